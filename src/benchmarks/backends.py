@@ -0,0 +1,85 @@
+import os
+import sys
+import glob
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import Tokenizer
+from parse import Parser
+from generator import Generator, ASSEMBLER
+from benchmarks.synthetic import write_source
+
+TESTS_DIRECTORY = os.path.normpath(os.path.join(__file__, "../../tests"))
+
+def compile_with(assembler: ASSEMBLER, file_path: str, output_path: str) -> float:
+    """
+    Compile a file with one backend, without any caches.
+
+    :return: The compile time in seconds.
+    """
+    start_time = time.perf_counter()
+
+    tokenizer = Tokenizer()
+    parser = Parser(tokenizer.stream(file_path), tokenizer.line_index)
+    program = Generator(assembler=assembler, use_cache=False).generate_assembly_elf64(parser.stream())
+    program.compile(output_path)
+
+    return time.perf_counter() - start_time
+
+def run(executable_path: str) -> tuple[int, bytes]:
+    result = subprocess.run([executable_path], stdout=subprocess.PIPE)
+    return result.returncode, result.stdout
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Check that the ELF64 backend builds programs that behave exactly like the NASM ones, and compare compile times')
+    arg_parser.add_argument('file_paths', type=str, nargs='*', help=f'Programs to compare (default: every .pnda file in {TESTS_DIRECTORY})')
+    arg_parser.add_argument('--synthetic', type=int, nargs='*', default=[1_000, 100_000], metavar='BYTES', help='Sizes of generated programs to compare as well')
+    arg_parser.add_argument('--seed', type=int, default=0, help='Seed for the generated programs')
+
+    args = arg_parser.parse_args()
+
+    assemblers = [ASSEMBLER.ELF64]
+    if shutil.which("nasm") is not None and shutil.which("ld") is not None:
+        assemblers.insert(0, ASSEMBLER.NASM)
+    else:
+        print("nasm or ld was not found, only the ELF64 backend will be timed and nothing can be compared")
+
+    file_paths = args.file_paths or sorted(glob.glob(os.path.join(TESTS_DIRECTORY, '**', '*.pnda'), recursive=True))
+
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.synthetic:
+            file_paths.append(write_source(os.path.join(tmp_dir, f"synthetic_{size}.pnda"), size, args.seed))
+
+        header = f"{'program':<40}" + "".join(f"{assembler.name + ' (s)':>12}" for assembler in assemblers) + f"{'result':>10}"
+        print(header)
+
+        for file_path in file_paths:
+            timings = []
+            results = []
+            for assembler in assemblers:
+                output_path = os.path.join(tmp_dir, f"{os.path.splitext(os.path.basename(file_path))[0]}_{assembler.name.lower()}")
+                timings.append(compile_with(assembler, file_path, output_path))
+                results.append(run(output_path))
+
+            if len(results) == 1:
+                verdict = "n/a"
+            elif all(result == results[0] for result in results):
+                verdict = "same"
+            else:
+                verdict = "DIFFERENT"
+                mismatches += 1
+
+            print(f"{os.path.basename(file_path):<40}" + "".join(f"{timing:>12.4f}" for timing in timings) + f"{verdict:>10}")
+
+    if mismatches > 0:
+        print(f"{mismatches} programs behaved differently between backends")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import struct
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import Tokenizer
+from parse import Parser
+from optimizer import Optimizer
+from generator import Generator, ASSEMBLER
+from benchmarks.synthetic import write_source
+from benchmarks.suite import DEFAULT_MIXES, best_time
+
+# (name, optimization level, optimize for size)
+MODES = [("-O1", 1, False), ("-O2", 2, False), ("-Os", 2, True)]
+
+PT_LOAD = 1
+PF_X = 1
+
+def text_size(executable_path: str) -> int:
+    """
+    Bytes of executable code in an ELF64 executable, the file size of its executable segments.
+    """
+    with open(executable_path, 'rb') as f:
+        data = f.read()
+
+    program_header_offset, = struct.unpack_from("<Q", data, 0x20)
+    program_header_size, program_header_count = struct.unpack_from("<HH", data, 0x36)
+
+    size = 0
+    for i in range(program_header_count):
+        segment_type, flags, _, _, _, file_size = struct.unpack_from("<IIQQQQ", data, program_header_offset + i * program_header_size)
+        if segment_type == PT_LOAD and flags & PF_X: size += file_size
+
+    return size
+
+def compile_mode(path: str, output_path: str, assembler: ASSEMBLER, optimization_level: int, optimize_size: bool) -> str:
+    """
+    :return: The -v line telling which builtins were inlined.
+    """
+    tokenizer = Tokenizer()
+    ast_nodes = Optimizer(optimization_level).optimize(Parser(tokenizer.stream(path), tokenizer.line_index).stream())
+
+    program_generator = Generator(assembler=assembler, use_cache=False, optimization_level=optimization_level, optimize_size=optimize_size)
+    program_generator.generate_assembly_elf64(ast_nodes).compile(output_path)
+
+    return program_generator.report_builtins()
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Compare the text size and runtime of programs built with -O1, -O2 and -Os')
+    arg_parser.add_argument('--mixes', nargs='+', default=DEFAULT_MIXES, help='Statement mixes of the generated programs')
+    arg_parser.add_argument('--size', type=int, default=256 * 1024, help='Size of each generated program in bytes')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Number of runs per binary, the best one is reported')
+    arg_parser.add_argument('--seed', type=int, default=0, help='Seed of the generated programs')
+    arg_parser.add_argument('--assembler', choices=['nasm', 'elf64'], default='nasm', help='Backend used to build the programs')
+    arg_parser.add_argument('-v', action='store_true', help='Print which builtins each mode inlined')
+
+    args = arg_parser.parse_args()
+    assembler = ASSEMBLER[args.assembler.upper()]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'mix':>16} {'mode':>5} {'text (bytes)':>13} {'vs -O1':>8} {'run (ms)':>9} {'vs -O1':>8}")
+        for mix in args.mixes:
+            path = write_source(os.path.join(tmp_dir, f"{mix}.pnda"), args.size, args.seed, mix)
+            baseline = None
+
+            for name, optimization_level, optimize_size in MODES:
+                output_path = os.path.join(tmp_dir, f"{mix}{name}")
+                builtins = compile_mode(path, output_path, assembler, optimization_level, optimize_size)
+                size = text_size(output_path)
+                elapsed = best_time(lambda: subprocess.run([output_path], stdout=subprocess.DEVNULL), args.repeat)
+                if baseline is None: baseline = (size, elapsed)
+
+                print(f"{mix:>16} {name:>5} {size:>13} {(size / baseline[0] - 1) * 100:>+7.1f}% {elapsed * 1000:>9.3f} {(elapsed / baseline[1] - 1) * 100:>+7.1f}%")
+                if args.v: print(f"{'':>23}{builtins}")
+
+if __name__ == '__main__':
+    main()
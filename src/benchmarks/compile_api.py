@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+import generator
+from compiler import CompilerPool, compile_source
+from benchmarks.synthetic import generate_source
+from benchmarks.suite import best_time
+
+def compile_unpooled(source: bytes, assembler: generator.ASSEMBLER) -> None:
+    """
+    Compile through compile_source with every per-process cache emptied first, like the first compile of a process.
+    """
+    generator.filter_builtins.cache_clear()
+    generator.assemble_builtins_object.cache_clear()
+    generator.BUILTINS_INCLUDE_CACHE.clear()
+
+    result = compile_source(source, assembler=assembler, pool=CompilerPool())
+    if not result.ok: raise RuntimeError("\n".join(result.diagnostics))
+
+def compile_pooled(source: bytes, assembler: generator.ASSEMBLER, pool: CompilerPool) -> None:
+    result = compile_source(source, assembler=assembler, pool=pool)
+    if not result.ok: raise RuntimeError("\n".join(result.diagnostics))
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Compare compile_source latency with and without the compiler pool, and its throughput across threads')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[256, 4096, 65536], help='Sizes of the compiled programs in bytes')
+    arg_parser.add_argument('--threads', type=int, nargs='+', default=[1, 4], help='Numbers of threads compiling at once')
+    arg_parser.add_argument('--count', type=int, default=64, help='Number of programs compiled per thread count')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Number of runs per measurement, the best one is reported')
+    arg_parser.add_argument('--assembler', choices=['nasm', 'elf64'], default='elf64', help='Backend used to build the programs')
+
+    args = arg_parser.parse_args()
+    assembler = generator.ASSEMBLER[args.assembler.upper()]
+
+    print(f"{'size (bytes)':>12} {'unpooled (ms)':>14} {'pooled (ms)':>12} {'speedup':>8}")
+    for size in args.sizes:
+        source = generate_source(size, mix="mixed").encode()
+        pool = CompilerPool()
+        pool.warm(assembler)
+
+        unpooled = best_time(lambda: compile_unpooled(source, assembler), args.repeat)
+        pooled = best_time(lambda: compile_pooled(source, assembler, pool), args.repeat)
+        print(f"{size:>12} {unpooled * 1000:>14.3f} {pooled * 1000:>12.3f} {unpooled / pooled:>7.1f}x")
+
+    sources = [generate_source(args.sizes[0], seed, "mixed").encode() for seed in range(args.count)]
+    print()
+    print(f"{'threads':>12} {'compiles/s':>14} {'compilers':>12}")
+    for threads in args.threads:
+        pool = CompilerPool()
+        pool.warm(assembler)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            start_time = time.perf_counter()
+            list(executor.map(lambda source: compile_pooled(source, assembler, pool), sources))
+            elapsed = time.perf_counter() - start_time
+
+        print(f"{threads:>12} {len(sources) / elapsed:>14.1f} {pool.created:>12}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+import client
+from benchmarks.synthetic import write_source
+from benchmarks.suite import best_time
+
+SOURCE_DIRECTORY = os.path.normpath(os.path.join(__file__, "../../"))
+
+def start_daemon(socket_path: str) -> subprocess.Popen:
+    daemon = subprocess.Popen([sys.executable, os.path.join(SOURCE_DIRECTORY, "daemon.py"), "--socket", socket_path], stdout=subprocess.DEVNULL)
+
+    # The socket only appears once the compiler is warm
+    while not os.path.exists(socket_path):
+        if daemon.poll() is not None: raise RuntimeError("The daemon exited before it was listening")
+        time.sleep(0.01)
+
+    return daemon
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Compare the latency of cold panda.py compiles with compiles by a warm daemon')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[256, 16 * 1024], help='Sizes of the compiled programs in bytes')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Number of runs per measurement, the best one is reported')
+
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "daemon.sock")
+        daemon = start_daemon(socket_path)
+
+        try:
+            print(f"{'size (bytes)':>12} {'cold (ms)':>10} {'client (ms)':>12} {'request (ms)':>13} {'unchanged (ms)':>15}")
+            for size in args.sizes:
+                path = write_source(os.path.join(tmp_dir, f"program_{size}.pnda"), size, mix="mixed")
+
+                cold = best_time(lambda: subprocess.run([sys.executable, os.path.join(SOURCE_DIRECTORY, "panda.py"), "--assembler", "elf64", "--no-cache", path], stdout=subprocess.DEVNULL, check=True), args.repeat)
+                # The thin client's own interpreter startup included, like running it from a shell
+                thin_client = best_time(lambda: subprocess.run([sys.executable, os.path.join(SOURCE_DIRECTORY, "client.py"), "--socket", socket_path, "--force", path], stdout=subprocess.DEVNULL, check=True), args.repeat)
+                forced = best_time(lambda: client.request({"command": "compile", "files": [path], "force": True}, socket_path), args.repeat)
+                unchanged = best_time(lambda: client.request({"command": "compile", "files": [path]}, socket_path), args.repeat)
+
+                print(f"{size:>12} {cold * 1000:>10.3f} {thin_client * 1000:>12.3f} {forced * 1000:>13.3f} {unchanged * 1000:>15.3f}")
+        finally:
+            client.request({"command": "stop"}, socket_path)
+            daemon.wait()
+
+if __name__ == '__main__':
+    main()
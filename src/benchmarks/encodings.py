@@ -0,0 +1,211 @@
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from elf64 import BASE_ADDRESS, PAGE_SIZE, SourceAssembler, ELF64Executable
+
+# Where ELF64Executable puts .text, nasm -f bin is given the same origin so addresses agree
+TEXT_ADDRESS = BASE_ADDRESS + PAGE_SIZE
+
+REGISTERS = {
+    64: ["rax", "rcx", "rbx", "rsp", "rbp", "rsi", "r8", "r12", "r13", "r15"],
+    32: ["eax", "ecx", "esp", "ebp", "edi", "r9d", "r12d", "r13d"],
+    16: ["ax", "cx", "sp", "r10w"],
+    8: ["al", "cl", "bl", "spl", "sil", "dil", "r11b", "r12b"],
+}
+
+# Every kind of ModRM and SIB the encoder picks between: no displacement, disp8, disp32, rsp and r12
+# as a base (SIB), rbp and r13 as a base (forced displacement), index registers and scales,
+# no base at all, and labels before and after the instruction. A plain [label] is left out, it is
+# rip-relative in elf64.py and absolute in nasm unless `default rel` is given, on purpose
+ADDRESSES = [
+    "[rax]", "[rsp]", "[rbp]", "[r12]", "[r13]", "[r15]",
+    "[rax + 8]", "[rsp + 8]", "[rbp - 8]", "[r13 + 127]", "[rcx - 128]", "[rdx + 128]", "[rsi - 129]", "[rdi + 0x12345]",
+    "[rax + rcx]", "[rax + rcx*2]", "[rbx + rdx*4 + 16]", "[r8 + r9*8 - 4096]", "[rsp + rax*8]", "[rbp + r12]", "[r13 + rsi*2]",
+    "[rcx*8]", "[r10*4 + 64]",
+    "[rax + .forward]", "[rbx + rcx*4 + .backward]", "[rel .backward]", "[rel .forward + 8]",
+]
+
+IMMEDIATES = [0, 1, 127, 128, 255, -1, -128, -129, 0x7FFF, 0x8000, -0x8000, 0x7FFFFFFF, 0x80000000, 0xFFFFFFFF, -0x80000000, 0x100000000, -0x80000001, 0x7FFFFFFFFFFFFFFF]
+
+SIZE_KEYWORDS = {8: "byte", 16: "word", 32: "dword", 64: "qword"}
+
+def fits(value: int, size: int, signed_only: bool = False) -> bool:
+    # nasm takes both the signed and the unsigned range for an immediate of size bits
+    if signed_only: return -2 ** (size - 1) <= value < 2 ** (size - 1)
+    return -2 ** (size - 1) <= value < 2 ** size
+
+def immediates(size: int, signed_only: bool = False) -> list[int]:
+    # Immediates wider than 32 bits are sign extended, only mov to a register takes 64 bits
+    return [value for value in IMMEDIATES if fits(value, min(size, 32), signed_only or size == 64)]
+
+def encoding_cases() -> list[str]:
+    """
+    One line of assembly per case, covering every encoder of the Assembler with the operand forms
+    the generator and builtins use, and the edge cases of each.
+
+    Symbols as immediates are left out, nasm -f bin knows their values and picks the encoding for
+    a constant, which nasm -f elf64 can't. benchmarks.backends checks them in real programs.
+    """
+    cases = []
+
+    for mnemonic in ["mov", "add", "or", "adc", "sbb", "and", "sub", "xor", "cmp", "test"]:
+        for size, registers in REGISTERS.items():
+            cases += [f"{mnemonic} {destination}, {source}" for destination in registers for source in registers[:3]]
+            cases += [f"{mnemonic} {registers[0]}, {address}" for address in ADDRESSES if mnemonic != "test"]
+            cases += [f"{mnemonic} {address}, {registers[-1]}" for address in ADDRESSES]
+            cases += [f"{mnemonic} {SIZE_KEYWORDS[size]} {address}, {value}" for address in ADDRESSES[::4] for value in immediates(size)]
+            # mov is the only instruction with a 64-bit immediate
+            register_immediates = [value for value in IMMEDIATES if fits(value, size)] if mnemonic == "mov" else immediates(size)
+            cases += [f"{mnemonic} {register}, {value}" for register in registers for value in register_immediates]
+
+    for mnemonic in ["movzx", "movsx"]:
+        for size in (64, 32, 16):
+            cases += [f"{mnemonic} {destination}, {source}" for destination in REGISTERS[size][::2] for source in REGISTERS[8][::2]]
+            cases += [f"{mnemonic} {REGISTERS[size][0]}, byte {address}" for address in ADDRESSES[::3]]
+        for size in (64, 32):
+            cases += [f"{mnemonic} {destination}, {source}" for destination in REGISTERS[size][::2] for source in REGISTERS[16]]
+            cases += [f"{mnemonic} {REGISTERS[size][-1]}, word {address}" for address in ADDRESSES[::3]]
+
+    cases += [f"lea {register}, {address}" for register in REGISTERS[64] + REGISTERS[32][:2] for address in ADDRESSES]
+
+    for mnemonic in ["inc", "dec", "not", "neg", "mul", "div", "idiv", "imul"]:
+        for size, registers in REGISTERS.items():
+            cases += [f"{mnemonic} {register}" for register in registers]
+            cases += [f"{mnemonic} {SIZE_KEYWORDS[size]} {address}" for address in ADDRESSES[::3]]
+
+    for size in (64, 32, 16):
+        registers = REGISTERS[size]
+        cases += [f"imul {destination}, {source}" for destination in registers for source in registers[:3]]
+        cases += [f"imul {registers[0]}, {address}" for address in ADDRESSES[::2]]
+        cases += [f"imul {register}, {value}" for register in registers[:3] for value in immediates(size, signed_only=True)]
+        cases += [f"imul {registers[1]}, {address}, {value}" for address in ADDRESSES[::5] for value in immediates(size, signed_only=True)[::2]]
+
+    for mnemonic in ["shl", "sal", "shr", "sar", "rol", "ror"]:
+        for size, registers in REGISTERS.items():
+            cases += [f"{mnemonic} {register}, {count}" for register in registers for count in ("cl", 1, 7, 63 if size == 64 else 31)]
+            cases += [f"{mnemonic} {SIZE_KEYWORDS[size]} {address}, {count}" for address in ADDRESSES[::5] for count in ("cl", 3)]
+
+    for condition in ["o", "no", "b", "ae", "e", "ne", "z", "nz", "be", "a", "s", "ns", "p", "np", "l", "ge", "le", "g", "c", "nc"]:
+        cases += [f"set{condition} {register}" for register in REGISTERS[8][::2]]
+        cases += [f"set{condition} byte {ADDRESSES[1]}"]
+        cases += [f"cmov{condition} {destination}, {source}" for destination, source in (("rax", "rcx"), ("r8", "rbx"), ("ecx", "r13d"), ("ax", "r10w"))]
+        cases += [f"cmov{condition} rdx, {address}" for address in ADDRESSES[::7]]
+        # The Assembler always encodes 32-bit displacements, which nasm only keeps for near jumps
+        cases += [f"j{condition} near {target}" for target in (".backward", ".forward")]
+
+    cases += [f"{mnemonic} {register}" for mnemonic in ("push", "pop") for register in REGISTERS[64] + ["r9", "r11", "r14"]]
+    cases += [f"{mnemonic} {target}" for mnemonic in ("jmp", "call") for target in ["near .backward", "near .forward", "rax", "r12", "qword [rax]", "qword [rsp + 8]", "qword [r13 + rcx*8]"]]
+    cases += ["ret", "syscall", "cqo", "nop", "movsb", "rep movsb"]
+
+    return cases
+
+# Each case gets a slot of its own, aligned the same way by both assemblers, so a case that encodes
+# to a different length doesn't shift the ones after it
+SLOT_SIZE = 32
+FILLER = 0xCC
+
+def case_source(number: int, case: str) -> str:
+    # Labels on both sides, so branches and addresses are resolved backward and forward
+    return f"case_{number}:\n.backward:\n    nop\n    {case}\n    nop\n.forward:\n"
+
+def assemble_elf64(cases: list[str]) -> bytes:
+    """
+    :return: The .text of the cases as elf64.py lays it out, with every fixup applied.
+    """
+    lines = []
+    for number, case in enumerate(cases):
+        lines.append(case_source(number, case))
+
+        # Lengths don't depend on where a case ends up, only the values of its fixups do
+        length = len(SourceAssembler().assemble(case_source(number, case)).sections["text"])
+        if length < SLOT_SIZE: lines.append(f"db {', '.join([str(FILLER)] * (SLOT_SIZE - length))}\n")
+
+    executable = ELF64Executable(SourceAssembler().assemble("".join(lines)))
+    executable.layout()
+    return bytes(executable.apply_fixups()["text"])
+
+def assemble_nasm(cases: list[str], tmp_dir: str) -> tuple[bytes | None, dict[int, str]]:
+    """
+    Assemble the cases with nasm -f bin at the address .text is linked at.
+
+    :return: The bytes, or None when nasm rejected any case, and nasm's errors by case number.
+    """
+    asm_path = os.path.join(tmp_dir, "cases.asm")
+    bin_path = os.path.join(tmp_dir, "cases.bin")
+
+    with open(asm_path, 'w') as asm_file:
+        asm_file.write(f"bits 64\norg {TEXT_ADDRESS:#x}\n")
+        for number, case in enumerate(cases):
+            asm_file.write(f"align {SLOT_SIZE}, db {FILLER}\n" + case_source(number, case))
+
+    result = subprocess.run(["nasm", "-f", "bin", "-o", bin_path, asm_path], stderr=subprocess.PIPE, text=True)
+
+    errors = {}
+    for line in result.stderr.splitlines():
+        match = re.match(rf"{re.escape(asm_path)}:(\d+): (?:error|fatal): (.*)", line)
+        # Two lines of header, then seven lines per case
+        if match: errors[(int(match.group(1)) - 3) // 7] = match.group(2)
+    if result.returncode != 0:
+        if not errors: raise RuntimeError(f"nasm failed: {result.stderr.strip()}")
+        return None, errors
+
+    with open(bin_path, 'rb') as bin_file:
+        return bin_file.read(), errors
+
+def compare(cases: list[str]) -> tuple[list[tuple[str, bytes, bytes]], dict[str, str]]:
+    """
+    :return: (case, elf64 bytes, nasm bytes) for every case that encodes differently, and nasm's
+             errors by case, those cases are left out of the comparison.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reference, errors = assemble_nasm(cases, tmp_dir)
+        if reference is None:
+            # Leave out what nasm doesn't take and compare the rest
+            errors = {cases[number]: message for number, message in errors.items()}
+            cases = [case for case in cases if case not in errors]
+            reference, _ = assemble_nasm(cases, tmp_dir)
+        else:
+            errors = {}
+
+    ours = assemble_elf64(cases)
+
+    differences = []
+    for number, case in enumerate(cases):
+        slot = slice(number * SLOT_SIZE, (number + 1) * SLOT_SIZE)
+        mine, theirs = ours[slot].rstrip(bytes([FILLER])), reference[slot].rstrip(bytes([FILLER]))
+        if mine != theirs: differences.append((case, mine, theirs))
+
+    return differences, errors
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description="Check that elf64.py encodes every instruction it supports to the same bytes as nasm")
+    arg_parser.add_argument('--filter', type=str, default=None, help='Only check the cases whose text contains this')
+    arg_parser.add_argument('--show', type=int, default=40, help='Number of differing cases to print')
+
+    args = arg_parser.parse_args()
+
+    if shutil.which("nasm") is None:
+        print("nasm was not found, there is nothing to compare the encodings with")
+        sys.exit(2)
+
+    cases = [case for case in encoding_cases() if args.filter is None or args.filter in case]
+    differences, errors = compare(cases)
+
+    for case, message in errors.items(): print(f"{case:<40} nasm error: {message}")
+    for case, mine, theirs in differences[:args.show]:
+        # The nop on either side of the case is left in, it shows where the instruction starts and ends
+        print(f"{case:<40} elf64 {mine.hex(' ')}\n{'':<40} nasm  {theirs.hex(' ')}")
+
+    compared = len(cases) - len(errors)
+    print(f"{compared - len(differences)} of {compared} instructions encode to the same bytes as nasm")
+    if differences or errors: sys.exit(1)
+
+if __name__ == '__main__':
+    main()
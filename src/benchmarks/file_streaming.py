@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+import generator
+from tokenizer import Tokenizer
+from parse import Parser
+
+def write_data(path: str, megabytes: int) -> None:
+    with open(path, 'wb') as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(megabytes):
+            f.write(block)
+
+def compile_cat(path: str, data_path: str, zero_copy: bool, assembler: generator.ASSEMBLER) -> str:
+    """
+    Compile a program that writes data_path to stdout with cat and return the executable path.
+    """
+    with open(path, 'w') as f:
+        f.write(f'cat("{data_path}");\n')
+
+    generator.ZERO_COPY_FILES = zero_copy
+
+    tokenizer = Tokenizer()
+    program = generator.Generator(assembler=assembler, use_cache=False).generate_assembly_elf64(Parser(tokenizer.stream(path), tokenizer.line_index).stream())
+    output_path = os.path.splitext(path)[0]
+    program.compile(output_path)
+
+    return output_path
+
+def measure_runtime(executable_path: str, output_path: str, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        with open(output_path, 'wb') as output:
+            start_time = time.perf_counter()
+            subprocess.run([executable_path], stdout=output, check=True)
+            best = min(best, time.perf_counter() - start_time)
+
+    return best
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Compare the throughput of cat with sendfile and mmap against a read and write loop')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=[1, 16, 256], help='Sizes of the copied files in MiB')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Number of runs per binary, the best one is reported')
+    arg_parser.add_argument('--assembler', choices=['nasm', 'elf64'], default='nasm', help='Backend used to build the programs')
+
+    args = arg_parser.parse_args()
+    assembler = generator.ASSEMBLER[args.assembler.upper()]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "output")
+
+        print(f"{'size (MiB)':>10} {'mode':>10} {'time (s)':>10} {'MiB/s':>10}")
+        for size in args.sizes:
+            data_path = os.path.join(tmp_dir, f"data_{size}.bin")
+            write_data(data_path, size)
+
+            for mode, zero_copy in [("read loop", False), ("zero copy", True)]:
+                executable_path = compile_cat(os.path.join(tmp_dir, f"{mode.replace(' ', '_')}_{size}.pnda"), data_path, zero_copy, assembler)
+                elapsed = measure_runtime(executable_path, output_path, args.repeat)
+                if os.path.getsize(output_path) != os.path.getsize(data_path):
+                    raise RuntimeError(f"{mode} wrote {os.path.getsize(output_path)} bytes of a {size} MiB file")
+
+                print(f"{size:>10} {mode:>10} {elapsed:>10.4f} {size / elapsed:>10.1f}")
+
+            os.remove(data_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+import generator
+from tokenizer import Tokenizer
+from parse import Parser
+
+def compile_prints(path: str, prints: int, buffer_output: bool) -> str:
+    """
+    Compile a program made of `prints` print statements and return the executable path.
+    """
+    with open(path, 'w') as f:
+        for i in range(prints):
+            f.write(f'print("line {i % 1000}");\n')
+
+    generator.BUFFER_OUTPUT = buffer_output
+
+    tokenizer = Tokenizer()
+    program = generator.Generator().generate_assembly_elf64(Parser(tokenizer.stream(path), tokenizer.line_index).stream())
+    output_path = os.path.splitext(path)[0]
+    program.compile(output_path)
+
+    return output_path
+
+def count_write_syscalls(executable_path: str) -> int | None:
+    """
+    Count the write syscalls made by a program using strace -c, None when strace isn't installed.
+    """
+    if shutil.which("strace") is None: return None
+
+    result = subprocess.run(["strace", "-c", "-f", "-e", "trace=write", executable_path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    match = re.search(r"^\s*[\d.]+\s+[\d.]+\s+\d+\s+(\d+)\s+(?:\d+\s+)?write$", result.stderr, re.MULTILINE)
+
+    return int(match.group(1)) if match else 0
+
+def measure_runtime(executable_path: str, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run([executable_path], stdout=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start_time)
+
+    return best
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Compare write syscalls and runtime of unbuffered and buffered print')
+    arg_parser.add_argument('--prints', type=int, nargs='+', default=[1_000, 10_000, 100_000], help='Number of print statements per program')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='Number of runs per binary, the best one is reported')
+
+    args = arg_parser.parse_args()
+
+    if shutil.which("strace") is None:
+        print("strace was not found, syscall counts will not be reported")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'prints':>8} {'mode':>11} {'writes':>8} {'time (s)':>10}")
+        for prints in args.prints:
+            for mode, buffer_output in [("unbuffered", False), ("buffered", True)]:
+                executable_path = compile_prints(os.path.join(tmp_dir, f"{mode}_{prints}.pnda"), prints, buffer_output)
+                writes = count_write_syscalls(executable_path)
+                elapsed = measure_runtime(executable_path, args.repeat)
+                print(f"{prints:>8} {mode:>11} {'n/a' if writes is None else writes:>8} {elapsed:>10.4f}")
+
+if __name__ == '__main__':
+    main()
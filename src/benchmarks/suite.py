@@ -0,0 +1,233 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import platform
+import tempfile
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import Tokenizer
+from parse import Parser
+from generator import Generator, ASSEMBLER
+from version import VERSION
+from benchmarks.synthetic import MIXES, write_source
+
+PANDA_PATH = os.path.normpath(os.path.join(__file__, "../../panda.py"))
+RESULTS_DIRECTORY = os.path.normpath(os.path.join(__file__, "../results"))
+
+DEFAULT_MIXES = ["prints", "integers", "long_strings", "escaped_strings", "mixed", "arithmetic"]
+
+class Metric:
+    """
+    One measured number, with the direction that counts as an improvement.
+    """
+    def __init__(self, value: float, unit: str, higher_is_better: bool) -> None:
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+
+    def to_dict(self) -> dict:
+        return {"value": self.value, "unit": self.unit, "higher_is_better": self.higher_is_better}
+
+def best_time(function, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start_time)
+
+    return best
+
+def measure_frontend(path: str, assembler: ASSEMBLER, repeat: int) -> dict[str, Metric]:
+    """
+    Throughput of the tokenizer, the parser and code generation, each measured on its own.
+    """
+    megabytes = os.path.getsize(path) / (1024 * 1024)
+
+    tokenizer = Tokenizer()
+    tokens = tokenizer.tokenize(path)
+    ast_nodes = Parser(tokens, tokenizer.line_index).parse()
+
+    tokenize_time = best_time(lambda: Tokenizer().tokenize(path), repeat)
+    parse_time = best_time(lambda: Parser(tokens, tokenizer.line_index).parse(), repeat)
+    codegen_time = best_time(lambda: Generator(assembler=assembler, use_cache=False).generate_assembly_elf64(ast_nodes), repeat)
+
+    return {
+        "tokenize": Metric(round(megabytes / tokenize_time, 3), "MB/s", True),
+        "parse": Metric(round(megabytes / parse_time, 3), "MB/s", True),
+        "codegen": Metric(round(megabytes / codegen_time, 3), "MB/s", True),
+    }
+
+def measure_compile(path: str, assembler: ASSEMBLER, repeat: int, cache_directory: str) -> dict[str, Metric]:
+    """
+    End to end latency of panda.py, from scratch and when the build cache already holds the program.
+    """
+    environment = {**os.environ, "PANDA_CACHE_DIR": cache_directory}
+    command = [sys.executable, PANDA_PATH, "--assembler", assembler.name.lower(), path]
+
+    def compile_program(*extra_arguments):
+        subprocess.run(command[:2] + list(extra_arguments) + command[2:], check=True, stdout=subprocess.DEVNULL, env=environment)
+
+    cold_time = best_time(lambda: compile_program("--no-cache"), repeat)
+
+    compile_program()
+    warm_time = best_time(compile_program, repeat)
+
+    return {
+        "compile_cold": Metric(round(cold_time, 6), "s", False),
+        "compile_warm": Metric(round(warm_time, 6), "s", False),
+    }
+
+def count_syscalls(executable_path: str) -> tuple[int, int] | None:
+    """
+    Count the syscalls made by a program using strace -c.
+
+    :return: (total syscalls, write syscalls), or None when strace isn't installed.
+    """
+    if shutil.which("strace") is None: return None
+
+    result = subprocess.run(["strace", "-c", "-f", executable_path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    def calls(name):
+        match = re.search(rf"^\s*[\d.]+\s+[\d.]+\s+(?:\d+\s+)?(\d+)\s+(?:\d+\s+)?{name}$", result.stderr, re.MULTILINE)
+        return int(match.group(1)) if match else 0
+
+    return calls("total"), calls("write")
+
+def measure_runtime(path: str, assembler: ASSEMBLER, repeat: int) -> dict[str, Metric]:
+    """
+    Runtime and syscall counts of the executable built from path.
+    """
+    tokenizer = Tokenizer()
+    program = Generator(assembler=assembler, use_cache=False).generate_assembly_elf64(Parser(tokenizer.stream(path), tokenizer.line_index).stream())
+    output_path = os.path.splitext(path)[0]
+    program.compile(output_path)
+
+    metrics = {"run": Metric(round(best_time(lambda: subprocess.run([output_path], stdout=subprocess.DEVNULL), repeat), 6), "s", False)}
+
+    syscalls = count_syscalls(output_path)
+    if syscalls is not None:
+        metrics["syscalls"] = Metric(syscalls[0], "calls", False)
+        metrics["write_syscalls"] = Metric(syscalls[1], "calls", False)
+
+    return metrics
+
+def run_suite(mixes: list[str], size: int, assembler: ASSEMBLER, repeat: int, seed: int) -> dict:
+    """
+    Run every benchmark on a generated program of each mix.
+
+    :return: The results, metrics are named {mix}.{benchmark}.
+    """
+    metrics = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_directory = os.path.join(tmp_dir, "cache")
+
+        for mix in mixes:
+            path = write_source(os.path.join(tmp_dir, f"{mix}.pnda"), size, seed, mix)
+
+            for measure in (measure_frontend, measure_runtime):
+                for name, metric in measure(path, assembler, repeat).items():
+                    metrics[f"{mix}.{name}"] = metric
+            for name, metric in measure_compile(path, assembler, repeat, cache_directory).items():
+                metrics[f"{mix}.{name}"] = metric
+
+            print(f"finished {mix}", file=sys.stderr)
+
+    return {
+        "compiler_version": VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "assembler": assembler.name.lower(),
+        "size": size,
+        "seed": seed,
+        "metrics": {name: metric.to_dict() for name, metric in metrics.items()},
+    }
+
+def threshold_for(name: str, default: float, overrides: list[tuple[str, float]]) -> float:
+    # The last matching pattern wins, so specific overrides can follow broad ones
+    threshold = default
+    for pattern, value in overrides:
+        if fnmatch.fnmatch(name, pattern): threshold = value
+
+    return threshold
+
+def compare(baseline: dict, results: dict, default_threshold: float, overrides: list[tuple[str, float]]) -> list[str]:
+    """
+    Print how every metric changed since the baseline.
+
+    :return: The names of the metrics that got worse by more than their threshold, in percent.
+    """
+    regressions = []
+
+    print(f"{'metric':<32} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, current in results["metrics"].items():
+        previous = baseline["metrics"].get(name)
+        if previous is None or previous["value"] == 0:
+            print(f"{name:<32} {'-':>12} {current['value']:>12} {'new':>9}")
+            continue
+
+        change = (current["value"] - previous["value"]) / previous["value"] * 100
+        worse_by = -change if current["higher_is_better"] else change
+        regressed = worse_by > threshold_for(name, default_threshold, overrides)
+        if regressed: regressions.append(name)
+
+        print(f"{name:<32} {previous['value']:>12} {current['value']:>12} {change:>+8.1f}%{'  REGRESSION' if regressed else ''}")
+
+    return regressions
+
+def parse_override(text: str) -> tuple[str, float]:
+    pattern, _, value = text.rpartition("=")
+    if not pattern: raise argparse.ArgumentTypeError(f"Expected PATTERN=PERCENT, got '{text}'")
+    return pattern, float(value)
+
+def resolve_results_path(name: str) -> str:
+    """
+    Names without a directory or extension refer to files in benchmarks/results/.
+    """
+    if os.path.dirname(name) or name.endswith(".json"): return name
+    return os.path.join(RESULTS_DIRECTORY, f"{name}.json")
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Run the compiler benchmark suite on generated programs, and compare with earlier results')
+    arg_parser.add_argument('--mixes', type=str, nargs='+', default=DEFAULT_MIXES, choices=list(MIXES), help='Kinds of programs to generate, see benchmarks/synthetic.py')
+    arg_parser.add_argument('--size', type=int, default=256 * 1024, help='Size of each generated program, in bytes')
+    arg_parser.add_argument('--seed', type=int, default=0, help='Seed for the generated programs')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='Number of runs per measurement, the best one is kept')
+    arg_parser.add_argument('--assembler', choices=[assembler.name.lower() for assembler in ASSEMBLER], default='nasm', help='Backend to build the programs with')
+    arg_parser.add_argument('--save', type=str, metavar='NAME', help='Store the results as benchmarks/results/NAME.json, or at NAME if it is a path')
+    arg_parser.add_argument('--baseline', type=str, metavar='NAME', help='Compare with stored results, exiting with 1 on a regression')
+    arg_parser.add_argument('--threshold', type=float, default=10.0, help='Percentage a metric may get worse by before it counts as a regression (default: 10)')
+    arg_parser.add_argument('--threshold-for', type=parse_override, action='append', default=[], metavar='PATTERN=PERCENT', help='Threshold for the metrics matching a glob pattern, e.g. "*.run=25"')
+
+    args = arg_parser.parse_args()
+
+    results = run_suite(args.mixes, args.size, ASSEMBLER[args.assembler.upper()], args.repeat, args.seed)
+
+    if args.save:
+        path = resolve_results_path(args.save)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"Results stored in {path}")
+
+    if args.baseline:
+        with open(resolve_results_path(args.baseline), 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compare(baseline, results, args.threshold, args.threshold_for)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed: {', '.join(regressions)}")
+            sys.exit(1)
+    elif not args.save:
+        print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
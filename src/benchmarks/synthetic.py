@@ -0,0 +1,89 @@
+import random
+
+STRING_CHARACTERS = "abcdefghijklmnopqrstuvwxyz ,.!"
+
+# Relative weights of each kind of statement, by mix name
+MIXES = {
+    "default": {"print": 90, "exit": 10},
+    "prints": {"print": 1},
+    "integers": {"print_int": 1},
+    "long_strings": {"long_string": 1},
+    "escaped_strings": {"escaped_string": 1},
+    "exits": {"exit": 1},
+    "mixed": {"print": 60, "print_int": 20, "long_string": 5, "escaped_string": 10, "exit": 5},
+    "arithmetic": {"arithmetic": 3, "print_variable": 1},
+}
+
+def generate_statement(kind: str, rng: random.Random, index: int, variables: list[str] = None) -> str:
+    """
+    Generate one statement of the given kind.
+
+    :param kind: One of the statement kinds used as keys in MIXES.
+    :param rng: The random generator to draw from.
+    :param index: The number of statements generated before this one, used to name variables.
+    :param variables: The variables declared so far, new declarations are appended to it.
+    """
+    variables = variables if variables is not None else []
+
+    if kind == "print":
+        text = ''.join(rng.choice(STRING_CHARACTERS) for _ in range(rng.randint(1, 40)))
+        return f'print("{text}");\n'
+    if kind == "long_string":
+        text = ''.join(rng.choice(STRING_CHARACTERS) for _ in range(rng.randint(200, 2000)))
+        return f'print("{text}");\n'
+    if kind == "escaped_string":
+        text = ''.join(rng.choice(STRING_CHARACTERS) if rng.random() < 0.7 else rng.choice(['\\"', '\\\\', "\\'"]) for _ in range(rng.randint(1, 40)))
+        return f'print("{text}");\n'
+    if kind == "print_variable" and variables:
+        return f'print({rng.choice(variables)});\n'
+    if kind in ("print_int", "print_variable"):
+        return f'print({rng.randint(0, 2 ** 63 - 1) if rng.random() < 0.2 else rng.randint(0, 100_000)});\n'
+    if kind == "exit":
+        return f'exit({rng.randint(0, 255)});\n'
+    if kind == "arithmetic":
+        # Operands refer to earlier variables when there are any, divisors are nonzero constants
+        operands = [rng.choice(variables) if variables and rng.random() < 0.5 else str(rng.randint(0, 1000)) for _ in range(rng.randint(2, 6))]
+        expression = operands[0] + ''.join(f" / {rng.randint(1, 1000)}" if rng.random() < 0.2 else f" {rng.choice('+-*')} {operand}" for operand in operands[1:])
+        variables.append(f"x{index}")
+        return f'let x{index} = {expression};\n'
+
+    raise ValueError(f"Unknown statement kind {kind}")
+
+def generate_source(target_bytes: int, seed: int = 0, mix: str | dict = "default") -> str:
+    """
+    Generate a syntactically valid Panda program of roughly the requested size.
+
+    :param target_bytes: The approximate size of the generated source in bytes.
+    :param seed: Seed for the random generator so runs are reproducible.
+    :param mix: The name of a mix in MIXES, or a dict of statement kinds to relative weights.
+    :return: The generated Panda source code.
+    """
+    rng = random.Random(seed)
+    weights = MIXES[mix] if isinstance(mix, str) else mix
+    kinds = list(weights)
+    statements = []
+    variables = []
+    size = 0
+
+    while size < target_bytes:
+        statement = generate_statement(rng.choices(kinds, [weights[kind] for kind in kinds])[0], rng, len(statements), variables)
+
+        statements.append(statement)
+        size += len(statement)
+
+    return ''.join(statements)
+
+def write_source(path: str, target_bytes: int, seed: int = 0, mix: str | dict = "default") -> str:
+    """
+    Write a generated Panda program to disk.
+
+    :param path: Where to write the .pnda file.
+    :param target_bytes: The approximate size of the generated source in bytes.
+    :param seed: Seed for the random generator so runs are reproducible.
+    :param mix: The name of a mix in MIXES, or a dict of statement kinds to relative weights.
+    :return: The path that was written.
+    """
+    with open(path, 'w') as f:
+        f.write(generate_source(target_bytes, seed, mix))
+
+    return path
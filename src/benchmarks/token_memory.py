@@ -0,0 +1,63 @@
+import os
+import gc
+import sys
+import tempfile
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import Tokenizer, Tokens
+from benchmarks.synthetic import write_source
+
+class LegacyToken:
+    """The token layout before Tokens was array backed: a plain class with a per-instance __dict__"""
+    def __init__(self, type_, value=None, start=None, end=None) -> None:
+        self.type = type_
+        self.value = value
+        self.start = start
+        self.end = end
+
+def measure(build) -> int:
+    """
+    Return the number of bytes still allocated by the storage that build() returns.
+    """
+    gc.collect()
+    tracemalloc.start()
+    storage = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del storage
+
+    return current
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Compare bytes per token of the token storage layouts')
+    arg_parser.add_argument('--tokens', type=int, default=1_000_000, help='Approximate number of tokens to store')
+
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Generated statements average a little over 5.5 bytes per token
+        path = write_source(os.path.join(tmp_dir, "bench_tokens.pnda"), int(args.tokens * 5.6))
+
+        def build_legacy():
+            return [LegacyToken(token.type, token.value, token.start, token.end) for token in Tokenizer().stream(path)]
+
+        def build_slots():
+            return list(Tokenizer().stream(path))
+
+        def build_arrays():
+            tokens = Tokens()
+            for token in Tokenizer().stream(path): tokens.add_token(token)
+            return tokens
+
+        token_count = len(Tokenizer().tokenize(path))
+        print(f"{token_count} tokens")
+        print(f"{'layout':>28} {'bytes':>12} {'bytes/token':>12}")
+        for name, build in [("list of __dict__ tokens", build_legacy), ("list of __slots__ tokens", build_slots), ("Tokens (struct of arrays)", build_arrays)]:
+            allocated = measure(build)
+            print(f"{name:>28} {allocated:>12} {allocated / token_count:>12.1f}")
+
+if __name__ == '__main__':
+    main()
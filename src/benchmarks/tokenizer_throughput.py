@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import Tokenizer
+from benchmarks.synthetic import write_source
+from benchmarks.legacy_tokenizer import LegacyTokenizer
+
+def measure(path: str, repeat: int, tokenizer_class=Tokenizer) -> float:
+    """
+    Tokenize a file several times and return the best wall-clock time in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        tokenizer_class().tokenize(path)
+        best = min(best, time.perf_counter() - start_time)
+
+    return best
+
+def measure_trailing_whitespace(megabytes: float, repeat: int) -> float:
+    """
+    Tokenize one statement followed by megabytes of whitespace, which has to take linear time.
+    """
+    source = b'print("a");' + b' \n' * int(megabytes * 1024 * 1024 / 2)
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        Tokenizer().tokenize(source)
+        best = min(best, time.perf_counter() - start_time)
+
+    return best
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Measure tokenizer throughput on generated .pnda files')
+    arg_parser.add_argument('--sizes', type=float, nargs='+', default=[1, 2, 4, 8], help='Source sizes to generate, in MB')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='Number of runs per size, the best one is reported')
+
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The character at a time lexer from before the master pattern, on the same sources
+        print(f"{'size (MB)':>10} {'time (s)':>10} {'MB/s':>10} {'legacy (s)':>11} {'legacy MB/s':>12} {'speedup':>8}")
+        for size in args.sizes:
+            path = write_source(os.path.join(tmp_dir, f"bench_{size}.pnda"), int(size * 1024 * 1024))
+            megabytes = os.path.getsize(path) / (1024 * 1024)
+            elapsed = measure(path, args.repeat)
+            legacy_elapsed = measure(path, args.repeat, LegacyTokenizer)
+            print(f"{megabytes:>10.2f} {elapsed:>10.3f} {megabytes / elapsed:>10.2f} {legacy_elapsed:>11.3f} {megabytes / legacy_elapsed:>12.2f} {legacy_elapsed / elapsed:>7.2f}x")
+
+    # Trailing whitespace used to be rescanned from every position in it, taking quadratic time
+    print()
+    print(f"{'trailing whitespace (MB)':>24} {'time (s)':>10}")
+    for size in args.sizes:
+        print(f"{size:>24.2f} {measure_trailing_whitespace(size, args.repeat):>10.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import functools
+import tempfile
+import threading
+import subprocess
+
+def default_cache_directory() -> str:
+    """
+    $PANDA_CACHE_DIR if set, otherwise panda-lang/ under $XDG_CACHE_HOME or ~/.cache
+    """
+    if os.environ.get("PANDA_CACHE_DIR"): return os.environ["PANDA_CACHE_DIR"]
+
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "panda-lang")
+
+def hash_bytes(*parts: bytes | str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str): part = part.encode('utf-8')
+        # Length prefixes keep ("ab", "c") and ("a", "bc") from hashing the same
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+
+    return digest.hexdigest()
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+@functools.lru_cache(maxsize=1)
+def compiler_hash() -> str:
+    """
+    Hash the compiler's own modules, src/*.py, once per process.
+
+    VERSION only changes when someone remembers to bump it, this changes with every edit to the
+    compiler, so executables built by any other compiler never come back from the cache.
+    """
+    compiler_directory = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(glob.glob(os.path.join(compiler_directory, "*.py")))
+
+    return hash_bytes(*[part for path in paths for part in (os.path.basename(path), hash_file(path))])
+
+def tool_identity(name: str) -> str:
+    """
+    Identify an external tool by its resolved path, size and mtime, without running it.
+    """
+    path = shutil.which(name)
+    if path is None: return f"{name}-not-found"
+
+    stat = os.stat(path)
+    return f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def nasm_version(cache_directory: str) -> str:
+    """
+    Return the output of `nasm -v` without launching nasm on every call.
+
+    The version is remembered in the cache directory, keyed by the path, size and mtime of the
+    nasm binary found on PATH, so it is only looked up again when nasm itself changes.
+    """
+    nasm_path = shutil.which("nasm")
+    if nasm_path is None: return "nasm-not-found"
+
+    binary_key = tool_identity("nasm")
+    versions_path = os.path.join(cache_directory, "nasm-versions.json")
+
+    try:
+        with open(versions_path, 'r') as f:
+            versions = json.load(f)
+    except (OSError, ValueError):
+        versions = {}
+
+    if binary_key not in versions:
+        result = subprocess.run([nasm_path, "-v"], check=True, stdout=subprocess.PIPE, text=True)
+        versions[binary_key] = result.stdout.strip()
+
+        os.makedirs(cache_directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(versions, f)
+        os.replace(tmp_path, versions_path)
+
+    return versions[binary_key]
+
+class BuiltinsCache:
+    """
+    On-disk cache of the filtered builtins source and its assembled object.
+
+    Entries live in <cache directory>/builtins/<key>/ and are keyed by the raw builtins file,
+    the compiler's source, which filters it, the NASM version and the assembler flags, so
+    editing any of them simply misses the cache.
+    Entries are assembled in a temporary directory and renamed into place, which keeps
+    concurrent compiles from ever seeing a half written entry.
+    """
+    def __init__(self, cache_directory: str = None) -> None:
+        self.cache_directory = cache_directory or default_cache_directory()
+        self.entries_directory = os.path.join(self.cache_directory, "builtins")
+
+    def key(self, raw_source: bytes, assembler_flags: list[str]) -> str:
+        return hash_bytes(raw_source, compiler_hash(), nasm_version(self.cache_directory), *assembler_flags)
+
+    def entry_directory(self, key: str) -> str:
+        return os.path.join(self.entries_directory, key)
+
+    def lookup(self, key: str, program_name: str) -> str | None:
+        """
+        :return: The entry directory holding {program_name}.asm and {program_name}.o, or None on a miss.
+        """
+        directory = self.entry_directory(key)
+        if os.path.exists(os.path.join(directory, f"{program_name}.o")): return directory
+        return None
+
+    def store(self, key: str, program_name: str, assembly_source: str, assembler_flags: list[str]) -> str:
+        """
+        Assemble the builtins into a new cache entry.
+
+        :return: The entry directory.
+        """
+        os.makedirs(self.entries_directory, exist_ok=True)
+        tmp_directory = tempfile.mkdtemp(dir=self.entries_directory, prefix=".tmp-")
+
+        try:
+            asm_filename = os.path.join(tmp_directory, f"{program_name}.asm")
+            obj_filename = os.path.join(tmp_directory, f"{program_name}.o")
+
+            with open(asm_filename, 'w') as asm_file:
+                asm_file.write(assembly_source)
+
+            subprocess.run(["nasm", "-f", "elf64"] + assembler_flags + ["-o", obj_filename, asm_filename], check=True, stderr=subprocess.PIPE)
+
+            try:
+                os.rename(tmp_directory, self.entry_directory(key))
+            except OSError:
+                # Another compile stored the same entry first, theirs is just as good
+                shutil.rmtree(tmp_directory, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+
+        return self.entry_directory(key)
+
+class BuildCache:
+    """
+    Content-addressed cache of linked executables.
+
+    A key covers everything that can change the output of a compile: the source, the compiler
+    version and its source, the builtins, the NASM version, the linker and the codegen options. A hit hands
+    back the executable without tokenizing, parsing, assembling or linking anything.
+    The cache is bounded to max_bytes, least recently used entries are evicted first.
+    """
+    EXECUTABLE_NAME = "program"
+
+    def __init__(self, cache_directory: str = None, max_bytes: int = None) -> None:
+        self.cache_directory = cache_directory or default_cache_directory()
+        self.entries_directory = os.path.join(self.cache_directory, "builds")
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.environ.get("PANDA_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+    def key(self, source_path: str, builtins_source: bytes, version: str, options: dict) -> str:
+        return hash_bytes(
+            hash_file(source_path),
+            version,
+            compiler_hash(),
+            builtins_source,
+            nasm_version(self.cache_directory),
+            tool_identity("ld"),
+            json.dumps(options, sort_keys=True),
+        )
+
+    def entry_directory(self, key: str) -> str:
+        return os.path.join(self.entries_directory, key)
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """
+        Copy a cached executable to output_path.
+
+        The copy is written next to output_path and renamed over it, like write_executable does,
+        so a running copy of the old executable is never written to. Anything that keeps the copy
+        from happening is a miss and the program is compiled instead.
+
+        :return: True on a hit.
+        """
+        executable_path = os.path.join(self.entry_directory(key), self.EXECUTABLE_NAME)
+        tmp_path = f"{output_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+
+        try:
+            shutil.copy(executable_path, tmp_path)
+            os.replace(tmp_path, output_path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            return False
+
+        # Entry mtimes double as the LRU order
+        try:
+            os.utime(self.entry_directory(key))
+        except FileNotFoundError:
+            pass
+
+        return True
+
+    def store(self, key: str, executable_path: str) -> None:
+        os.makedirs(self.entries_directory, exist_ok=True)
+        tmp_directory = tempfile.mkdtemp(dir=self.entries_directory, prefix=".tmp-")
+
+        try:
+            shutil.copy(executable_path, os.path.join(tmp_directory, self.EXECUTABLE_NAME))
+            os.rename(tmp_directory, self.entry_directory(key))
+        except OSError:
+            # Either the copy failed or another compile stored the same entry first
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+        self.evict(keep=key)
+
+    def evict(self, keep: str = None) -> list[str]:
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+
+        :param keep: A key that is never evicted, normally the entry that was just stored.
+        :return: The keys that were evicted.
+        """
+        entries = []
+        total_bytes = 0
+
+        for key in os.listdir(self.entries_directory):
+            if key.startswith(".tmp-"): continue
+
+            directory = self.entry_directory(key)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(directory))
+                entries.append((os.stat(directory).st_mtime, size, key))
+            except FileNotFoundError:
+                continue
+
+            total_bytes += size
+
+        evicted = []
+        for _, size, key in sorted(entries):
+            if total_bytes <= self.max_bytes: break
+            if key == keep: continue
+
+            shutil.rmtree(self.entry_directory(key), ignore_errors=True)
+            total_bytes -= size
+            evicted.append(key)
+
+        return evicted
@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+
+# Only the standard library is imported here, the compiler itself stays loaded in the daemon
+
+def default_socket_path() -> str:
+    """
+    $PANDA_SOCKET if set, otherwise panda-lang-<uid>.sock under $XDG_RUNTIME_DIR or the temporary directory
+    """
+    if os.environ.get("PANDA_SOCKET"): return os.environ["PANDA_SOCKET"]
+
+    runtime_directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runtime_directory, f"panda-lang-{os.getuid()}.sock")
+
+def request(message: dict, socket_path: str = None) -> dict:
+    """
+    Send one request to the daemon and wait for its answer, both are a line of JSON.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path or default_socket_path())
+        connection.sendall(json.dumps(message).encode() + b"\n")
+        connection.shutdown(socket.SHUT_WR)
+
+        chunks = []
+        for chunk in iter(lambda: connection.recv(65536), b''):
+            chunks.append(chunk)
+
+    return json.loads(b"".join(chunks))
+
+def format_result(result: dict) -> str:
+    if not result["ok"]:
+        return f"FAIL  {result['file']} ({result['latency_ms']:.3f} ms)\n" + "\n".join(f"      {line}" for line in result["diagnostics"])
+
+    return f"ok    {result['file']} ({result['status']} in {result['latency_ms']:.3f} ms)"
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Compile Panda programs with a running compiler daemon')
+
+    arg_parser.add_argument('-r', action='store_true', help='Run the code after compiling')
+    arg_parser.add_argument('-v', action='store_true', help='Print the time spent in each compiler phase')
+    arg_parser.add_argument('-O', default=None, choices=['0', '1', '2', 's'], metavar='LEVEL', help="Optimization level, as in panda.py (default: the daemon's)")
+    arg_parser.add_argument('--force', action='store_true', help='Compile even when the source did not change since the last build')
+    arg_parser.add_argument('--socket', type=str, default=default_socket_path(), metavar='PATH', help='Socket of the daemon (default: %(default)s)')
+    arg_parser.add_argument('--stats', action='store_true', help='Print the request count and latencies of the daemon')
+    arg_parser.add_argument('--stop', action='store_true', help='Stop the daemon')
+    arg_parser.add_argument('file_paths', type=str, nargs='*', metavar='file_path', help='The files you would like to compile')
+
+    args = arg_parser.parse_args()
+
+    if args.r and len(args.file_paths) != 1:
+        print("Error: -r only works with a single file.")
+        sys.exit(1)
+
+    if args.stats: message = {"command": "stats"}
+    elif args.stop: message = {"command": "stop"}
+    elif args.file_paths: message = {"command": "compile", "files": [os.path.abspath(path) for path in args.file_paths], "force": args.force}
+    else: arg_parser.error("give the files to compile, --stats or --stop")
+
+    if args.O is not None:
+        message["optimize_size"] = args.O == 's'
+        message["optimization_level"] = 2 if args.O == 's' else int(args.O)
+
+    start_time = time.perf_counter()
+    try:
+        response = request(message, args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"Error: No daemon is listening on {args.socket}, start one with `python daemon.py`.")
+        sys.exit(1)
+    round_trip = time.perf_counter() - start_time
+
+    if response.get("ok") is False:
+        print(f"Error: {response['error']}")
+        sys.exit(1)
+
+    if "results" not in response:
+        print(json.dumps(response, indent=4))
+        return
+
+    for result in response["results"]:
+        print(format_result(result))
+        if args.v: print("      " + ", ".join(f"{name} {milliseconds:.3f} ms" for name, milliseconds in result["timings"].items()))
+    print(f"Round trip: {round_trip * 1000:.3f} ms")
+
+    if not all(result["ok"] for result in response["results"]): sys.exit(1)
+
+    if args.r:
+        executable_path = response["results"][0]["output"]
+        print(f"Executing {executable_path}...")
+        with subprocess.Popen([executable_path], stdout=sys.stdout, stderr=sys.stderr, stdin=sys.stdin) as process:
+            process.wait()
+            print(f"Process exited with code {process.returncode}")
+
+if __name__ == '__main__':
+    main()
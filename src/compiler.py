@@ -0,0 +1,168 @@
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from exceptions import PandaCompilerError, ParsingErrors, raising_errors
+from tokenizer import Tokenizer
+from parse import Parser
+from optimizer import Optimizer, DEFAULT_OPTIMIZATION_LEVEL
+from generator import Generator, ASSEMBLER
+from profiler import Profiler, active_profiler, phase
+
+class CompileResult:
+    """
+    Everything one compile produced.
+
+    asm is the generated assembly and executable the bytes of the linked ELF64 executable, either
+    is None when the compile failed before getting to it. diagnostics holds one line per error,
+    "<exception class>: message" like "UnexpectedTokenError: Expected ... at 3:7", or
+    "<tool> failed: ..." when nasm or ld failed. timings holds the seconds spent in each compiler
+    phase and counters what the phases produced, as named in --profile.
+    """
+    def __init__(self) -> None:
+        self.asm = None
+        self.executable = None
+        self.diagnostics = []
+        self.timings = {}
+        self.counters = {}
+
+    @property
+    def ok(self) -> bool:
+        return not self.diagnostics
+
+    @property
+    def total_time(self) -> float:
+        return sum(self.timings.values())
+
+    def __repr__(self) -> str:
+        if not self.ok: return f"CompileResult(failed, {len(self.diagnostics)} diagnostics)"
+        return f"CompileResult({len(self.executable or b'')} bytes, {self.total_time * 1000:.3f} ms)"
+
+def diagnostics(error: PandaCompilerError) -> list[str]:
+    if isinstance(error, ParsingErrors):
+        return [f"{parsing_error.__class__.__name__}: {parsing_error.message}" for parsing_error in error.errors]
+
+    return [f"{error.__class__.__name__}: {error.message}"]
+
+class Compiler:
+    """
+    One set of compiler stages, reset and reused for every program it compiles.
+
+    The tokenizer's pattern and handler tables, the parser's statement table and a generator per
+    set of codegen options are built once. A Compiler must only be used by one thread at a time,
+    CompilerPool hands out one per thread.
+    """
+    def __init__(self) -> None:
+        self.tokenizer = Tokenizer()
+        self.parser = Parser()
+        # (assembler, optimization level, optimize size) -> generator
+        self.generators = {}
+
+    def generator(self, assembler: ASSEMBLER, optimization_level: int, optimize_size: bool):
+        key = (assembler, optimization_level, optimize_size)
+        if key not in self.generators:
+            self.generators[key] = Generator(assembler=assembler, optimization_level=optimization_level, optimize_size=optimize_size)
+
+        return self.generators[key]
+
+    def compile(self, source: bytes, assembler: ASSEMBLER, optimization_level: int, optimize_size: bool, build: bool = True) -> CompileResult:
+        """
+        Compile a source, errors end up in the result's diagnostics instead of raising or exiting.
+
+        :param source: The source code, as bytes.
+        :param build: Also assemble and link the program, otherwise only the assembly is generated.
+        """
+        result = CompileResult()
+
+        # The phases report to a profiler of this thread only, one started by the caller is resumed after
+        caller_profiler = active_profiler()
+        compile_profiler = Profiler().start()
+        try:
+            with raising_errors():
+                with phase("tokenize"):
+                    tokens = self.tokenizer.tokenize(source)
+
+                self.parser.reset(tokens, self.tokenizer.line_index)
+                with phase("parse"):
+                    ast_nodes = self.parser.parse()
+
+                if optimization_level > 0:
+                    # Drained here, so its time isn't counted as the generator's
+                    with phase("optimize"):
+                        ast_nodes = list(Optimizer(optimization_level).optimize(ast_nodes))
+
+                program_generator = self.generator(assembler, optimization_level, optimize_size)
+                with phase("generate"):
+                    program = program_generator.generate_assembly_elf64(ast_nodes)
+
+                program.include_prefix = "lib/"
+                result.asm = program.assembly_source
+                if build: result.executable = program.compile_in_memory("panda")
+        except PandaCompilerError as e:
+            result.diagnostics = diagnostics(e)
+        except subprocess.CalledProcessError as e:
+            result.diagnostics = [f"{e.cmd[0]} failed: {e.stderr.decode().strip() if e.stderr else e}"]
+        except OSError as e:
+            # nasm or ld missing, or the tmpfs directory they work in not writable
+            result.diagnostics = [f"{e.__class__.__name__}: {e}"]
+        finally:
+            compile_profiler.stop()
+            if caller_profiler is not None: caller_profiler.start()
+
+        result.timings = dict(compile_profiler.phases)
+        result.counters = dict(compile_profiler.counters)
+        return result
+
+class CompilerPool:
+    """
+    Idle Compilers, handed out one per caller so no two threads ever share stages.
+
+    Compilers are made on demand and put back after each compile, so a pool settles at one
+    Compiler per thread compiling at the same time and their tables are built only once.
+    """
+    def __init__(self) -> None:
+        self.idle = []
+        self.lock = threading.Lock()
+        self.created = 0
+
+    @contextmanager
+    def compiler(self):
+        with self.lock:
+            compiler = self.idle.pop() if self.idle else None
+            if compiler is None: self.created += 1
+
+        if compiler is None: compiler = Compiler()
+        try:
+            yield compiler
+        finally:
+            # Every stage resets before its next program, even one that failed half way can go back
+            with self.lock:
+                self.idle.append(compiler)
+
+    def warm(self, assembler: ASSEMBLER = ASSEMBLER.ELF64) -> None:
+        """
+        Compile an empty program, which loads the builtins and fills the per-process caches,
+        so the first real compile doesn't pay for them.
+        """
+        with self.compiler() as compiler:
+            compiler.compile(b"", assembler, DEFAULT_OPTIMIZATION_LEVEL, False)
+
+# The pool compile_source uses unless it is given one
+COMPILER_POOL = CompilerPool()
+
+def compile_source(source: str | bytes, assembler: ASSEMBLER = ASSEMBLER.ELF64, optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL, optimize_size: bool = False, build: bool = True, pool: CompilerPool = None) -> CompileResult:
+    """
+    Compile a Panda program in-process, safe to call from many threads at once.
+
+    Nothing is printed and the process never exits, errors are returned as diagnostics. With the
+    elf64 assembler, the default, nothing is written to disk and no other process is started.
+
+    :param source: The source code. Unlike in Tokenizer a str is always code, never a path.
+    :param build: Also assemble and link the executable, otherwise only the assembly is generated.
+    :param pool: The pool to take a Compiler from, COMPILER_POOL by default.
+    :return: The CompileResult.
+    """
+    if isinstance(source, str): source = source.encode('utf-8')
+
+    with (pool or COMPILER_POOL).compiler() as compiler:
+        return compiler.compile(source, assembler, optimization_level, optimize_size, build)
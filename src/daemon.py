@@ -0,0 +1,328 @@
+import os
+import sys
+import glob
+import json
+import time
+import socket
+import signal
+import argparse
+import threading
+import socketserver
+
+from cache import hash_bytes
+from client import default_socket_path, format_result
+from compiler import CompilerPool, compile_source
+from generator import ASSEMBLER, BUILTINS_PATH, codegen_options, write_executable
+from optimizer import DEFAULT_OPTIMIZATION_LEVEL
+from version import VERSION
+
+# Seconds between two scans of the watched directories
+WATCH_INTERVAL = 0.25
+
+# Latencies kept for the statistics, the oldest are dropped first
+LATENCY_HISTORY = 4096
+
+# Fields of a compile request, with a check of their value and what the check wants. Fields left out take the daemon's defaults
+COMPILE_FIELDS = {
+    "files": (lambda value: isinstance(value, list) and all(isinstance(path, str) for path in value), "a list of paths"),
+    # bool is an int too, True isn't a level
+    "optimization_level": (lambda value: value is None or (type(value) is int and 0 <= value <= 2), "0, 1 or 2"),
+    "optimize_size": (lambda value: value is None or isinstance(value, bool), "true or false"),
+    "force": (lambda value: isinstance(value, bool), "true or false"),
+}
+
+def output_path(file_path: str) -> str:
+    return os.path.normpath(os.path.join(file_path, '../', os.path.splitext(os.path.basename(file_path))[0]))
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class CompilerDaemon:
+    """
+    Keeps the compiler loaded between compiles, for the client in client.py and for watched directories.
+
+    A program is only compiled again when the hash of its source, the builtins and the codegen
+    options changed since its last successful build. The latency of a compile runs from when
+    its request was read until its answer was ready.
+    """
+    def __init__(self, assembler: ASSEMBLER = ASSEMBLER.ELF64, optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL, optimize_size: bool = False) -> None:
+        self.assembler = assembler
+        self.optimization_level = optimization_level
+        self.optimize_size = optimize_size
+        self.pool = CompilerPool()
+        self.server = None
+        self.stopping = False
+        self.start_time = time.time()
+
+        # file path -> hash of its last successful build
+        self.built_hashes = {}
+        self.lock = threading.Lock()
+        self.statistics = {"requests": 0, "compiled": 0, "unchanged": 0, "failed": 0}
+        self.latencies = []
+
+        # Request handlers by the request's command
+        self.commands = {
+            "compile": self.compile_command,
+            "stats": self.stats_command,
+            "stop": self.stop_command,
+        }
+
+    def build_hash(self, source: bytes, optimization_level: int, optimize_size: bool) -> str:
+        with open(BUILTINS_PATH, 'rb') as builtins_file:
+            builtins = builtins_file.read()
+
+        options = codegen_options(self.assembler, optimization_level, optimize_size)
+        return hash_bytes(source, builtins, VERSION, json.dumps(options, sort_keys=True))
+
+    def build(self, file_path: str, optimization_level: int = None, optimize_size: bool = None, force: bool = False) -> dict:
+        """
+        Compile a file next to itself, unless it didn't change since its last build.
+
+        :return: What happened, as sent back to the client.
+        """
+        start_time = time.perf_counter()
+        file_path = os.path.abspath(file_path)
+        optimization_level = self.optimization_level if optimization_level is None else optimization_level
+        optimize_size = self.optimize_size if optimize_size is None else optimize_size
+
+        result = {"file": file_path, "ok": False, "status": "failed", "output": None, "diagnostics": [], "timings": {}}
+        try:
+            with open(file_path, 'rb') as source_file:
+                source = source_file.read()
+        except OSError as e:
+            source = None
+            result["diagnostics"] = [f"{e.__class__.__name__}: {e.strerror}"]
+
+        if source is not None:
+            build_hash = self.build_hash(source, optimization_level, optimize_size)
+            executable_path = output_path(file_path)
+
+            with self.lock:
+                unchanged = not force and self.built_hashes.get(file_path) == build_hash and os.path.exists(executable_path)
+
+            if unchanged:
+                result.update(ok=True, status="unchanged", output=executable_path)
+            else:
+                compile_result = compile_source(source, assembler=self.assembler, optimization_level=optimization_level, optimize_size=optimize_size, pool=self.pool)
+                result["diagnostics"] = compile_result.diagnostics
+                result["timings"] = {name: round(seconds * 1000, 3) for name, seconds in compile_result.timings.items()}
+
+                if compile_result.ok:
+                    try:
+                        result.update(ok=True, status="compiled", output=write_executable(executable_path, compile_result.executable))
+                    except OSError as e:
+                        result["diagnostics"] = [f"{e.__class__.__name__}: {e}"]
+
+                with self.lock:
+                    if result["ok"]: self.built_hashes[file_path] = build_hash
+                    else: self.built_hashes.pop(file_path, None)
+
+        latency = time.perf_counter() - start_time
+        result["latency_ms"] = round(latency * 1000, 3)
+
+        with self.lock:
+            self.statistics[result["status"]] += 1
+            self.latencies.append(latency)
+            if len(self.latencies) > LATENCY_HISTORY: del self.latencies[:len(self.latencies) - LATENCY_HISTORY]
+
+        return result
+
+    def handle_request(self, request: dict) -> dict:
+        """
+        Answer a request, malformed ones get {"ok": false, "error": ...} back.
+        """
+        with self.lock:
+            self.statistics["requests"] += 1
+
+        command = request.get("command", "compile")
+        handler = self.commands.get(command) if isinstance(command, str) else None
+        if handler is None: return {"ok": False, "error": f"Unknown command {command!r}"}
+        return handler(request)
+
+    def compile_command(self, request: dict) -> dict:
+        for field, (valid, expected) in COMPILE_FIELDS.items():
+            if field in request and not valid(request[field]):
+                return {"ok": False, "error": f"{field} must be {expected}, not {json.dumps(request[field])}"}
+
+        results = [self.build(file_path, request.get("optimization_level"), request.get("optimize_size"), request.get("force", False)) for file_path in request.get("files", [])]
+        for result in results: print(format_result(result))
+        sys.stdout.flush()
+
+        return {"results": results}
+
+    def stats_command(self, request: dict) -> dict:
+        with self.lock:
+            statistics = dict(self.statistics)
+            latencies = sorted(self.latencies)
+
+        if latencies:
+            statistics["latency_ms"] = {
+                "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+                "p50": round(percentile(latencies, 0.5) * 1000, 3),
+                "p95": round(percentile(latencies, 0.95) * 1000, 3),
+                "max": round(latencies[-1] * 1000, 3),
+            }
+        statistics["compilers"] = self.pool.created
+        statistics["uptime_s"] = round(time.time() - self.start_time, 3)
+
+        return statistics
+
+    def stop_command(self, request: dict) -> dict:
+        # The server is shut down once this answer is sent, the process may exit right after
+        self.stopping = True
+        return {"stopped": True}
+
+    def serve(self, socket_path: str) -> None:
+        """
+        Answer requests on a Unix socket until a stop request comes in, each connection in its own thread.
+        """
+        remove_stale_socket(socket_path)
+
+        warm_start = time.perf_counter()
+        self.pool.warm(self.assembler)
+        print(f"Compiler warmed up in {(time.perf_counter() - warm_start) * 1000:.3f} ms")
+
+        # Only the user running the daemon can connect to it
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler)
+        finally:
+            os.umask(umask)
+
+        self.server.daemon_threads = True
+        self.server.compiler_daemon = self
+        print(f"Listening on {socket_path}")
+        sys.stdout.flush()
+
+        try:
+            with self.server:
+                self.server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        # Connections that close without a request only checked that the daemon is up
+        if not line.strip(): return
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict): raise ValueError("A request is a JSON object")
+        except ValueError as e:
+            response = {"ok": False, "error": f"Malformed request: {e}"}
+        else:
+            try:
+                response = self.server.compiler_daemon.handle_request(request)
+            except Exception as e:
+                # Whatever went wrong, the client gets an answer and the daemon keeps serving
+                response = {"ok": False, "error": f"{e.__class__.__name__}: {e}"}
+
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+        # Handlers run in threads of their own, serve_forever can return while this one waits for it
+        if self.server.compiler_daemon.stopping: self.server.shutdown()
+
+def remove_stale_socket(socket_path: str) -> None:
+    """
+    Remove the socket of a daemon that is gone, a daemon that still answers is left alone.
+    """
+    if not os.path.exists(socket_path): return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+            return
+
+    raise RuntimeError(f"A daemon is already listening on {socket_path}")
+
+class DirectoryWatcher(threading.Thread):
+    """
+    Polls directories for .pnda files that were added or whose size or mtime changed.
+
+    Only those are handed to the daemon, which then only recompiles the ones whose contents
+    changed, so touching a file or saving it unchanged costs a hash and no compile.
+    """
+    def __init__(self, compiler_daemon: CompilerDaemon, directories: list[str], interval: float = WATCH_INTERVAL) -> None:
+        super().__init__(name="panda-watcher", daemon=True)
+        self.compiler_daemon = compiler_daemon
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.interval = interval
+        # file path -> (mtime, size) when it was last seen
+        self.file_stats = {}
+        self.stopped = threading.Event()
+
+    def scan(self) -> list[str]:
+        """
+        :return: The files that are new or changed since the last scan.
+        """
+        changed = []
+        seen = set()
+        for directory in self.directories:
+            for file_path in glob.glob(os.path.join(directory, '**', '*.pnda'), recursive=True):
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+
+                seen.add(file_path)
+                if self.file_stats.get(file_path) != (stat.st_mtime_ns, stat.st_size):
+                    self.file_stats[file_path] = (stat.st_mtime_ns, stat.st_size)
+                    changed.append(file_path)
+
+        for file_path in self.file_stats.keys() - seen: del self.file_stats[file_path]
+        return changed
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            for file_path in self.scan():
+                result = self.compiler_daemon.build(file_path)
+                if result["status"] != "unchanged": print(f"{format_result(result)} [watch]")
+            sys.stdout.flush()
+
+            self.stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description='Keep a Panda compiler running and compile programs for client.py, or whenever they change')
+
+    arg_parser.add_argument('-O', default=str(DEFAULT_OPTIMIZATION_LEVEL), choices=['0', '1', '2', 's'], metavar='LEVEL', help=f'Optimization level of requests that do not give one and of watched files, as in panda.py (default: {DEFAULT_OPTIMIZATION_LEVEL})')
+    arg_parser.add_argument('--assembler', choices=[assembler.name.lower() for assembler in ASSEMBLER], default='elf64', help='Assemble with nasm and ld, or write the ELF64 executable directly (default: elf64)')
+    arg_parser.add_argument('--socket', type=str, default=default_socket_path(), metavar='PATH', help='Socket to listen on (default: %(default)s)')
+    arg_parser.add_argument('--watch', type=str, nargs='+', default=[], metavar='DIRECTORY', help='Compile every .pnda file below these directories whenever its contents change')
+    arg_parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, metavar='SECONDS', help=f'Seconds between two scans of the watched directories (default: {WATCH_INTERVAL})')
+
+    args = arg_parser.parse_args()
+    optimize_size = args.O == 's'
+
+    for directory in args.watch:
+        if not os.path.isdir(directory):
+            print(f"Error: The directory '{directory}' does not exist.")
+            sys.exit(1)
+
+    compiler_daemon = CompilerDaemon(ASSEMBLER[args.assembler.upper()], 2 if optimize_size else int(args.O), optimize_size)
+
+    # Stopped like with Ctrl+C, so the socket is removed on the way out
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+
+    watcher = None
+    if args.watch:
+        watcher = DirectoryWatcher(compiler_daemon, args.watch, args.interval)
+        watcher.start()
+
+    try:
+        compiler_daemon.serve(args.socket)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None: watcher.stop()
+
+if __name__ == '__main__':
+    main()
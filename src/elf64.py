@@ -0,0 +1,1089 @@
+import re
+import struct
+from typing import Iterable
+
+from exceptions import AssemblerError
+
+# Static executables are laid out the same way ld lays them out by default
+BASE_ADDRESS = 0x400000
+PAGE_SIZE = 0x1000
+
+REGISTERS = {}
+for number, names in enumerate([
+    ("rax", "eax", "ax", "al"), ("rcx", "ecx", "cx", "cl"), ("rdx", "edx", "dx", "dl"), ("rbx", "ebx", "bx", "bl"),
+    ("rsp", "esp", "sp", "spl"), ("rbp", "ebp", "bp", "bpl"), ("rsi", "esi", "si", "sil"), ("rdi", "edi", "di", "dil"),
+]):
+    for size, name in zip((64, 32, 16, 8), names):
+        REGISTERS[name] = (number, size)
+for number in range(8, 16):
+    for size, suffix in ((64, ""), (32, "d"), (16, "w"), (8, "b")):
+        REGISTERS[f"r{number}{suffix}"] = (number, size)
+
+# 8-bit registers that only exist with a REX prefix, without one the same numbers mean ah, ch, dh and bh
+REX_BYTE_REGISTERS = {"spl", "bpl", "sil", "dil"}
+
+SIZE_KEYWORDS = {"byte": 8, "word": 16, "dword": 32, "qword": 64}
+
+CONDITION_CODES = {
+    "o": 0, "no": 1, "b": 2, "c": 2, "nae": 2, "ae": 3, "nb": 3, "nc": 3, "e": 4, "z": 4, "ne": 5, "nz": 5,
+    "be": 6, "na": 6, "a": 7, "nbe": 7, "s": 8, "ns": 9, "p": 10, "pe": 10, "np": 11, "po": 11,
+    "l": 12, "nge": 12, "ge": 13, "nl": 13, "le": 14, "ng": 14, "g": 15, "nle": 15,
+}
+
+# Group 1 arithmetic, the number is both the /digit of the immediate forms and the opcode row
+ARITHMETIC_OPERATIONS = {"add": 0, "or": 1, "adc": 2, "sbb": 3, "and": 4, "sub": 5, "xor": 6, "cmp": 7}
+SHIFT_OPERATIONS = {"rol": 0, "ror": 1, "shl": 4, "sal": 4, "shr": 5, "sar": 7}
+UNARY_OPERATIONS = {"not": 2, "neg": 3, "mul": 4, "div": 6, "idiv": 7}
+
+SECTION_NAMES = {".text": "text", ".rodata": "rodata", ".data": "data", ".bss": "bss"}
+
+LABEL_PATTERN = re.compile(r"^([A-Za-z_.%@$?][\w.%@$?]*):\s*(.*)$")
+MACRO_LOCAL_PATTERN = re.compile(r"%%(\w+)")
+ADDRESS_TERM_PATTERN = re.compile(r"([+-]?)\s*([^+-]+)")
+EXPRESSION_TOKEN_PATTERN = re.compile(r"0x[0-9A-Fa-f_]+|[0-9][0-9_]*|'[^']*'|\"[^\"]*\"|`[^`]*`|[A-Za-z_.@$?][\w.@$?]*|[-+*()]")
+NUMBER_PATTERN = re.compile(r"0x[0-9A-Fa-f_]+|[0-9][0-9_]*")
+
+class Register:
+    __slots__ = ('name', 'number', 'size')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.number, self.size = REGISTERS[name]
+
+    def __repr__(self) -> str:
+        return self.name
+
+class Value:
+    """
+    An assemble time value: a constant, or a symbol's address plus a constant.
+    """
+    __slots__ = ('symbol', 'addend')
+
+    def __init__(self, symbol: str = None, addend: int = 0) -> None:
+        self.symbol = symbol
+        self.addend = addend
+
+    def is_constant(self) -> bool:
+        return self.symbol is None
+
+    def __repr__(self) -> str:
+        if self.symbol is None: return str(self.addend)
+        return f"{self.symbol}{self.addend:+}"
+
+class Memory:
+    __slots__ = ('base', 'index', 'scale', 'displacement', 'size')
+
+    def __init__(self, base: Register = None, index: Register = None, scale: int = 1, displacement: Value = None, size: int = None) -> None:
+        self.base = base
+        self.index = index
+        self.scale = scale
+        self.displacement = displacement or Value()
+        self.size = size
+
+class Fixup:
+    """
+    A field that can only be filled in once every symbol has an address.
+
+    kind is "rel32" for fields relative to the end of their instruction, "abs32" for sign
+    extended absolute addresses and "abs64" for full absolute addresses.
+    """
+    __slots__ = ('section', 'offset', 'kind', 'value', 'instruction_end')
+
+    def __init__(self, section: str, offset: int, kind: str, value: Value, instruction_end: int) -> None:
+        self.section = section
+        self.offset = offset
+        self.kind = kind
+        self.value = value
+        self.instruction_end = instruction_end
+
+def fits_int8(value: int) -> bool:
+    return -128 <= value <= 127
+
+def fits_int32(value: int) -> bool:
+    return -2 ** 31 <= value < 2 ** 31
+
+class Assembler:
+    """
+    Encodes the subset of x86-64 used by Panda programs and their builtins straight to machine code.
+
+    Instructions are appended to the current section, symbols are recorded per section and every
+    reference to a symbol becomes a Fixup, which ELF64Executable resolves once the layout is known.
+    Jumps and calls always use 32-bit displacements, so no relaxation pass is needed.
+    """
+    def __init__(self) -> None:
+        self.sections = {"text": bytearray(), "rodata": bytearray(), "data": bytearray()}
+        self.bss_size = 0
+        self.current_section = "text"
+        # name -> (section, offset), section is None for absolute symbols
+        self.symbols = {}
+        self.fixups = []
+        self.instruction_count = 0
+
+        self.encoders = {
+            "mov": self.encode_mov,
+            "movzx": self.encode_movzx,
+            "movsx": self.encode_movsx,
+            "lea": self.encode_lea,
+            "test": self.encode_test,
+            "inc": self.encode_inc_dec,
+            "dec": self.encode_inc_dec,
+            "imul": self.encode_imul,
+            "push": self.encode_push_pop,
+            "pop": self.encode_push_pop,
+            "jmp": self.encode_branch,
+            "call": self.encode_branch,
+            "ret": lambda mnemonic, operands: self.emit_instruction(b"\xc3"),
+            "syscall": lambda mnemonic, operands: self.emit_instruction(b"\x0f\x05"),
+            "cqo": lambda mnemonic, operands: self.emit_instruction(b"\x48\x99"),
+            "nop": lambda mnemonic, operands: self.emit_instruction(b"\x90"),
+            "movsb": lambda mnemonic, operands: self.emit_instruction(b"\xa4"),
+            "rep movsb": lambda mnemonic, operands: self.emit_instruction(b"\xf3\xa4"),
+        }
+        for mnemonic in ARITHMETIC_OPERATIONS: self.encoders[mnemonic] = self.encode_arithmetic
+        for mnemonic in SHIFT_OPERATIONS: self.encoders[mnemonic] = self.encode_shift
+        for mnemonic in UNARY_OPERATIONS: self.encoders[mnemonic] = self.encode_unary
+        for condition in CONDITION_CODES:
+            self.encoders[f"j{condition}"] = self.encode_branch
+            self.encoders[f"set{condition}"] = self.encode_setcc
+            self.encoders[f"cmov{condition}"] = self.encode_cmov
+
+    #
+    #   Sections and symbols
+    #
+
+    def section(self, name: str) -> None:
+        if name not in SECTION_NAMES: raise AssemblerError(f"Unsupported section {name}")
+        self.current_section = SECTION_NAMES[name]
+
+    def define_symbol(self, name: str, section: str | None, value: int) -> None:
+        if name in self.symbols and self.symbols[name] != (section, value):
+            raise AssemblerError(f"Symbol {name} is defined more than once")
+        self.symbols[name] = (section, value)
+
+    def label(self, name: str) -> None:
+        if self.current_section == "bss":
+            self.define_symbol(name, "bss", self.bss_size)
+        else:
+            self.define_symbol(name, self.current_section, len(self.sections[self.current_section]))
+
+    def data(self, data: bytes) -> None:
+        if self.current_section == "bss": raise AssemblerError("Initialized data in .bss")
+        self.sections[self.current_section].extend(data)
+
+    def data_value(self, value: Value, size: int) -> None:
+        """
+        Emit one initialized word of `size` bytes, which may refer to a symbol.
+        """
+        if value.is_constant():
+            self.data(value.addend.to_bytes(size, 'little', signed=value.addend < 0))
+            return
+
+        if size not in (4, 8): raise AssemblerError(f"Symbol {value.symbol} doesn't fit in {size} bytes")
+        section = self.sections[self.current_section]
+        self.fixups.append(Fixup(self.current_section, len(section), "abs64" if size == 8 else "abs32", value, len(section) + size))
+        self.data(bytes(size))
+
+    def reserve(self, size: int) -> None:
+        if self.current_section != "bss": raise AssemblerError("Uninitialized data outside of .bss")
+        self.bss_size += size
+
+    def align_bss(self, alignment: int) -> None:
+        self.bss_size = (self.bss_size + alignment - 1) // alignment * alignment
+
+    def append(self, unit: 'Assembler') -> None:
+        """
+        Append a unit assembled on its own, as if its source had been assembled after this one's.
+
+        Its symbols and fixups move to where its sections now start, the unit itself is left
+        untouched, so one assembled unit can be appended to any number of programs.
+        """
+        starts = {name: len(section) for name, section in self.sections.items()}
+        starts["bss"] = self.bss_size
+
+        for name, data in unit.sections.items(): self.sections[name].extend(data)
+        self.bss_size += unit.bss_size
+
+        for name, (section, value) in unit.symbols.items():
+            self.define_symbol(name, section, value if section is None else starts[section] + value)
+        for fixup in unit.fixups:
+            start = starts[fixup.section]
+            self.fixups.append(Fixup(fixup.section, start + fixup.offset, fixup.kind, fixup.value, start + fixup.instruction_end))
+
+        self.instruction_count += unit.instruction_count
+
+    #
+    #   Instruction encoding
+    #
+
+    def instruction(self, mnemonic: str, *operands) -> None:
+        encoder = self.encoders.get(mnemonic)
+        if encoder is None: raise AssemblerError(f"Unsupported instruction {mnemonic}")
+        if self.current_section != "text": raise AssemblerError(f"Instruction {mnemonic} outside of .text")
+
+        encoder(mnemonic, operands)
+        self.instruction_count += 1
+
+    def emit_instruction(self, encoded: bytes, fixups: list[tuple[int, str, Value]] = ()) -> None:
+        """
+        Append an encoded instruction, fixups are (offset in the instruction, kind, value).
+        """
+        text = self.sections["text"]
+        start = len(text)
+        text.extend(encoded)
+
+        for offset, kind, value in fixups:
+            self.fixups.append(Fixup("text", start + offset, kind, value, start + len(encoded)))
+
+    def encode_modrm(self, opcode: bytes, reg: int, rm, size: int, immediate: bytes = b"", immediate_fixup: tuple[str, Value] = None, byte_registers: tuple = ()) -> None:
+        """
+        Encode an instruction that takes a ModRM byte.
+
+        :param opcode: The opcode bytes, after any prefixes.
+        :param reg: The value of the ModRM reg field, a register number or an opcode extension.
+        :param rm: The Register or Memory operand of the rm field.
+        :param size: Operand size in bits, decides the 0x66 prefix and REX.W.
+        :param immediate: Immediate bytes following the addressing bytes.
+        :param immediate_fixup: (kind, value) when the immediate refers to a symbol.
+        :param byte_registers: Registers whose 8-bit forms need a REX prefix to be addressable.
+        """
+        prefixes = bytearray()
+        if size == 16: prefixes.append(0x66)
+
+        rex = 0x48 if size == 64 else 0x40
+        if reg >= 8: rex |= 0x04
+
+        addressing = bytearray()
+        fixups = []
+
+        if isinstance(rm, Register):
+            if rm.number >= 8: rex |= 0x01
+            addressing.append(0xC0 | (reg & 7) << 3 | rm.number & 7)
+        elif rm.base is None and rm.index is None:
+            # [symbol] is addressed relative to rip, plain numbers are absolute
+            if rm.displacement.is_constant():
+                addressing += bytes([(reg & 7) << 3 | 4, 0x25])
+                addressing += struct.pack('<i', rm.displacement.addend)
+            else:
+                addressing.append((reg & 7) << 3 | 5)
+                fixups.append((len(addressing), "rel32", rm.displacement))
+                addressing += bytes(4)
+        else:
+            base, index, displacement = rm.base, rm.index, rm.displacement
+            if index is not None and index.number == 4: raise AssemblerError("rsp can't be used as an index")
+            if index is not None and index.number >= 8: rex |= 0x02
+            if base is not None and base.number >= 8: rex |= 0x01
+
+            scale_bits = {1: 0, 2: 1, 4: 2, 8: 3}[rm.scale]
+            if base is None:
+                # [index * scale + disp32] has no base, it always carries a 32-bit displacement
+                addressing += bytes([(reg & 7) << 3 | 4, scale_bits << 6 | (index.number & 7) << 3 | 5])
+                mode = None
+            elif not displacement.is_constant():
+                mode = 0x80
+            elif displacement.addend == 0 and base.number & 7 != 5:
+                mode = 0x00
+            elif fits_int8(displacement.addend):
+                mode = 0x40
+            else:
+                mode = 0x80
+
+            if base is not None:
+                if index is not None or base.number & 7 == 4:
+                    addressing += bytes([mode | (reg & 7) << 3 | 4, scale_bits << 6 | (index.number & 7 if index is not None else 4) << 3 | base.number & 7])
+                else:
+                    addressing.append(mode | (reg & 7) << 3 | base.number & 7)
+
+            if mode == 0x40:
+                addressing += struct.pack('<b', displacement.addend)
+            elif mode == 0x80 or mode is None:
+                if displacement.is_constant():
+                    addressing += struct.pack('<i', displacement.addend)
+                else:
+                    fixups.append((len(addressing), "abs32", displacement))
+                    addressing += bytes(4)
+
+        needs_rex = rex != 0x40 or any(register.name in REX_BYTE_REGISTERS for register in byte_registers)
+        head = prefixes + (bytes([rex]) if needs_rex else b"") + opcode
+
+        fixups = [(len(head) + offset, kind, value) for offset, kind, value in fixups]
+        if immediate_fixup is not None:
+            fixups.append((len(head) + len(addressing), immediate_fixup[0], immediate_fixup[1]))
+
+        self.emit_instruction(bytes(head + addressing + immediate), fixups)
+
+    @staticmethod
+    def is_accumulator(operand) -> bool:
+        # spl and friends are number 4, only al, ax, eax and rax are number 0
+        return isinstance(operand, Register) and operand.number == 0
+
+    def encode_accumulator(self, opcode: bytes, size: int, immediate: bytes, immediate_fixup: tuple[str, Value] = None) -> None:
+        """
+        Encode the short form of an instruction on al, ax, eax or rax and an immediate.
+        """
+        prefix = b"\x66" if size == 16 else b"\x48" if size == 64 else b""
+        self.emit_instruction(prefix + opcode + immediate, [(len(prefix) + len(opcode), *immediate_fixup)] if immediate_fixup else [])
+
+    def immediate(self, value: Value, size: int) -> tuple[bytes, tuple[str, Value] | None]:
+        """
+        Encode an immediate of `size` bits, symbols become sign extended 32-bit fixups.
+        """
+        if not value.is_constant():
+            if size < 32: raise AssemblerError(f"Symbol {value.symbol} doesn't fit in a {size}-bit immediate")
+            return bytes(4), ("abs32", value)
+
+        limit = 2 ** size
+        if not -limit // 2 <= value.addend < limit: raise AssemblerError(f"Immediate {value.addend} doesn't fit in {size} bits")
+        return (value.addend & (limit - 1)).to_bytes(size // 8, 'little'), None
+
+    @staticmethod
+    def operand_size(operands) -> int:
+        for operand in operands:
+            if isinstance(operand, Register): return operand.size
+        for operand in operands:
+            if isinstance(operand, Memory) and operand.size is not None: return operand.size
+
+        raise AssemblerError("Operation size not specified")
+
+    @staticmethod
+    def byte_registers(operands) -> tuple:
+        return tuple(operand for operand in operands if isinstance(operand, Register) and operand.size == 8)
+
+    def encode_mov(self, mnemonic, operands):
+        destination, source = operands
+        size = self.operand_size(operands)
+        byte_registers = self.byte_registers(operands)
+
+        if isinstance(source, Value) and isinstance(destination, Register):
+            number = destination.number
+            rex_b = 0x01 if number >= 8 else 0x00
+
+            if size == 64 and source.is_constant() and 0 <= source.addend < 2 ** 32:
+                # Writing the 32-bit register zero extends, which saves the REX.W and a 64-bit immediate
+                self.emit_instruction((bytes([0x40 | rex_b]) if rex_b else b"") + bytes([0xB8 | number & 7]) + source.addend.to_bytes(4, 'little'))
+            elif size == 64 and source.is_constant() and not fits_int32(source.addend):
+                self.emit_instruction(bytes([0x48 | rex_b, 0xB8 | number & 7]) + (source.addend & (2 ** 64 - 1)).to_bytes(8, 'little'))
+            elif size == 64:
+                immediate, fixup = self.immediate(source, 32)
+                self.encode_modrm(b"\xc7", 0, destination, 64, immediate, fixup)
+            else:
+                immediate, fixup = self.immediate(source, size)
+                prefix = b"\x66" if size == 16 else b""
+                rex = 0x40 | rex_b if rex_b or destination.name in REX_BYTE_REGISTERS else None
+                opcode = (0xB0 if size == 8 else 0xB8) | number & 7
+                self.emit_instruction(prefix + (bytes([rex]) if rex else b"") + bytes([opcode]) + immediate, [(len(prefix) + (1 if rex else 0) + 1, *fixup)] if fixup else [])
+        elif isinstance(source, Value):
+            immediate, fixup = self.immediate(source, min(size, 32))
+            self.encode_modrm(b"\xc6" if size == 8 else b"\xc7", 0, destination, size, immediate, fixup)
+        elif isinstance(source, Register) and source.size != size and isinstance(destination, Register):
+            raise AssemblerError(f"Mismatched operand sizes in mov {destination}, {source}")
+        elif isinstance(source, Register):
+            self.encode_modrm(b"\x88" if size == 8 else b"\x89", source.number, destination, size, byte_registers=byte_registers)
+        else:
+            self.encode_modrm(b"\x8a" if size == 8 else b"\x8b", destination.number, source, size, byte_registers=byte_registers)
+
+    def encode_movzx(self, mnemonic, operands, opcodes=(b"\x0f\xb6", b"\x0f\xb7")):
+        destination, source = operands
+        source_size = source.size
+        if source_size not in (8, 16): raise AssemblerError(f"{mnemonic} needs a byte or word source")
+
+        self.encode_modrm(opcodes[0] if source_size == 8 else opcodes[1], destination.number, source, destination.size, byte_registers=self.byte_registers([source]))
+
+    def encode_movsx(self, mnemonic, operands):
+        self.encode_movzx(mnemonic, operands, (b"\x0f\xbe", b"\x0f\xbf"))
+
+    def encode_lea(self, mnemonic, operands):
+        destination, source = operands
+        self.encode_modrm(b"\x8d", destination.number, source, destination.size)
+
+    def encode_arithmetic(self, mnemonic, operands):
+        operation = ARITHMETIC_OPERATIONS[mnemonic]
+        destination, source = operands
+        size = self.operand_size(operands)
+        byte_registers = self.byte_registers(operands)
+
+        if isinstance(source, Value):
+            # 0xFFFFFFFF is -1 to a 32-bit operation, and takes the sign extended 8-bit form too
+            if source.is_constant() and size in (16, 32) and 2 ** (size - 1) <= source.addend < 2 ** size: source = Value(None, (source.addend + 2 ** (size - 1)) % 2 ** size - 2 ** (size - 1))
+
+            if self.is_accumulator(destination) and (size == 8 or not (source.is_constant() and fits_int8(source.addend))):
+                # al, ax, eax and rax have a form without ModRM byte, like nasm picks
+                immediate, fixup = self.immediate(source, min(size, 32))
+                self.encode_accumulator(bytes([operation << 3 | (4 if size == 8 else 5)]), size, immediate, fixup)
+            elif size == 8:
+                immediate, fixup = self.immediate(source, 8)
+                self.encode_modrm(b"\x80", operation, destination, size, immediate, fixup, byte_registers)
+            elif source.is_constant() and fits_int8(source.addend):
+                self.encode_modrm(b"\x83", operation, destination, size, struct.pack('<b', source.addend), byte_registers=byte_registers)
+            else:
+                immediate, fixup = self.immediate(source, min(size, 32))
+                self.encode_modrm(b"\x81", operation, destination, size, immediate, fixup, byte_registers)
+        elif isinstance(source, Register):
+            self.encode_modrm(bytes([operation << 3 | (0 if size == 8 else 1)]), source.number, destination, size, byte_registers=byte_registers)
+        else:
+            self.encode_modrm(bytes([operation << 3 | (2 if size == 8 else 3)]), destination.number, source, size, byte_registers=byte_registers)
+
+    def encode_test(self, mnemonic, operands):
+        destination, source = operands
+        size = self.operand_size(operands)
+        byte_registers = self.byte_registers(operands)
+
+        if isinstance(source, Value):
+            immediate, fixup = self.immediate(source, min(size, 32))
+            if self.is_accumulator(destination):
+                self.encode_accumulator(b"\xa8" if size == 8 else b"\xa9", size, immediate, fixup)
+            else:
+                self.encode_modrm(b"\xf6" if size == 8 else b"\xf7", 0, destination, size, immediate, fixup, byte_registers)
+        else:
+            self.encode_modrm(b"\x84" if size == 8 else b"\x85", source.number, destination, size, byte_registers=byte_registers)
+
+    def encode_inc_dec(self, mnemonic, operands):
+        size = self.operand_size(operands)
+        self.encode_modrm(b"\xfe" if size == 8 else b"\xff", 0 if mnemonic == "inc" else 1, operands[0], size, byte_registers=self.byte_registers(operands))
+
+    def encode_unary(self, mnemonic, operands):
+        size = self.operand_size(operands)
+        self.encode_modrm(b"\xf6" if size == 8 else b"\xf7", UNARY_OPERATIONS[mnemonic], operands[0], size, byte_registers=self.byte_registers(operands))
+
+    def encode_shift(self, mnemonic, operands):
+        destination, count = operands
+        size = self.operand_size([destination])
+        operation = SHIFT_OPERATIONS[mnemonic]
+        byte_registers = self.byte_registers([destination])
+
+        if isinstance(count, Register):
+            if count.name != "cl": raise AssemblerError(f"{mnemonic} can only shift by cl")
+            self.encode_modrm(b"\xd2" if size == 8 else b"\xd3", operation, destination, size, byte_registers=byte_registers)
+        elif count.is_constant() and count.addend == 1:
+            self.encode_modrm(b"\xd0" if size == 8 else b"\xd1", operation, destination, size, byte_registers=byte_registers)
+        else:
+            immediate, _ = self.immediate(count, 8)
+            self.encode_modrm(b"\xc0" if size == 8 else b"\xc1", operation, destination, size, immediate, byte_registers=byte_registers)
+
+    def encode_imul(self, mnemonic, operands):
+        if len(operands) == 1:
+            size = self.operand_size(operands)
+            self.encode_modrm(b"\xf6" if size == 8 else b"\xf7", 5, operands[0], size, byte_registers=self.byte_registers(operands))
+        elif len(operands) == 2 and not isinstance(operands[1], Value):
+            self.encode_modrm(b"\x0f\xaf", operands[0].number, operands[1], operands[0].size)
+        else:
+            destination, source, factor = operands if len(operands) == 3 else (operands[0], operands[0], operands[1])
+            if factor.is_constant() and fits_int8(factor.addend):
+                self.encode_modrm(b"\x6b", destination.number, source, destination.size, struct.pack('<b', factor.addend))
+            else:
+                immediate, fixup = self.immediate(factor, min(destination.size, 32))
+                self.encode_modrm(b"\x69", destination.number, source, destination.size, immediate, fixup)
+
+    def encode_push_pop(self, mnemonic, operands):
+        register = operands[0]
+        if not isinstance(register, Register) or register.size != 64: raise AssemblerError(f"{mnemonic} needs a 64-bit register")
+
+        opcode = (0x50 if mnemonic == "push" else 0x58) | register.number & 7
+        self.emit_instruction((b"\x41" if register.number >= 8 else b"") + bytes([opcode]))
+
+    def encode_branch(self, mnemonic, operands):
+        target = operands[0]
+
+        if isinstance(target, Register) or isinstance(target, Memory):
+            self.encode_modrm(b"\xff", 4 if mnemonic == "jmp" else 2, target, 32)
+            return
+
+        if mnemonic == "jmp":
+            opcode = b"\xe9"
+        elif mnemonic == "call":
+            opcode = b"\xe8"
+        else:
+            opcode = bytes([0x0F, 0x80 | CONDITION_CODES[mnemonic[1:]]])
+
+        self.emit_instruction(opcode + bytes(4), [(len(opcode), "rel32", target)])
+
+    def encode_setcc(self, mnemonic, operands):
+        self.encode_modrm(bytes([0x0F, 0x90 | CONDITION_CODES[mnemonic[3:]]]), 0, operands[0], 8, byte_registers=self.byte_registers(operands))
+
+    def encode_cmov(self, mnemonic, operands):
+        destination, source = operands
+        self.encode_modrm(bytes([0x0F, 0x40 | CONDITION_CODES[mnemonic[4:]]]), destination.number, source, destination.size)
+
+class SourceAssembler:
+    """
+    Front end for Assembler that reads the NASM dialect the generator and builtins are written in.
+
+    Only the parts of NASM those files use are understood: %macro with numbered parameters,
+    overloading by parameter count and %% local labels, %define, %ifdef/%ifndef/%else/%endif,
+    %include, equ, db/dw/dd/dq, resb/resw/resd/resq, sections, .local labels and the instructions
+    Assembler can encode. global and extern are accepted and ignored, every unit ends up in the
+    same executable.
+    """
+    def __init__(self, assembler: Assembler = None, includes: dict[str, str] = None, defines: dict[str, str] = None, include_cache: dict = None) -> None:
+        self.assembler = assembler or Assembler()
+        # Included files are looked up by their basename
+        self.includes = includes or {}
+        # What including a file left behind, shared between assemblers so each file is only read once
+        self.include_cache = include_cache
+        self.defines = dict(defines or {})
+        self.constants = {}
+        # name -> {parameter count -> body lines}
+        self.macros = {}
+        self.macro_expansions = 0
+        self.scope = ""
+        self.conditions = []
+        self.recording_macro = None
+
+    def assemble(self, source: str | Iterable[str], defines: dict[str, str] = None) -> Assembler:
+        """
+        Assemble one unit of source, defines only apply to this unit.
+
+        :param source: The source text, or chunks of it that each end at a line break.
+        """
+        saved_defines = self.defines
+        self.defines = {**self.defines, **(defines or {})}
+        self.assembler.section(".text")
+
+        lines = source.splitlines() if isinstance(source, str) else (line for chunk in source for line in chunk.splitlines())
+
+        try:
+            for line_number, line in enumerate(lines, start=1):
+                try:
+                    self.process_line(line)
+                except AssemblerError as e:
+                    raise AssemblerError(f"{e.message} on line {line_number}: {line.strip()}") from None
+        finally:
+            self.defines = saved_defines
+
+        if self.conditions: raise AssemblerError("Missing %endif")
+        if self.recording_macro is not None: raise AssemblerError("Missing %endmacro")
+
+        return self.assembler
+
+    @staticmethod
+    def strip_comment(line: str) -> str:
+        # Most lines have no quotes, the first ; is then always the comment
+        if '"' not in line and "'" not in line and '`' not in line: return line.partition(';')[0]
+
+        quote = None
+        for i, char in enumerate(line):
+            if quote is not None:
+                if char == quote: quote = None
+            elif char in "\"'`":
+                quote = char
+            elif char == ';':
+                return line[:i]
+
+        return line
+
+    @staticmethod
+    def split_operands(text: str) -> list[str]:
+        operands = []
+        depth = 0
+        quote = None
+        current = ""
+
+        for char in text:
+            if quote is not None:
+                if char == quote: quote = None
+            elif char in "\"'`":
+                quote = char
+            elif char == '[':
+                depth += 1
+            elif char == ']':
+                depth -= 1
+            elif char == ',' and depth == 0:
+                operands.append(current.strip())
+                current = ""
+                continue
+            current += char
+
+        if current.strip(): operands.append(current.strip())
+        return operands
+
+    def process_line(self, line: str) -> None:
+        text = self.strip_comment(line).strip()
+
+        if self.recording_macro is not None:
+            if text.lower().startswith("%endmacro"):
+                name, argc, body = self.recording_macro
+                self.macros.setdefault(name, {})[argc] = body
+                self.recording_macro = None
+            else:
+                self.recording_macro[2].append(line)
+            return
+
+        if not text: return
+
+        if text.startswith("%"):
+            self.process_directive(text)
+            return
+
+        if self.conditions and not all(self.conditions): return
+
+        for name, value in self.defines.items():
+            if value and name in text: text = re.sub(rf"\b{re.escape(name)}\b", value, text)
+
+        self.process_statement(text)
+
+    def process_directive(self, text: str) -> None:
+        directive, _, argument = text.partition(" ")
+        directive = directive.lower()
+        argument = argument.strip()
+
+        if directive in ("%ifdef", "%ifndef"):
+            defined = argument in self.defines
+            self.conditions.append(defined if directive == "%ifdef" else not defined)
+            return
+        if directive == "%else":
+            if not self.conditions: raise AssemblerError("%else without %if")
+            self.conditions[-1] = not self.conditions[-1]
+            return
+        if directive == "%endif":
+            if not self.conditions: raise AssemblerError("%endif without %if")
+            self.conditions.pop()
+            return
+
+        if self.conditions and not all(self.conditions): return
+
+        if directive == "%define":
+            name, _, value = argument.partition(" ")
+            self.defines[name] = value.strip()
+        elif directive == "%macro":
+            name, argc = argument.split()
+            self.recording_macro = (name, int(argc), [])
+        elif directive == "%include":
+            path = argument.strip("\"'")
+            name = path.replace("\\", "/").rsplit("/", 1)[-1]
+            if name not in self.includes: raise AssemblerError(f"Can't include {path}")
+
+            included = self.cached_include(name)
+            if included is not None:
+                included.replay(self)
+                return
+
+            for line in self.includes[name].splitlines():
+                self.process_line(line)
+        else:
+            raise AssemblerError(f"Unsupported directive {directive}")
+
+    def cached_include(self, name: str) -> 'IncludedFile | None':
+        """
+        Look up, or record, what including a file does, when that can be replayed instead.
+
+        Only files included before anything else was assembled are cached, their result then
+        depends on nothing but their text and the defines.
+
+        :return: The recorded include, or None when the file has to be processed line by line.
+        """
+        if self.include_cache is None or self.constants or self.macros or self.assembler.symbols: return None
+
+        key = (name, self.includes[name], tuple(sorted(self.defines.items())))
+        if key not in self.include_cache:
+            self.include_cache[key] = IncludedFile.record(self, name)
+
+        return self.include_cache[key]
+
+    def process_statement(self, text: str) -> None:
+        # name: on its own, or in front of a statement
+        match = LABEL_PATTERN.match(text) if ':' in text else None
+        if match is not None:
+            self.define_label(match.group(1))
+            text = match.group(2)
+            if not text: return
+
+        words = text.split(None, 1)
+        keyword = words[0].lower()
+        rest = words[1] if len(words) > 1 else ""
+
+        if keyword == "section" or keyword == "segment":
+            self.assembler.section(rest.split()[0])
+        elif keyword in ("global", "extern", "bits", "default"):
+            pass
+        elif keyword == "rep":
+            self.assembler.instruction(f"rep {rest.strip().lower()}")
+        elif words[0] in self.macros:
+            self.expand_macro(words[0], self.split_operands(rest))
+        elif keyword in self.assembler.encoders:
+            self.assembler.instruction(keyword, *[self.parse_operand(operand) for operand in self.split_operands(rest)])
+        else:
+            # label db ..., label equ ..., label resb ...
+            name = words[0]
+            directive_words = rest.split(None, 1)
+            if not directive_words: raise AssemblerError(f"Unrecognized statement {text}")
+
+            directive = directive_words[0].lower()
+            argument = directive_words[1] if len(directive_words) > 1 else ""
+
+            if directive == "equ":
+                self.define_constant(name, argument)
+            elif directive in ("db", "dw", "dd", "dq", "resb", "resw", "resd", "resq"):
+                self.define_label(name)
+                self.process_data(directive, argument)
+            elif keyword in ("db", "dw", "dd", "dq", "resb", "resw", "resd", "resq"):
+                self.process_data(keyword, rest)
+            else:
+                raise AssemblerError(f"Unrecognized statement {text}")
+
+    def expand_macro(self, name: str, arguments: list[str]) -> None:
+        body = self.macros[name].get(len(arguments))
+        if body is None: raise AssemblerError(f"Macro {name} doesn't take {len(arguments)} parameters")
+
+        self.macro_expansions += 1
+        expansion = self.macro_expansions
+
+        for line in body:
+            line = MACRO_LOCAL_PATTERN.sub(lambda match: f"..@{expansion}.{match.group(1)}", line)
+            # Highest numbers first, so %1 doesn't eat the start of %10
+            for number in range(len(arguments), 0, -1):
+                line = line.replace(f"%{number}", arguments[number - 1])
+            self.process_line(line)
+
+    def qualify(self, name: str) -> str:
+        # .local labels belong to the last ordinary label, ..@ labels come from macro expansions
+        if name.startswith(".") and not name.startswith("..@"): return self.scope + name
+        return name
+
+    def define_label(self, name: str) -> None:
+        if not name.startswith("."): self.scope = name
+        self.assembler.label(self.qualify(name))
+
+    def define_constant(self, name: str, expression: str) -> None:
+        value = self.evaluate(expression)
+        self.constants[name] = value
+        if value.is_constant():
+            self.assembler.define_symbol(name, None, value.addend)
+
+    def process_data(self, directive: str, argument: str) -> None:
+        if directive.startswith("res"):
+            unit = {"resb": 1, "resw": 2, "resd": 4, "resq": 8}[directive]
+            count = self.evaluate(argument)
+            if not count.is_constant(): raise AssemblerError(f"{directive} needs a constant size")
+            if unit > 1: self.assembler.align_bss(unit)
+            self.assembler.reserve(unit * count.addend)
+            return
+
+        unit = {"db": 1, "dw": 2, "dd": 4, "dq": 8}[directive]
+        for operand in self.split_operands(argument):
+            if operand[0] in "\"'`" and operand[-1] == operand[0] and (unit == 1 or len(operand) > 3):
+                data = operand[1:-1].encode('utf-8')
+                padding = (-len(data)) % unit
+                self.assembler.data(data + bytes(padding))
+            else:
+                self.assembler.data_value(self.evaluate(operand), unit)
+
+    def parse_operand(self, text: str):
+        text = text.strip()
+        size = None
+
+        words = text.split(None, 1)
+        # Jumps and calls are always near already
+        if len(words) == 2 and words[0].lower() == "near":
+            text = words[1].strip()
+            words = text.split(None, 1)
+
+        if len(words) == 2 and words[0].lower() in SIZE_KEYWORDS:
+            size = SIZE_KEYWORDS[words[0].lower()]
+            text = words[1].strip()
+
+        if text.startswith("[") and text.endswith("]"):
+            return self.parse_memory(text[1:-1], size)
+
+        if text.lower() in REGISTERS: return Register(text.lower())
+        return self.evaluate(text)
+
+    def parse_memory(self, text: str, size: int) -> Memory:
+        base = None
+        index = None
+        scale = 1
+        displacement = Value()
+
+        terms = ADDRESS_TERM_PATTERN.findall(text.replace("rel ", ""))
+        for sign, term in terms:
+            term = term.strip()
+            factors = [factor.strip() for factor in term.split("*")]
+            registers = [factor for factor in factors if factor.lower() in REGISTERS]
+
+            if registers:
+                register = Register(registers[0].lower())
+                other = [factor for factor in factors if factor.lower() not in REGISTERS]
+                term_scale = self.evaluate(other[0]).addend if other else 1
+
+                if sign == "-": raise AssemblerError("Registers can't be subtracted in an address")
+                if term_scale == 1 and base is None:
+                    base = register
+                elif index is None:
+                    index, scale = register, term_scale
+                else:
+                    raise AssemblerError(f"Too many registers in [{text}]")
+            else:
+                value = self.evaluate(term)
+                if sign == "-":
+                    if not value.is_constant(): raise AssemblerError("Symbols can't be subtracted in an address")
+                    value = Value(None, -value.addend)
+                displacement = self.add_values(displacement, value)
+
+        return Memory(base, index, scale, displacement, size)
+
+    @staticmethod
+    def add_values(left: Value, right: Value) -> Value:
+        if left.symbol is not None and right.symbol is not None: raise AssemblerError("Can't add two symbols")
+        return Value(left.symbol or right.symbol, left.addend + right.addend)
+
+    def evaluate(self, expression: str) -> Value:
+        """
+        Evaluate + - * expressions over numbers, character literals, constants and symbols.
+        """
+        expression = expression.strip()
+        if NUMBER_PATTERN.fullmatch(expression): return Value(None, int(expression.replace("_", ""), 0))
+
+        tokens = EXPRESSION_TOKEN_PATTERN.findall(expression)
+        if not tokens: raise AssemblerError(f"Can't evaluate '{expression}'")
+        position = 0
+
+        def peek():
+            return tokens[position] if position < len(tokens) else None
+
+        def take():
+            nonlocal position
+            position += 1
+            return tokens[position - 1]
+
+        def primary() -> Value:
+            token = take()
+            if token == "(":
+                value = expression_sum()
+                take()
+                return value
+            if token == "-":
+                value = primary()
+                if not value.is_constant(): raise AssemblerError("Can't negate a symbol")
+                return Value(None, -value.addend)
+            if token[0].isdigit():
+                return Value(None, int(token.replace("_", ""), 0))
+            if token[0] in "'\"`":
+                return Value(None, int.from_bytes(token[1:-1].encode('utf-8'), 'little'))
+
+            name = self.qualify(token)
+            if name in self.constants: return self.constants[name]
+            return Value(name, 0)
+
+        def product() -> Value:
+            value = primary()
+            while peek() == "*":
+                take()
+                other = primary()
+                if not value.is_constant() or not other.is_constant(): raise AssemblerError("Can't multiply a symbol")
+                value = Value(None, value.addend * other.addend)
+            return value
+
+        def expression_sum() -> Value:
+            value = product()
+            while peek() in ("+", "-"):
+                operator = take()
+                other = product()
+                if operator == "-":
+                    if not other.is_constant(): raise AssemblerError("Can't subtract a symbol")
+                    other = Value(None, -other.addend)
+                value = self.add_values(value, other)
+            return value
+
+        value = expression_sum()
+        if position != len(tokens): raise AssemblerError(f"Can't evaluate '{expression}'")
+        return value
+
+class IncludedFile:
+    """
+    The macros, constants and defines an included file leaves behind.
+
+    Files that emit anything can't be replayed this way, recording one of those gives None.
+    """
+    def __init__(self, macros: dict, constants: dict, symbols: dict, defines: dict) -> None:
+        self.macros = macros
+        self.constants = constants
+        self.symbols = symbols
+        self.defines = defines
+
+    @staticmethod
+    def record(including: SourceAssembler, name: str) -> 'IncludedFile | None':
+        # Processed line by line like a %include is, assemble() would drop the defines made by the file
+        source_assembler = SourceAssembler(includes=including.includes, defines=including.defines)
+        for line in including.includes[name].splitlines():
+            source_assembler.process_line(line)
+
+        if source_assembler.conditions or source_assembler.recording_macro is not None: return None
+
+        assembler = source_assembler.assembler
+        if any(assembler.sections.values()) or assembler.bss_size or assembler.fixups or assembler.current_section != "text": return None
+        if any(section is not None for section, _ in assembler.symbols.values()): return None
+
+        defines = {name: value for name, value in source_assembler.defines.items() if including.defines.get(name) != value}
+        return IncludedFile(source_assembler.macros, source_assembler.constants, assembler.symbols, defines)
+
+    def replay(self, source_assembler: SourceAssembler) -> None:
+        # Macro bodies are never changed once recorded, they can be shared
+        for name, bodies in self.macros.items():
+            source_assembler.macros.setdefault(name, {}).update(bodies)
+        source_assembler.constants.update(self.constants)
+        source_assembler.defines.update(self.defines)
+
+        for name, (section, value) in self.symbols.items():
+            source_assembler.assembler.define_symbol(name, section, value)
+
+class ELF64Executable:
+    """
+    Lays out an Assembler's sections as a static x86-64 Linux executable.
+
+    .text, .rodata and .data/.bss each get their own page aligned PT_LOAD segment with the
+    matching permissions, and section headers plus a symbol table are included so objdump
+    and gdb can make sense of the result.
+    """
+    def __init__(self, assembler: Assembler, entry_symbol: str = "_start") -> None:
+        self.assembler = assembler
+        self.entry_symbol = entry_symbol
+        self.section_addresses = {}
+        self.section_offsets = {}
+
+    @staticmethod
+    def align(value: int, alignment: int) -> int:
+        return (value + alignment - 1) // alignment * alignment
+
+    def layout(self) -> int:
+        """
+        Assign file offsets and addresses to every section.
+
+        :return: The file offset where the section contents end.
+        """
+        offset = PAGE_SIZE
+        for section in ("text", "rodata", "data"):
+            self.section_offsets[section] = offset
+            self.section_addresses[section] = BASE_ADDRESS + offset
+            offset = self.align(offset + len(self.assembler.sections[section]), PAGE_SIZE) if self.assembler.sections[section] else offset
+
+        end_of_contents = self.section_offsets["data"] + len(self.assembler.sections["data"])
+
+        # .bss shares the page alignment of the segment it follows, but has no bytes in the file
+        self.section_offsets["bss"] = end_of_contents
+        self.section_addresses["bss"] = BASE_ADDRESS + self.align(end_of_contents, 16)
+        return end_of_contents
+
+    def symbol_address(self, name: str) -> int:
+        if name not in self.assembler.symbols: raise AssemblerError(f"Undefined symbol {name}")
+
+        section, value = self.assembler.symbols[name]
+        if section is None: return value
+        return self.section_addresses[section] + value
+
+    def resolve(self, value: Value) -> int:
+        if value.symbol is None: return value.addend
+        return self.symbol_address(value.symbol) + value.addend
+
+    def apply_fixups(self) -> dict[str, bytearray]:
+        sections = {name: bytearray(data) for name, data in self.assembler.sections.items()}
+
+        for fixup in self.assembler.fixups:
+            target = self.resolve(fixup.value)
+            if fixup.kind == "rel32":
+                field = struct.pack('<i', target - (self.section_addresses[fixup.section] + fixup.instruction_end))
+            elif fixup.kind == "abs32":
+                if not fits_int32(target): raise AssemblerError(f"Address of {fixup.value} doesn't fit in 32 bits")
+                field = struct.pack('<i', target)
+            else:
+                field = struct.pack('<Q', target & (2 ** 64 - 1))
+
+            sections[fixup.section][fixup.offset:fixup.offset + len(field)] = field
+
+        return sections
+
+    def build(self) -> bytes:
+        end_of_contents = self.layout()
+        sections = self.apply_fixups()
+        entry = self.symbol_address(self.entry_symbol)
+        bss_size = self.assembler.bss_size
+
+        # Program headers, one PT_LOAD per non-empty segment
+        PT_LOAD, PF_X, PF_W, PF_R = 1, 1, 2, 4
+        segments = []
+        if sections["text"]:
+            segments.append((PF_R | PF_X, self.section_offsets["text"], self.section_addresses["text"], len(sections["text"]), len(sections["text"])))
+        if sections["rodata"]:
+            segments.append((PF_R, self.section_offsets["rodata"], self.section_addresses["rodata"], len(sections["rodata"]), len(sections["rodata"])))
+        if sections["data"] or bss_size:
+            data_start = self.section_offsets["data"]
+            memory_size = self.section_addresses["bss"] + bss_size - self.section_addresses["data"]
+            segments.append((PF_R | PF_W, data_start, self.section_addresses["data"], len(sections["data"]), memory_size))
+
+        # Section headers, with the symbol table and string tables after the contents
+        section_names = bytearray(b"\0")
+
+        def name_offset(name: str) -> int:
+            offset = len(section_names)
+            section_names.extend(name.encode() + b"\0")
+            return offset
+
+        symbol_names = bytearray(b"\0")
+        local_symbols = []
+        global_symbols = []
+        section_indexes = {"text": 1, "rodata": 2, "data": 3, "bss": 4}
+
+        for name, (section, value) in sorted(self.assembler.symbols.items(), key=lambda item: item[0]):
+            # Constants from equ would only bloat the table, the builtins alone define hundreds
+            if section is None: continue
+
+            name_index = len(symbol_names)
+            symbol_names.extend(name.encode() + b"\0")
+            address = self.section_addresses[section] + value
+            section_index = section_indexes[section]
+
+            if name == self.entry_symbol:
+                global_symbols.append(struct.pack('<IBBHQQ', name_index, 0x10, 0, section_index, address, 0))
+            else:
+                local_symbols.append(struct.pack('<IBBHQQ', name_index, 0x00, 0, section_index, address, 0))
+
+        symbol_table = bytes(24) + b"".join(local_symbols) + b"".join(global_symbols)
+        symbol_table_offset = self.align(end_of_contents, 8)
+        symbol_names_offset = symbol_table_offset + len(symbol_table)
+
+        SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB, SHT_NOBITS = 1, 2, 3, 8
+        SHF_WRITE, SHF_ALLOC, SHF_EXECINSTR = 1, 2, 4
+        headers = [
+            (name_offset(".text"), SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, self.section_addresses["text"], self.section_offsets["text"], len(sections["text"]), 0, 0, 16, 0),
+            (name_offset(".rodata"), SHT_PROGBITS, SHF_ALLOC, self.section_addresses["rodata"], self.section_offsets["rodata"], len(sections["rodata"]), 0, 0, 16, 0),
+            (name_offset(".data"), SHT_PROGBITS, SHF_ALLOC | SHF_WRITE, self.section_addresses["data"], self.section_offsets["data"], len(sections["data"]), 0, 0, 16, 0),
+            (name_offset(".bss"), SHT_NOBITS, SHF_ALLOC | SHF_WRITE, self.section_addresses["bss"], self.section_offsets["bss"], bss_size, 0, 0, 16, 0),
+            (name_offset(".symtab"), SHT_SYMTAB, 0, 0, symbol_table_offset, len(symbol_table), 6, 1 + len(local_symbols), 8, 24),
+            (name_offset(".strtab"), SHT_STRTAB, 0, 0, symbol_names_offset, len(symbol_names), 0, 0, 1, 0),
+        ]
+        section_names_offset = symbol_names_offset + len(symbol_names)
+        headers.append((name_offset(".shstrtab"), SHT_STRTAB, 0, 0, section_names_offset, len(section_names) + len(".shstrtab") + 1, 0, 0, 1, 0))
+        section_names.extend(b".shstrtab\0")
+        section_headers_offset = self.align(section_names_offset + len(section_names), 8)
+
+        # ELF header
+        image = bytearray(struct.pack(
+            '<16sHHIQQQIHHHHHH',
+            b"\x7fELF\x02\x01\x01" + bytes(9),
+            2,      # ET_EXEC
+            0x3E,   # EM_X86_64
+            1,
+            entry,
+            64,
+            section_headers_offset,
+            0,
+            64,
+            56,
+            len(segments),
+            64,
+            len(headers) + 1,
+            len(headers),
+        ))
+        for flags, offset, address, file_size, memory_size in segments:
+            image += struct.pack('<IIQQQQQQ', PT_LOAD, flags, offset, address, address, file_size, memory_size, PAGE_SIZE)
+
+        for section in ("text", "rodata", "data"):
+            if not sections[section]: continue
+            image.extend(bytes(self.section_offsets[section] - len(image)))
+            image.extend(sections[section])
+
+        image.extend(bytes(symbol_table_offset - len(image)))
+        image += symbol_table + symbol_names + section_names
+        image.extend(bytes(section_headers_offset - len(image)))
+        image += bytes(64)
+        for header in headers:
+            image += struct.pack('<IIQQQQIIQQ', *header)
+
+        return bytes(image)
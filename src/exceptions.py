@@ -1,5 +1,23 @@
+import threading
+from contextlib import contextmanager
+
 SUPPRESS_TRACEBACK = True
 
+# Per thread, so a thread compiling through the library API never exits the whole process
+ERROR_MODE = threading.local()
+
+@contextmanager
+def raising_errors():
+    """
+    Make raise_err raise in the current thread, whatever SUPPRESS_TRACEBACK says.
+    """
+    previous = getattr(ERROR_MODE, "raise_errors", False)
+    ERROR_MODE.raise_errors = True
+    try:
+        yield
+    finally:
+        ERROR_MODE.raise_errors = previous
+
 class PandaCompilerError(Exception):
     """Base class for other panda compiler exceptions"""
     def __init__(self, message=""):
@@ -12,7 +30,7 @@ class PandaCompilerError(Exception):
         exit(1)
 
     def raise_err(self, exit=True):
-        if SUPPRESS_TRACEBACK: 
+        if SUPPRESS_TRACEBACK and not getattr(ERROR_MODE, "raise_errors", False):
             print(f"{self.__class__.__name__}: {self.message}")
             if exit: self.exit_program()
         else:
@@ -45,7 +63,45 @@ class UnexpectedTokenError(ParsingError):
         self.message = message
         super().__init__(self.message)
 
+class IntegerOutOfRangeError(ParsingError):
+    def __init__(self, message="Integer does not fit in 64 bits"):
+        self.message = message
+        super().__init__(self.message)
+
+class UndefinedVariableError(ParsingError):
+    def __init__(self, message="Variable used before it was declared"):
+        self.message = message
+        super().__init__(self.message)
+
+class RedeclaredVariableError(ParsingError):
+    def __init__(self, message="Variable declared twice"):
+        self.message = message
+        super().__init__(self.message)
+
+class ImmutableVariableError(ParsingError):
+    """Exception raised when a variable declared with let is assigned to."""
+    def __init__(self, message="Variable declared with let can't be assigned to"):
+        self.message = message
+        super().__init__(self.message)
+
 class UnrecognizedTokenError(ParsingError):
     def __init__(self, message="Urecognized token encountered"):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class ParsingErrors(ParsingError):
+    """Exception raised after a whole file was parsed, holding every error found in it."""
+    def __init__(self, errors, message=None):
+        self.errors = errors
+        self.message = message or f"{len(errors)} errors found\n" + "\n".join(f"{error.__class__.__name__}: {error.message}" for error in errors)
+        super().__init__(self.message)
+
+#
+#   Assembly Errors
+#
+
+class AssemblerError(PandaCompilerError):
+    """Exception raised when the built-in ELF64 assembler can't assemble a program."""
+    def __init__(self, message="Unable to assemble program"):
+        self.message = message
+        super().__init__(self.message)
@@ -1,31 +1,132 @@
-import io
 import os
+import re
 import sys
 import subprocess
 import shutil
+import tempfile
+import functools
+import threading
 from enum import Enum, auto
 
 from parse import AST_NODE_TYPE
 from version import VERSION
+from cache import BuiltinsCache
+from elf64 import Assembler, SourceAssembler, ELF64Executable
+from exceptions import AssemblerError
+from profiler import phase, count
+from optimizer import DEFAULT_OPTIMIZATION_LEVEL
+from ir import IR_OPCODE, IRBuilder, Instruction, fits_int32
+from regalloc import LinearScanAllocator, CALL_PRESERVED_REGISTERS
+from peephole import AsmInstruction, PeepholeOptimizer, RUNTIME_MACROS
 
 ALWAYS_DEFAULT_EXIT_WITH_0 = True
 USE_ABSOLUTE_INCLUDE_PATH = True
+# Collect prints in a runtime stdout buffer and merge consecutive constant prints into one string
+BUFFER_OUTPUT = True
+# Stream files with sendfile, falling back to mmap, instead of copying them with read and write
+ZERO_COPY_FILES = True
+
+# Runtime macros with an inline and a shared form in builtins-elf64.asm, by the IR instruction calling them
+BUILTIN_MACROS = {IR_OPCODE.PRINT_STRING: "print", IR_OPCODE.EXIT: "exit"}
+# Bytes of .text taken by one call site of each, (inlined, calling the shared routine), as the elf64 backend encodes them
+BUILTIN_CALL_SITE_SIZES = {"print": (65, 17), "exit": (17, 10)}
+# Below -O2 exit is inlined and print calls the runtime, like they always did
+DEFAULT_INLINED_BUILTINS = frozenset({"exit"})
+# -O2 inlines a builtin at up to this many call sites, past it the copies cost more in instruction cache than the calls save
+INLINE_CALL_SITE_LIMIT = 64
+
+BUILTINS_PATH = os.path.normpath(os.path.join(__file__, "../lib/builtins-elf64.asm"))
+# Where nasm and ld get their files when nothing may be written to disk
+TMPFS_DIRECTORY = "/dev/shm"
+# Stands in for the directory holding the builtins until the program is written out
+LIB_DIRECTORY_PLACEHOLDER = "#{LIB_DIRECTORY}"
+
+@functools.lru_cache(maxsize=1)
+def in_memory_directory() -> str:
+    """
+    Without a writable tmpfs the intermediates of nasm and ld have to go to the system temporary directory,
+    which is usually on disk, so that is warned about on stderr. The directory is looked up once per process.
+
+    :return: A directory on tmpfs, or the system temporary directory when there is none.
+    """
+    if os.path.isdir(TMPFS_DIRECTORY) and os.access(TMPFS_DIRECTORY, os.W_OK): return TMPFS_DIRECTORY
+
+    temporary_directory = tempfile.gettempdir()
+    print(f"Warning: {TMPFS_DIRECTORY} is missing or not writable, nasm and ld write their intermediates to "
+          f"{temporary_directory} instead, use --assembler elf64 to keep them off disk.", file=sys.stderr)
+    return temporary_directory
+
+def write_executable(output_path: str, image: bytes) -> str:
+    """
+    Write an executable's bytes to output_path.
+
+    :return: The absolute path of the executable.
+    """
+    executable_path = os.path.abspath(output_path)
+    # Write next to the output and rename, so a running copy of the old executable is never truncated.
+    # The thread is part of the name, threads of one process may write the same output
+    tmp_path = f"{executable_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, 'wb') as executable_file:
+        executable_file.write(image)
+    os.chmod(tmp_path, 0o755)
+    os.replace(tmp_path, executable_path)
+
+    return executable_path
 
 class ASSEMBLER(Enum):
     NASM = auto()
+    # Assembled and linked in-process by elf64.py, without nasm or ld
+    ELF64 = auto()
 
 class Program:
-    def __init__(self, assembly_source: str, program_name: str = None) -> None:
-        self.assembly_source = assembly_source
+    def __init__(self, assembly_source: str | list[str], program_name: str = None, assembler_flags: list[str] = None) -> None:
+        # Generated programs hand over the generator's list of chunks, which is only joined when written out
+        self.assembly_chunks = [assembly_source] if isinstance(assembly_source, str) else assembly_source
+        self.include_prefix = LIB_DIRECTORY_PLACEHOLDER
         self.executable_path = None
+        # The executable's bytes, when it was built in memory instead of to a path
+        self.executable_image = None
         self.program_name = program_name
+        self.assembler_flags = assembler_flags or []
+        # Set on child programs: where their .asm/.o end up, and the cache they come from, if any
+        self.library_directory = None
+        self.builtins_cache = None
+        self.cache_key = None
+        self.cache_status = None
         self.child_programs = []
         self.object_filenames = []
 
     def add_child(self, child_program):
         self.child_programs.append(child_program)
 
-    def compile(self, output_path: str, full_output=False):
+    @property
+    def assembly_source(self) -> str | None:
+        if self.assembly_chunks is None: return None
+        return "".join(self.emit_assembly())
+
+    def emit_assembly(self):
+        """
+        Yield the chunks of the program, with the lib directory placeholder resolved as they go by.
+        """
+        include_prefix = self.include_prefix
+        for chunk in self.assembly_chunks:
+            if LIB_DIRECTORY_PLACEHOLDER in chunk: chunk = chunk.replace(LIB_DIRECTORY_PLACEHOLDER, include_prefix)
+            yield chunk
+
+    def write_assembly(self, asm_file) -> int:
+        """
+        Write the program to an open file or pipe.
+
+        :return: The number of characters written.
+        """
+        written = 0
+        for chunk in self.emit_assembly():
+            asm_file.write(chunk)
+            written += len(chunk)
+
+        return written
+
+    def compile(self, output_path: str, full_output=False, output_folder_path: str = None):
         base_name = os.path.splitext(os.path.basename(output_path))[0]
         # Ensure dir_name is only the directory part of output_path
         dir_name = os.path.dirname(output_path) if os.path.dirname(output_path) else '.'
@@ -33,20 +134,34 @@ class Program:
         # Correct handling for relative paths like './tests/test.pnda/..'
         dir_name = os.path.normpath(dir_name)  # Normalize the path to resolve '..'
 
-        output_folder_path = os.path.normpath(os.path.join(dir_name, 'output/'))
+        # Without full output the intermediates go to a private folder, so compiles of several
+        # programs in the same directory can run at the same time. Children share their parent's
+        if output_folder_path is None and full_output:
+            output_folder_path = os.path.normpath(os.path.join(dir_name, 'output/'))
+        elif output_folder_path is None:
+            os.makedirs(dir_name, exist_ok=True)
+            output_folder_path = tempfile.mkdtemp(prefix='output-', dir=dir_name)
         lib_path = os.path.normpath(os.path.join(output_folder_path, 'lib/'))
 
-        if USE_ABSOLUTE_INCLUDE_PATH == True:
-            self.assembly_source = self.assembly_source.replace("#{LIB_DIRECTORY}", os.path.abspath(lib_path) + "/")
-        else:
-            self.assembly_source = self.assembly_source.replace("#{LIB_DIRECTORY}", "lib/")
-
         # Ensure the directory exists
         os.makedirs(dir_name, exist_ok=True)
         os.makedirs(lib_path, exist_ok=True)
 
+        include_directory = lib_path
+        cached_object_filenames = []
         for child_program in self.child_programs:
-            child_program.compile(output_path, full_output)    
+            child_program.compile(output_path, full_output, output_folder_path)
+            self.object_filenames.extend(child_program.object_filenames)
+
+            if child_program.cache_status is not None:
+                include_directory = child_program.library_directory
+                cached_object_filenames.extend(child_program.object_filenames)
+
+        # The placeholder is resolved while the assembly is written out
+        if USE_ABSOLUTE_INCLUDE_PATH == True:
+            self.include_prefix = os.path.abspath(include_directory) + "/"
+        else:
+            self.include_prefix = "lib/"
 
         if self.program_name == None:
             # Generate the filenames for assembly and object files
@@ -58,10 +173,11 @@ class Program:
             try:
                 # Write assembly source to file
                 with open(asm_filename, 'w') as asm_file:
-                    asm_file.write(self.assembly_source)
+                    count("asm_bytes", self.write_assembly(asm_file))
 
                 # Assemble with NASM
-                subprocess.run(["nasm", "-f", "elf64", "-o", obj_filename, asm_filename], check=True, stderr=subprocess.PIPE)
+                with phase("nasm"):
+                    subprocess.run(["nasm", "-f", "elf64"] + self.assembler_flags + ["-o", obj_filename, asm_filename], check=True, stderr=subprocess.PIPE)
 
                 self.link(output_path, self.object_filenames, full_output=full_output)
             except subprocess.CalledProcessError as e:
@@ -80,9 +196,25 @@ class Program:
                 if not os.listdir(output_folder_path) or full_output == False: shutil.rmtree(output_folder_path) # os.rmdir(output_folder_path)
 
                 for object_filename in self.object_filenames:
+                    if object_filename in cached_object_filenames: continue
+
                     path = os.path.join(dir_name, object_filename)
                     if os.path.exists(path): os.remove(path)
+        elif self.builtins_cache is not None:
+            if self.cache_status != "hit":
+                with phase("nasm"):
+                    self.library_directory = self.builtins_cache.store(self.cache_key, self.program_name, self.assembly_source, self.assembler_flags)
+                self.cache_status = "miss"
+
+            self.object_filenames.append(os.path.join(self.library_directory, f"{self.program_name}.o"))
+
+            # Relative includes and full output both expect the files next to the program
+            if full_output or not USE_ABSOLUTE_INCLUDE_PATH:
+                for extension in [".asm", ".o"]:
+                    shutil.copy(os.path.join(self.library_directory, f"{self.program_name}{extension}"), lib_path)
         else:
+            self.library_directory = lib_path
+
             # Generate the filenames for assembly and object files
             asm_filename = os.path.join(lib_path, f"{self.program_name}.asm")
             obj_filename = os.path.join(lib_path, f"{self.program_name}.o")
@@ -91,10 +223,11 @@ class Program:
 
             try:
                 with open(asm_filename, 'w') as asm_file:
-                    asm_file.write(self.assembly_source)
+                    count("asm_bytes", self.write_assembly(asm_file))
 
                 # Assemble with NASM
-                subprocess.run(["nasm", "-f", "elf64", "-o", obj_filename, asm_filename], check=True, stderr=subprocess.PIPE)
+                with phase("nasm"):
+                    subprocess.run(["nasm", "-f", "elf64"] + self.assembler_flags + ["-o", obj_filename, asm_filename], check=True, stderr=subprocess.PIPE)
             except subprocess.CalledProcessError as e:
                 print(f"Error during generation:")
                 print(e.stderr.decode())
@@ -109,7 +242,52 @@ class Program:
 
         # Link with ld
         self.executable_path = os.path.abspath(output_path)
-        subprocess.run(["ld", "-o", self.executable_path] + object_filenames, check=True, stderr=subprocess.PIPE)
+        with phase("ld"):
+            subprocess.run(["ld", "-o", self.executable_path] + object_filenames, check=True, stderr=subprocess.PIPE)
+
+    def compile_in_memory(self, name: str) -> bytes:
+        """
+        Build the program without keeping anything on disk.
+
+        nasm and ld only work with files, so they get a private directory on tmpfs, which is removed
+        once the executable has been read back.
+
+        :return: The executable's bytes.
+        """
+        working_directory = tempfile.mkdtemp(prefix='panda-', dir=in_memory_directory())
+        try:
+            self.compile(os.path.join(working_directory, name))
+            with open(self.executable_path, 'rb') as executable_file:
+                self.executable_image = executable_file.read()
+        finally:
+            shutil.rmtree(working_directory)
+
+        self.executable_path = None
+        return self.executable_image
+
+    def run_in_memory(self, name: str = "panda") -> None:
+        """
+        Executes the program built by compile_in_memory from a memfd_create file and prints its exit code.
+        """
+        if self.executable_image is None:
+            print("Executable does not exist. Please compile the program first.")
+            return
+
+        # Closed on exec, so the program never sees it
+        memory_file = os.memfd_create(name, os.MFD_CLOEXEC)
+        try:
+            with phase("load"):
+                with open(memory_file, 'wb', closefd=False) as executable_file:
+                    executable_file.write(self.executable_image)
+
+            print(f"Executing {name} from memory...")
+
+            # The kernel opens /proc/self/fd while the exec still has the descriptor, close_fds would close it first
+            with phase("run"), subprocess.Popen([name], executable=f"/proc/self/fd/{memory_file}", close_fds=False, stdout=sys.stdout, stderr=sys.stderr, stdin=sys.stdin) as process:
+                process.wait()
+                print(f"Process exited with code {process.returncode}")
+        finally:
+            os.close(memory_file)
 
     def run(self):
         """
@@ -118,17 +296,94 @@ class Program:
         if self.executable_path and os.path.exists(self.executable_path):
             print(f"Executing {os.path.abspath(self.executable_path)}...")
 
-            with subprocess.Popen([self.executable_path], stdout=sys.stdout, stderr=sys.stderr, stdin=sys.stdin) as process:
+            with phase("run"), subprocess.Popen([self.executable_path], stdout=sys.stdout, stderr=sys.stderr, stdin=sys.stdin) as process:
                 process.wait()  # Wait for the process to complete
                 # After the process has completed, print the exit code
                 print(f"Process exited with code {process.returncode}")
         else:
             print("Executable does not exist. Please compile the program first.")
 
+class ProgramELF64(Program):
+    """
+    A program that is assembled and linked in-process, straight to a static ELF64 executable.
+
+    The builtins are assembled into the same executable, once for their macros through the
+    program's %include and once more with BUILTINS_OBJECT defined for the runtime routines.
+    """
+    def __init__(self, assembly_source: str | list[str], builtins_source: str) -> None:
+        super().__init__(assembly_source)
+        self.builtins_source = builtins_source
+        self.instruction_count = 0
+
+    def assemble(self) -> bytes:
+        with phase("assemble"):
+            source_assembler = SourceAssembler(includes={"builtins-elf64.asm": self.builtins_source}, include_cache=BUILTINS_INCLUDE_CACHE)
+            source_assembler.assemble(self.emit_assembly())
+            source_assembler.assembler.append(assemble_builtins_object(self.builtins_source))
+
+        self.instruction_count = source_assembler.assembler.instruction_count
+        count("asm_bytes", sum(len(chunk) for chunk in self.assembly_chunks) + len(self.builtins_source))
+        count("instructions", self.instruction_count)
+
+        with phase("link"):
+            return ELF64Executable(source_assembler.assembler).build()
+
+    def compile(self, output_path: str, full_output=False, output_folder_path: str = None):
+        dir_name = os.path.normpath(os.path.dirname(output_path) if os.path.dirname(output_path) else '.')
+        base_name = os.path.splitext(os.path.basename(output_path))[0]
+        os.makedirs(dir_name, exist_ok=True)
+
+        self.include_prefix = "lib/"
+
+        # There are no object files, full output only keeps the sources around for reading
+        if full_output:
+            output_folder_path = output_folder_path or os.path.normpath(os.path.join(dir_name, 'output/'))
+            os.makedirs(os.path.join(output_folder_path, 'lib/'), exist_ok=True)
+
+            with open(os.path.join(output_folder_path, f"{base_name}.asm"), 'w') as asm_file:
+                self.write_assembly(asm_file)
+            with open(os.path.join(output_folder_path, 'lib/', "builtins-elf64.asm"), 'w') as asm_file:
+                asm_file.write(self.builtins_source)
+
+        self.executable_path = write_executable(output_path, self.compile_in_memory(base_name))
+
+    def compile_in_memory(self, name: str) -> bytes:
+        """
+        Assemble and link the program, there are no intermediates to keep anywhere.
+
+        :return: The executable's bytes.
+        """
+        self.include_prefix = "lib/"
+
+        try:
+            self.executable_image = self.assemble()
+        except AssemblerError as e:
+            e.raise_err()
+            raise
+
+        return self.executable_image
+
+# The macros and constants the builtins leave behind when a program includes them, shared by
+# every ELF64 compile in the process
+BUILTINS_INCLUDE_CACHE = {}
+
+@functools.lru_cache(maxsize=4)
+def assemble_builtins_object(builtins_source: str) -> Assembler:
+    """
+    Assemble the runtime routines of the builtins once per process, every ELF64 program appends them.
+    """
+    return SourceAssembler().assemble(builtins_source, defines={"BUILTINS_OBJECT": ""})
+
 class StringStream:
+    """
+    Collects generated lines as a list of chunks.
+
+    Appending a section to its parent only moves references to its chunks, the text itself is
+    never copied until the finished program is written out.
+    """
     def __init__(self, indent_level=0) -> None:
         self.indent_level = indent_level
-        self.stream = io.StringIO()
+        self.chunks = []
 
     def increase_indent(self) -> None:
         self.indent_level += 4
@@ -137,23 +392,23 @@ class StringStream:
         self.indent_level = max(0, self.indent_level - 4)
 
     def write(self, text) -> None:
-        indented_text = ' ' * self.indent_level + text + '\n'
-        self.stream.write(indented_text)
+        self.chunks.append(f"{' ' * self.indent_level}{text}\n")
+
+    def write_chunks(self, chunks: list[str]) -> None:
+        self.chunks.extend(chunks)
 
     def close(self) -> None:
-        self.stream.close()
+        self.chunks = []
 
     def get_value(self) -> str:
-        return self.stream.getvalue()
-    
+        return "".join(self.chunks)
+
     def trim_trailing_newlines(self):
         """
-        Trim trailing newlines from the stream's content.
+        Drop trailing blank lines and the newline ending the last line.
         """
-        content = self.stream.getvalue()
-        trimmed_content = content.rstrip('\n')
-        self.close()
-        self.stream = io.StringIO(trimmed_content)
+        while self.chunks and not self.chunks[-1].strip(): self.chunks.pop()
+        if self.chunks: self.chunks[-1] = self.chunks[-1].rstrip('\n')
 
 class Section(StringStream):
     def __init__(self, label, indent_level=4) -> None:
@@ -171,34 +426,322 @@ class MacroSection(Section):
         self.decrease_indent()
         self.write("%endmacro")
 
+# Bytes that can go inside a quoted NASM string
+PRINTABLE_DB_BYTES = frozenset(byte for byte in range(32, 127) if byte != ord('"'))
+DB_OPERAND_PATTERN = re.compile(rb'[\x20\x21\x23-\x7e]+|[\x00-\x1f\x22\x7f-\xff]')
+
+class ConstantPool:
+    """
+    Interns the constant strings of a program so each distinct string is emitted once.
+
+    Strings are stored NUL terminated with a trailing newline, exactly as print expects them.
+    When one string is a suffix of another, it gets no storage of its own and its label points
+    into the longer one. Every label also gets a {label}_len symbol holding its length without
+    the NUL terminator, so print never has to scan for it at runtime.
+    """
+    def __init__(self, label_prefix: str = "_cs") -> None:
+        self.label_prefix = label_prefix
+        self.labels = {}
+        self.references = 0
+        self.referenced_bytes = 0
+
+    @staticmethod
+    def encode(value: str, newline: bool = True) -> bytes:
+        return value.encode('utf-8') + (b"\n\0" if newline else b"\0")
+
+    def add(self, value: str, newline: bool = True) -> str:
+        """
+        Intern a string and return the label it can be referenced by.
+
+        :param newline: False for strings that aren't printed, like paths, which only get the NUL terminator.
+        """
+        data = self.encode(value, newline)
+
+        self.references += 1
+        self.referenced_bytes += len(data)
+        label = self.labels.get(data)
+        if label is None:
+            label = f"{self.label_prefix}{len(self.labels)}"
+            self.labels[data] = label
+
+        return label
+
+    def layout(self) -> list[tuple[bytes, str, str, int]]:
+        """
+        Decide where every interned string lives.
+
+        Sorting the strings by their reversed bytes, in descending order, puts each string
+        right after the longest string it is a suffix of.
+
+        :return: (data, label, owner label, offset into the owner) for every interned string.
+        """
+        placements = []
+        owner = None
+        owner_label = None
+
+        for data in sorted(self.labels, key=lambda data: data[::-1], reverse=True):
+            if owner is not None and owner.endswith(data):
+                placements.append((data, self.labels[data], owner_label, len(owner) - len(data)))
+            else:
+                owner, owner_label = data, self.labels[data]
+                placements.append((data, owner_label, owner_label, 0))
+
+        return placements
+
+    @staticmethod
+    def format_db(data: bytes) -> str:
+        """
+        Format bytes as NASM db operands, printable runs go in quotes and everything else as numbers.
+        """
+        # One match per printable run or other byte, instead of a Python step per byte
+        return ",".join(
+            f'"{match.decode("ascii")}"' if match[0] in PRINTABLE_DB_BYTES else str(match[0])
+            for match in DB_OPERAND_PATTERN.findall(data)
+        )
+
+    @staticmethod
+    def length_symbol(label: str) -> str:
+        return f"{label}_len"
+
+    def write(self, section: Section) -> None:
+        for data, label, owner_label, offset in self.layout():
+            if label == owner_label:
+                section.write(f"{label} db {self.format_db(data)}")
+            else:
+                section.write(f"{label} equ {owner_label} + {offset}")
+
+            section.write(f"{self.length_symbol(label)} equ {len(data) - 1}")
+
+    def statistics(self) -> dict:
+        placements = self.layout()
+
+        return {
+            "references": self.references,
+            "unique": len(placements),
+            "shared_suffixes": sum(1 for _, label, owner_label, _ in placements if label != owner_label),
+            "stored_bytes": sum(len(data) for data, label, owner_label, _ in placements if label == owner_label),
+            "referenced_bytes": self.referenced_bytes,
+        }
+
+    def report(self) -> str:
+        stats = self.statistics()
+        return (f"Constant pool: {stats['references']} references, {stats['unique']} unique strings, "
+                f"{stats['shared_suffixes']} shared as suffixes, {stats['stored_bytes']} bytes stored "
+                f"({stats['referenced_bytes'] - stats['stored_bytes']} bytes saved)")
+
+@functools.lru_cache(maxsize=4)
+def filter_builtins(raw_source: str) -> str:
+    """
+    Strip the file-only ";;" comments and any ";; begin .bss"/";; end .bss" blocks from the builtins source,
+    then run the peephole optimizer over its macros and runtime routines, whatever -O a program is compiled with.
+    Filtered sources are kept, so a long-running process only filters the builtins again when they change.
+    """
+    builtins_asm = StringStream()
+    skipping = False
+    for line in raw_source.splitlines():
+        if line.strip() == ";; begin .bss":
+            skipping = True
+        elif line.strip() == ";; end .bss":
+            skipping = False
+
+        if skipping == True: continue
+
+        if not line.startswith(";;"):
+            builtins_asm.write(line)
+    builtins_asm.write("")
+
+    builtins_source = builtins_asm.get_value()
+    builtins_asm.close()
+    return PeepholeOptimizer().optimize_assembly(builtins_source)
+
+def load_builtins(builtins_cache: BuiltinsCache = None) -> Program:
+    """
+    Create the child program holding the builtins.
+
+    With a cache, a hit skips filtering entirely and the program links the cached object,
+    a miss fills the cache when the program is compiled.
+    """
+    program_name = "builtins-elf64"
+    assembler_flags = ["-dBUILTINS_OBJECT"]
+
+    with open(BUILTINS_PATH, "rb") as elf64_builtins:
+        raw_source = elf64_builtins.read()
+
+    if builtins_cache is not None:
+        key = builtins_cache.key(raw_source, assembler_flags)
+        library_directory = builtins_cache.lookup(key, program_name)
+
+        if library_directory is not None:
+            builtins = Program(None, program_name, assembler_flags)
+            builtins.library_directory = library_directory
+            builtins.cache_status = "hit"
+        else:
+            builtins = Program(filter_builtins(raw_source.decode('utf-8')), program_name, assembler_flags)
+
+        builtins.builtins_cache = builtins_cache
+        builtins.cache_key = key
+        return builtins
+
+    return Program(filter_builtins(raw_source.decode('utf-8')), program_name, assembler_flags)
+
+def warm_builtins_cache(builtins_cache: BuiltinsCache = None) -> str:
+    """
+    Make sure the builtins object is in the cache, assembling it if needed.
+
+    :return: The cache entry directory.
+    """
+    builtins_cache = builtins_cache or BuiltinsCache()
+    builtins = load_builtins(builtins_cache)
+    if builtins.cache_status != "hit":
+        builtins.library_directory = builtins_cache.store(builtins.cache_key, builtins.program_name, builtins.assembly_source, builtins.assembler_flags)
+
+    return builtins.library_directory
+
+BINARY_MNEMONICS = {
+    IR_OPCODE.ADD: "add",
+    IR_OPCODE.SUBTRACT: "sub",
+    IR_OPCODE.MULTIPLY: "imul",
+}
+
+SHIFT_MNEMONICS = {
+    IR_OPCODE.SHIFT_LEFT: "shl",
+    IR_OPCODE.SHIFT_RIGHT: "shr",
+    IR_OPCODE.SHIFT_RIGHT_ARITHMETIC: "sar",
+}
+
+def is_memory(operand: str) -> bool:
+    return operand.endswith("]")
+
+def is_immediate(operand: str) -> bool:
+    return operand.lstrip("-").isdigit()
+
 class GeneratorNASM(StringStream):
-    def __init__(self) -> None:
+    def __init__(self, use_cache: bool = True, optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL, optimize_size: bool = False) -> None:
         super().__init__(indent_level=0)
         self.assembler = ASSEMBLER.NASM
+        self.optimization_level = optimization_level
+        self.optimize_size = optimize_size
+        self.builtins_cache = BuiltinsCache() if use_cache else None
+        self.reset()
+
+        # Writers of the assembly for each IR instruction
+        self.instruction_writers = {
+            IR_OPCODE.MOVE: self.write_move,
+            IR_OPCODE.ADD: self.write_binary_operation,
+            IR_OPCODE.SUBTRACT: self.write_binary_operation,
+            IR_OPCODE.MULTIPLY: self.write_binary_operation,
+            IR_OPCODE.DIVIDE: self.write_divide,
+            IR_OPCODE.SHIFT_LEFT: self.write_shift,
+            IR_OPCODE.SHIFT_RIGHT: self.write_shift,
+            IR_OPCODE.SHIFT_RIGHT_ARITHMETIC: self.write_shift,
+            IR_OPCODE.MULTIPLY_HIGH: self.write_multiply_high,
+            IR_OPCODE.SCALED_ADD: self.write_scaled_add,
+            IR_OPCODE.NEGATE: self.write_negate,
+            IR_OPCODE.PRINT_STRING: self.write_print_string,
+            IR_OPCODE.PRINT_INTEGER: self.write_print_integer,
+            IR_OPCODE.EXIT: self.write_exit,
+            IR_OPCODE.CAT_FILE: self.write_cat_file,
+        }
+
+    def reset(self) -> None:
+        """
+        Drop everything about the last program, the writer tables are kept for the next one.
+        Its reports stay readable until the next program is generated, which resets first.
+        """
+        self.chunks = []
+        self.indent_level = 0
+        self.constant_pool = ConstantPool()
+        self.ir_builder = None
+        self.register_allocator = None
+        self.peephole_optimizer = None
+        # Instructions of _start, written as text once the peephole optimizer is done with them
+        self.machine_code = []
+        # Call sites of every builtin with two forms, and the ones that are inlined
+        self.builtin_call_sites = {}
+        self.inlined_builtins = set()
 
     def write_section(self, section: Section, close: bool = True, trim: bool = False) -> None:
         if type(section) is MacroSection: section.end_macro()
         if trim == True: section.trim_trailing_newlines()
-        self.write(section.get_value())        
+        self.write_chunks(section.chunks)
+        self.chunks.append('\n')
         if close == True: section.close()
 
     def generate_assembly_elf64(self, ast_nodes) -> Program:
+        self.reset()
+
         self.write(f"; Transpiled using Panda-Lang v{VERSION}")
         self.write( "; Linux x86_64: elf64\n")
 
+        if not BUFFER_OUTPUT: self.write("%define UNBUFFERED_OUTPUT\n")
+        if not ZERO_COPY_FILES: self.write("%define COPY_FILE_OUTPUT\n")
+
         # section .bss
         # section_bss = Section("section .bss")
         # section_bss.write('a resb 8')
         # self.write_section(section_bss)
 
-        # section .data
-        section_data = Section("section .data")
-        
-        for i, node in enumerate(ast_nodes):
-            if node.type == AST_NODE_TYPE.PRINT:
-                section_data.write(f'_cs{i} db "{node.value}",10,0')
+        # section .rodata
+        section_rodata = Section("section .rodata")
 
-        self.write_section(section_data)
+        # User defined code
+        # _start:
+        section__start = Section("_start:")
+        
+        exit_processed = False
+        ends_with_exit = False
+
+        # ast_nodes may be a lazy stream from the parser, the pool and the IR are filled in the same pass.
+        # Merging prints and folding constants happen before, in the optimizer
+        self.ir_builder = IRBuilder(self.optimization_level)
+        for node in ast_nodes:
+            if node.type == AST_NODE_TYPE.PRINT and isinstance(node.value, str):
+                label = self.constant_pool.add(node.value)
+                self.ir_builder.print_string(label, self.constant_pool.length_symbol(label))
+            elif node.type == AST_NODE_TYPE.CAT:
+                self.ir_builder.cat_file(self.constant_pool.add(node.value, newline=False), node.operands[0])
+            else:
+                self.ir_builder.lower_statement(node)
+
+            if node.type == AST_NODE_TYPE.EXIT: exit_processed = True
+            ends_with_exit = node.type == AST_NODE_TYPE.EXIT
+
+        # An exit as the very last statement already ends the program, a default exit after it could never run
+        default_exit = not ends_with_exit and (not exit_processed or ALWAYS_DEFAULT_EXIT_WITH_0)
+
+        self.builtin_call_sites = {name: 0 for name in BUILTIN_MACROS.values()}
+        for instruction in self.ir_builder.instructions:
+            if instruction.opcode in BUILTIN_MACROS: self.builtin_call_sites[BUILTIN_MACROS[instruction.opcode]] += 1
+        if default_exit: self.builtin_call_sites["exit"] += 1
+        self.inlined_builtins = self.choose_inlined_builtins(self.builtin_call_sites)
+        for name in sorted(self.inlined_builtins): self.write(f"%define INLINE_{name.upper()}")
+        if self.inlined_builtins: self.write("")
+
+        # Registers can only be assigned once the whole program is known, the last use of a variable may be anywhere
+        self.register_allocator = LinearScanAllocator()
+        self.register_allocator.allocate(self.ir_builder.instructions)
+        count("ir_instructions", len(self.ir_builder.instructions))
+        count("spilled", self.register_allocator.statistics.get("spilled", 0))
+
+        self.machine_code = []
+        if self.register_allocator.spill_slots > 0:
+            self.machine_code.append(AsmInstruction("sub", ("rsp", str(self.register_allocator.spill_slots * 8)), "spill slots"))
+        for instruction in self.ir_builder.instructions:
+            self.instruction_writers[instruction.opcode](instruction)
+
+        if self.optimization_level >= 1:
+            self.peephole_optimizer = PeepholeOptimizer()
+            self.machine_code = self.peephole_optimizer.optimize(self.machine_code)
+            count("peephole_removed", self.peephole_optimizer.instructions_before - self.peephole_optimizer.instructions_after)
+
+        for instruction in self.machine_code:
+            section__start.write(instruction.format())
+            # A blank line after every call into the runtime, which ends most statements
+            if instruction.mnemonic in RUNTIME_MACROS or instruction.comment == "spill slots": section__start.write("")
+        self.machine_code = []
+
+        self.constant_pool.write(section_rodata)
+        self.write_section(section_rodata)
 
         # section .text
         section_text = Section("section .text")
@@ -212,48 +755,11 @@ class GeneratorNASM(StringStream):
         # section_macro.write("syscall")
         # self.write_section(section_macro)
 
-        # Open and input methods from "src/lib/builtins-elf64.asm"
-        builtins = None
-        builtins_asm = StringStream()
-        with open(os.path.normpath(os.path.join(__file__, "../lib/builtins-elf64.asm")), "r") as elf64_builtins:
-            skipping = False
-            for line in elf64_builtins:
-                if line.strip() == ";; begin .bss":
-                    skipping = True
-                elif line.strip() == ";; end .bss":
-                    skipping = False
-
-                if skipping == True: continue
-
-                if not line.startswith(";;"):
-                    builtins_asm.write(line.rstrip('\n'))
-            builtins_asm.write("")
-        
-        builtins = Program(builtins_asm.get_value(), "builtins-elf64")
-        builtins_asm.close()
-        self.write(f"%include \"{'#{LIB_DIRECTORY}builtins-elf64.asm'}\"\n")
-
-        # User defined code
-        # _start:
-        section__start = Section("_start:")
-        
-        exit_processed = False
+        # Methods from "src/lib/builtins-elf64.asm"
+        builtins = load_builtins(self.builtins_cache)
+        self.write(f"%include \"{LIB_DIRECTORY_PLACEHOLDER}builtins-elf64.asm\"\n")
 
-        for i, node in enumerate(ast_nodes):
-            if node.type == AST_NODE_TYPE.EXIT:
-                section__start.write(f"exit {node.value}")
-                # section__start.write("mov rax, 60 ; syscall code for exit")
-                # section__start.write(f"mov rdi, {node.value} ; exit code")
-                # section__start.write("syscall")
-                section__start.write("")
-                exit_processed = True
-            elif node.type == AST_NODE_TYPE.PRINT:
-                # section__start.write(f"mov rax, _cs{i}")
-                # section__start.write("call _print")
-                section__start.write(f"print _cs{i}")
-                section__start.write("")
-
-        if not exit_processed or ALWAYS_DEFAULT_EXIT_WITH_0:
+        if default_exit:
             section__start.write("exit 0 ; default to exiting with 0")
             # section__start.write("mov rax, 60 ; syscall code for exit")
             # section__start.write("mov rdi, 0 ; exit code")
@@ -263,13 +769,182 @@ class GeneratorNASM(StringStream):
         self.write_section(section__start, trim=True)
 
         # Create and return the program
-        program = Program(self.get_value().rstrip("\n"))
+        program = Program(self.chunks)
         if builtins: program.add_child(builtins)
-        self.close()
+        self.chunks = []
 
         return program
 
-def Generator(assembler: ASSEMBLER = ASSEMBLER.NASM):
+    def choose_inlined_builtins(self, call_sites: dict[str, int]) -> set[str]:
+        """
+        Choose which builtins are expanded at every call site instead of calling their shared routine.
+
+        -Os keeps the form that takes the fewest bytes, the shared routines are linked in either way.
+        -O2 inlines for speed while a builtin has at most INLINE_CALL_SITE_LIMIT call sites.
+
+        :param call_sites: The number of call sites of each builtin.
+        """
+        if self.optimize_size:
+            return {name for name in call_sites if BUILTIN_CALL_SITE_SIZES[name][0] <= BUILTIN_CALL_SITE_SIZES[name][1]}
+        if self.optimization_level >= 2:
+            return {name for name, count in call_sites.items() if count <= INLINE_CALL_SITE_LIMIT}
+
+        return set(DEFAULT_INLINED_BUILTINS)
+
+    def report_builtins(self) -> str:
+        forms = ", ".join(f"{name} {'inlined' if name in self.inlined_builtins else 'shared'} at {count} call sites" for name, count in self.builtin_call_sites.items())
+        return f"Builtins: {forms}"
+
+    def operand(self, value) -> str:
+        """
+        :return: The assembly operand for an int or a virtual register, a register or a spill slot.
+        """
+        if type(value) is int: return str(value)
+
+        location = self.register_allocator.location(value)
+        if type(location) is int: return f"qword [rsp + {location * 8}]"
+        return location
+
+    def asm(self, mnemonic: str, *operands: str) -> None:
+        self.machine_code.append(AsmInstruction(mnemonic, operands))
+
+    def move(self, destination: str, source: str) -> None:
+        if destination == source: return
+
+        # There is no memory to memory mov, and only mov to a register takes a 64-bit immediate
+        if is_memory(destination) and (is_memory(source) or (is_immediate(source) and not fits_int32(int(source)))):
+            self.asm("mov", "rax", source)
+            source = "rax"
+        self.asm("mov", destination, source)
+
+    def write_move(self, instruction: Instruction) -> None:
+        self.move(self.operand(instruction.destination), self.operand(instruction.sources[0]))
+
+    def write_in_place(self, instruction: Instruction, mnemonic: str, *arguments: str) -> None:
+        """
+        Write destination = mnemonic(source, *arguments) for operations that change their first operand in place.
+        """
+        destination = self.operand(instruction.destination)
+        source = self.operand(instruction.sources[0])
+
+        if is_memory(destination) and is_memory(source) and destination != source:
+            self.asm("mov", "rax", source)
+            self.asm(mnemonic, "rax", *arguments)
+            self.asm("mov", destination, "rax")
+        else:
+            self.move(destination, source)
+            self.asm(mnemonic, destination, *arguments)
+
+    def write_negate(self, instruction: Instruction) -> None:
+        self.write_in_place(instruction, "neg")
+
+    def write_shift(self, instruction: Instruction) -> None:
+        self.write_in_place(instruction, SHIFT_MNEMONICS[instruction.opcode], str(instruction.sources[1]))
+
+    def write_binary_operation(self, instruction: Instruction) -> None:
+        mnemonic = BINARY_MNEMONICS[instruction.opcode]
+        destination = self.operand(instruction.destination)
+        left, right = (self.operand(source) for source in instruction.sources)
+        immediate = type(instruction.sources[1]) is int
+
+        if destination == left and (not is_memory(destination) or (mnemonic != "imul" and not is_memory(right))):
+            self.asm(mnemonic, destination, right)
+        elif is_memory(destination) or (destination == right and mnemonic == "sub"):
+            # Work in rax when the result goes to memory, or when sub would overwrite its right operand
+            if mnemonic == "imul" and immediate:
+                self.asm("imul", "rax", left, right)
+            else:
+                self.asm("mov", "rax", left)
+                self.asm(mnemonic, "rax", right)
+            self.asm("mov", destination, "rax")
+        elif destination == right:
+            self.asm(mnemonic, destination, left)
+        elif mnemonic == "imul" and immediate:
+            self.asm("imul", destination, left, right)
+        elif mnemonic == "add" and not is_memory(left) and not is_memory(right):
+            # lea adds into a third register without the mov
+            self.asm("lea", destination, f"[{left} + {right}]" if not right.startswith("-") else f"[{left} - {right[1:]}]")
+        else:
+            self.asm("mov", destination, left)
+            self.asm(mnemonic, destination, right)
+
+    def write_scaled_add(self, instruction: Instruction) -> None:
+        destination = self.operand(instruction.destination)
+        base, index = (self.operand(source) for source in instruction.sources[:2])
+
+        # lea only adds registers, spilled operands are loaded into the scratch registers
+        if is_memory(base):
+            self.asm("mov", "rax", base)
+            if index == base: index = "rax"
+            base = "rax"
+        if is_memory(index):
+            self.asm("mov", "rdx", index)
+            index = "rdx"
+
+        target = "rax" if is_memory(destination) else destination
+        self.asm("lea", target, f"[{base} + {index} * {instruction.sources[2]}]")
+        self.move(destination, target)
+
+    def write_multiply_high(self, instruction: Instruction) -> None:
+        self.asm("mov", "rax", str(instruction.sources[1]))
+        self.asm("imul", self.operand(instruction.sources[0]))
+        self.move(self.operand(instruction.destination), "rdx")
+
+    def write_divide(self, instruction: Instruction) -> None:
+        dividend, divisor = (self.operand(source) for source in instruction.sources)
+        self.asm("mov", "rax", dividend)
+        self.asm("cqo")
+        self.asm("idiv", divisor)
+        self.move(self.operand(instruction.destination), "rax")
+
+    def write_print_string(self, instruction: Instruction) -> None:
+        self.asm("print", *instruction.sources)
+
+    def write_print_integer(self, instruction: Instruction) -> None:
+        self.asm("printInt", self.operand(instruction.sources[0]))
+
+    def write_cat_file(self, instruction: Instruction) -> None:
+        label, file_descriptor = instruction.sources
+        self.asm("cat", label, self.operand(file_descriptor))
+
+    def write_exit(self, instruction: Instruction) -> None:
+        exit_code = self.operand(instruction.sources[0])
+        # exit flushes the output buffer first, which clobbers every register the runtime doesn't preserve
+        if type(instruction.sources[0]) is not int and not is_memory(exit_code) and exit_code not in CALL_PRESERVED_REGISTERS:
+            self.asm("mov", "rbx", exit_code)
+            exit_code = "rbx"
+        self.asm("exit", exit_code)
+
+class GeneratorELF64(GeneratorNASM):
+    """
+    Generates the same assembly as GeneratorNASM, but the program it returns is assembled
+    by elf64.py instead of nasm and ld, so compiling never launches another process.
+    """
+    def __init__(self, optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL, optimize_size: bool = False) -> None:
+        # The builtins cache holds NASM objects, there is nothing in it for this backend
+        super().__init__(use_cache=False, optimization_level=optimization_level, optimize_size=optimize_size)
+        self.assembler = ASSEMBLER.ELF64
+
+    def generate_assembly_elf64(self, ast_nodes) -> ProgramELF64:
+        program = super().generate_assembly_elf64(ast_nodes)
+        return ProgramELF64(program.assembly_chunks, program.child_programs[0].assembly_source)
+
+def codegen_options(assembler: ASSEMBLER = ASSEMBLER.NASM, optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL, optimize_size: bool = False) -> dict:
+    """
+    Every setting that changes the generated program, used to key the build cache.
+    """
+    return {
+        "assembler": assembler.name,
+        "optimization_level": optimization_level,
+        "optimize_size": optimize_size,
+        "always_default_exit_with_0": ALWAYS_DEFAULT_EXIT_WITH_0,
+        "buffer_output": BUFFER_OUTPUT,
+        "zero_copy_files": ZERO_COPY_FILES,
+    }
+
+def Generator(assembler: ASSEMBLER = ASSEMBLER.NASM, use_cache: bool = True, optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL, optimize_size: bool = False):
     match assembler:
         case ASSEMBLER.NASM:
-            return GeneratorNASM()
\ No newline at end of file
+            return GeneratorNASM(use_cache=use_cache, optimization_level=optimization_level, optimize_size=optimize_size)
+        case ASSEMBLER.ELF64:
+            return GeneratorELF64(optimization_level=optimization_level, optimize_size=optimize_size)
\ No newline at end of file
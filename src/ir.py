@@ -0,0 +1,275 @@
+from enum import Enum, auto
+
+from parse import AST_NODE_TYPE, ASTNode
+from tokenizer import TOKEN_TYPE
+from optimizer import DEFAULT_OPTIMIZATION_LEVEL, evaluate_binary_operation, wrap_int64
+
+UINT64_MASK = 2 ** 64 - 1
+
+class IR_OPCODE(Enum):
+    # destination = sources[0]
+    MOVE = auto()
+
+    # destination = sources[0] op sources[1]
+    ADD = auto()
+    SUBTRACT = auto()
+    MULTIPLY = auto()
+    DIVIDE = auto() # Truncates toward zero, traps on zero and INT64_MIN / -1
+    # destination = sources[0] op constant sources[1]
+    SHIFT_LEFT = auto()
+    SHIFT_RIGHT = auto() # Logical
+    SHIFT_RIGHT_ARITHMETIC = auto()
+    MULTIPLY_HIGH = auto() # Upper 64 bits of the signed 128-bit product
+    # destination = sources[0] + sources[1] * constant sources[2], a single lea
+    SCALED_ADD = auto()
+
+    # destination = -sources[0]
+    NEGATE = auto()
+
+    # Calls into the runtime
+    PRINT_STRING = auto() # sources are the label and its length symbol
+    PRINT_INTEGER = auto()
+    EXIT = auto()
+    CAT_FILE = auto() # sources are the path's label and the file descriptor to write to
+
+# Instructions that call a runtime routine, which clobbers the caller saved registers
+CALL_OPCODES = frozenset({IR_OPCODE.PRINT_STRING, IR_OPCODE.PRINT_INTEGER, IR_OPCODE.EXIT, IR_OPCODE.CAT_FILE})
+
+# Multiplications by these fit in one lea, x * 3 is [x + x * 2]
+LEA_FACTORS = {3: 2, 5: 4, 9: 8}
+
+def fits_int32(value: int) -> bool:
+    return -2 ** 31 <= value < 2 ** 31
+
+def power_of_two(value: int) -> int | None:
+    """
+    :return: k when value is 2 ** k, otherwise None.
+    """
+    if value > 0 and value & (value - 1) == 0: return value.bit_length() - 1
+    return None
+
+def signed_division_magic(divisor: int) -> tuple[int, int]:
+    """
+    Find the multiplier and shift that turn a signed 64-bit division by a constant into a
+    multiplication, following Hacker's Delight (10-1).
+
+    :param divisor: At least 2 and not a power of two.
+    :return: (multiplier as a signed 64-bit integer, shift).
+    """
+    two63 = 2 ** 63
+    anc = two63 - 1 - two63 % divisor
+    p = 63
+    q1, r1 = divmod(two63, anc)
+    q2, r2 = divmod(two63, divisor)
+
+    while True:
+        p += 1
+        # The quotients are unsigned 64-bit values and wrap around like them
+        q1, r1 = 2 * q1 & UINT64_MASK, 2 * r1
+        if r1 >= anc: q1, r1 = q1 + 1 & UINT64_MASK, r1 - anc
+        q2, r2 = 2 * q2 & UINT64_MASK, 2 * r2
+        if r2 >= divisor: q2, r2 = q2 + 1 & UINT64_MASK, r2 - divisor
+
+        delta = divisor - r2
+        if not (q1 < delta or (q1 == delta and r1 == 0)): break
+
+    return wrap_int64((q2 + 1) & UINT64_MASK), p - 64
+
+class VirtualRegister:
+    __slots__ = ('number',)
+
+    def __init__(self, number: int) -> None:
+        self.number = number
+
+    def __repr__(self) -> str:
+        return f"v{self.number}"
+
+class Instruction:
+    __slots__ = ('opcode', 'destination', 'sources')
+
+    def __init__(self, opcode: IR_OPCODE, destination: VirtualRegister = None, sources: tuple = ()) -> None:
+        self.opcode = opcode
+        self.destination = destination
+        # VirtualRegisters or ints, constants are only left where the instruction can take them as immediates
+        self.sources = sources
+
+    def __repr__(self) -> str:
+        operands = ", ".join(str(operand) for operand in self.sources)
+        if self.destination is None: return f"{self.opcode.name} {operands}"
+        return f"{self.destination} = {self.opcode.name} {operands}"
+
+class IRBuilder:
+    """
+    Lowers statements into a straight line of instructions over an unlimited number of virtual registers.
+
+    Every value gets a fresh virtual register and a variable is just the name of the latest one
+    assigned to it, so no value is ever overwritten and each register has a single live range.
+    Variables holding constants stay constants and end up as immediates, and from -O1 constants are
+    folded through variables. Multiplications and divisions by constants are always strength reduced,
+    like choosing an instruction, it never changes a result.
+    """
+    def __init__(self, optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL) -> None:
+        self.optimization_level = optimization_level
+        self.instructions = []
+        self.variables = {}
+        self.register_count = 0
+        self.statistics = {}
+
+        # Statement lowering by AST node type
+        self.statement_lowerings = {
+            AST_NODE_TYPE.LET: self.lower_assignment,
+            AST_NODE_TYPE.VAR: self.lower_assignment,
+            AST_NODE_TYPE.ASSIGN: self.lower_assignment,
+            AST_NODE_TYPE.PRINT: self.lower_print,
+            AST_NODE_TYPE.EXIT: self.lower_exit,
+        }
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.statistics[name] = self.statistics.get(name, 0) + value
+
+    def new_register(self) -> VirtualRegister:
+        self.register_count += 1
+        return VirtualRegister(self.register_count - 1)
+
+    def emit(self, opcode: IR_OPCODE, *sources) -> VirtualRegister:
+        destination = self.new_register()
+        self.instructions.append(Instruction(opcode, destination, sources))
+        return destination
+
+    def register(self, operand) -> VirtualRegister:
+        """
+        Materialize a constant in a register, for the places that can't take an immediate.
+        """
+        if isinstance(operand, VirtualRegister): return operand
+        return self.emit(IR_OPCODE.MOVE, operand)
+
+    def immediate(self, operand):
+        # Besides mov, x86-64 instructions only take sign extended 32-bit immediates
+        if isinstance(operand, int) and not fits_int32(operand): return self.register(operand)
+        return operand
+
+    def lower_statement(self, node: ASTNode) -> None:
+        self.statement_lowerings[node.type](node)
+
+    def print_string(self, label: str, length_symbol: str) -> None:
+        self.instructions.append(Instruction(IR_OPCODE.PRINT_STRING, sources=(label, length_symbol)))
+
+    def cat_file(self, label: str, file_descriptor: ASTNode) -> None:
+        self.instructions.append(Instruction(IR_OPCODE.CAT_FILE, sources=(label, self.lower_expression(file_descriptor))))
+
+    def lower_assignment(self, node: ASTNode) -> None:
+        self.variables[node.value] = self.lower_expression(node.operands[0])
+
+    def lower_print(self, node: ASTNode) -> None:
+        self.instructions.append(Instruction(IR_OPCODE.PRINT_INTEGER, sources=(self.lower_value(node.value),)))
+
+    def lower_exit(self, node: ASTNode) -> None:
+        self.instructions.append(Instruction(IR_OPCODE.EXIT, sources=(self.lower_value(node.value),)))
+
+    def lower_value(self, value):
+        # print and exit hold plain ints for literals
+        if isinstance(value, int): return value
+        return self.lower_expression(value)
+
+    def lower_expression(self, expression: ASTNode):
+        """
+        :return: The constant value of the expression, or the virtual register holding it.
+        """
+        if expression.type == AST_NODE_TYPE.INTEGER: return expression.value
+        if expression.type == AST_NODE_TYPE.VARIABLE: return self.variables[expression.value]
+
+        if expression.type == AST_NODE_TYPE.NEGATE:
+            operand = self.lower_expression(expression.operands[0])
+            if isinstance(operand, int) and self.optimization_level >= 1:
+                self.count("folded")
+                return wrap_int64(-operand)
+            return self.emit(IR_OPCODE.NEGATE, self.register(operand))
+
+        left = self.lower_expression(expression.operands[0])
+        right = self.lower_expression(expression.operands[1])
+        return self.lower_binary_operation(expression.value, left, right)
+
+    def lower_binary_operation(self, operator: TOKEN_TYPE, left, right):
+        if self.optimization_level >= 1 and isinstance(left, int) and isinstance(right, int):
+            result = evaluate_binary_operation(operator, left, right)
+            if result is not None:
+                self.count("folded")
+                return result
+
+        # Addition and multiplication commute, so a constant can always go on the right
+        if operator in (TOKEN_TYPE.PLUS, TOKEN_TYPE.MULTIPLY) and isinstance(left, int):
+            left, right = right, left
+
+        if operator == TOKEN_TYPE.MULTIPLY and isinstance(right, int) and isinstance(left, VirtualRegister):
+            return self.multiply_by_constant(left, right)
+        if operator == TOKEN_TYPE.DIVIDE and isinstance(right, int) and isinstance(left, VirtualRegister):
+            quotient = self.divide_by_constant(left, right)
+            if quotient is not None: return quotient
+
+        left = self.register(left)
+        if operator == TOKEN_TYPE.PLUS:
+            return self.emit(IR_OPCODE.ADD, left, self.immediate(right))
+        if operator == TOKEN_TYPE.MINUS:
+            return self.emit(IR_OPCODE.SUBTRACT, left, self.immediate(right))
+        if operator == TOKEN_TYPE.MULTIPLY:
+            return self.emit(IR_OPCODE.MULTIPLY, left, self.immediate(right))
+
+        # idiv takes its divisor from a register or memory
+        return self.emit(IR_OPCODE.DIVIDE, left, self.register(right))
+
+    def multiply_by_constant(self, value: VirtualRegister, factor: int):
+        """
+        Multiply with shifts, adds and lea where that is cheaper than imul.
+        """
+        magnitude = abs(factor)
+        shift = power_of_two(magnitude)
+
+        if factor == 0:
+            product = 0
+        elif magnitude == 1:
+            product = value
+        elif shift is not None:
+            product = self.emit(IR_OPCODE.SHIFT_LEFT, value, shift)
+        elif magnitude in LEA_FACTORS:
+            product = self.emit(IR_OPCODE.SCALED_ADD, value, value, LEA_FACTORS[magnitude])
+        elif power_of_two(magnitude - 1) is not None:
+            product = self.emit(IR_OPCODE.ADD, self.emit(IR_OPCODE.SHIFT_LEFT, value, power_of_two(magnitude - 1)), value)
+        elif power_of_two(magnitude + 1) is not None:
+            product = self.emit(IR_OPCODE.SUBTRACT, self.emit(IR_OPCODE.SHIFT_LEFT, value, power_of_two(magnitude + 1)), value)
+        else:
+            return self.emit(IR_OPCODE.MULTIPLY, value, self.immediate(factor))
+
+        self.count("multiplications_reduced")
+        if factor < 0: product = self.emit(IR_OPCODE.NEGATE, product)
+        return product
+
+    def divide_by_constant(self, value: VirtualRegister, divisor: int):
+        """
+        Divide with shifts, or a multiplication by the divisor's reciprocal, instead of idiv.
+
+        :return: The quotient, or None for divisors left to idiv: 0 and -1 must still trap.
+        """
+        if divisor in (0, -1): return None
+
+        magnitude = abs(divisor)
+        shift = power_of_two(magnitude)
+
+        if magnitude == 1:
+            quotient = value
+        elif shift is not None:
+            # An arithmetic shift rounds toward negative infinity, adding 2 ** shift - 1 first to
+            # negative values makes it round toward zero
+            sign = value if shift == 1 else self.emit(IR_OPCODE.SHIFT_RIGHT_ARITHMETIC, value, 63)
+            bias = self.emit(IR_OPCODE.SHIFT_RIGHT, sign, 64 - shift)
+            quotient = self.emit(IR_OPCODE.SHIFT_RIGHT_ARITHMETIC, self.emit(IR_OPCODE.ADD, value, bias), shift)
+        else:
+            multiplier, shift = signed_division_magic(magnitude)
+            quotient = self.emit(IR_OPCODE.MULTIPLY_HIGH, value, multiplier)
+            if multiplier < 0: quotient = self.emit(IR_OPCODE.ADD, quotient, value)
+            if shift > 0: quotient = self.emit(IR_OPCODE.SHIFT_RIGHT_ARITHMETIC, quotient, shift)
+            # Rounds the quotient of negative values toward zero
+            quotient = self.emit(IR_OPCODE.ADD, quotient, self.emit(IR_OPCODE.SHIFT_RIGHT, value, 63))
+
+        self.count("divisions_reduced")
+        if divisor < 0: quotient = self.emit(IR_OPCODE.NEGATE, quotient)
+        return quotient
@@ -2,22 +2,69 @@
 ; Linux x86_64: elf64
 ;; coments defined with two semicolons will not appear in the generated program and can only be seen in this file
 
-;; section .bss 
-;;     digitSpace resb 100
-;;     digitSpacePos resb 8
-;;
+;; print and exit come in two forms. The generator defines INLINE_PRINT and INLINE_EXIT to expand
+;; them at every call site, otherwise each call site only passes its arguments to a shared routine
+
 ; input: integer defining exit code
+; output: flushes buffered output, then exits
 %macro exit 1
+%ifdef INLINE_EXIT
+    call _flushOutput
     mov rax, SYS_EXIT
     mov rdi, %1
     syscall
+%else
+    mov rdi, %1
+    call _exitProgram
+%endif
+%endmacro
+
+; input: pointer to string, length of the string without its NUL terminator
+; output: string appended to the stdout buffer
+;; used for constant strings, whose length the generator already knows. Inlined, the string is
+;; copied straight into the buffer and the runtime is only called when the buffer is full
+%macro print 2
+%ifdef UNBUFFERED_OUTPUT
+    mov rsi, %1
+    mov rdx, %2
+    mov rax, SYS_WRITE
+    mov rdi, STDOUT
+    syscall
+%else
+%ifdef INLINE_PRINT
+    mov rsi, %1
+    mov rdx, %2
+    mov rax, [_outputBufferLength]
+    lea rcx, [rax + rdx]
+    cmp rcx, OUTPUT_BUFFER_SIZE
+    ja %%full
+    mov [_outputBufferLength], rcx
+    lea rdi, [_outputBuffer + rax]
+    mov rcx, rdx
+    rep movsb
+    jmp %%done
+%%full:
+    call _bufferedWrite
+%%done:
+%else
+    mov rsi, %1
+    mov rdx, %2
+    call _bufferedWrite
+%endif
+%endif
 %endmacro
 
-; input: pointer to string
+; output: writes out everything buffered for stdout
+%macro flush 0
+    call _flushOutput
+%endmacro
+
+; input: pointer to NUL terminated string
 ; output: print string
+;; fallback for strings whose length is only known at runtime
 %macro print 1
     mov rax, %1
-    mov rbx, 0
+    xor edx, edx
 
 ; input: rax as pointer to string
 ; output: print string at rax
@@ -25,57 +72,34 @@
     mov cl, [rax]
     cmp cl, 0
     je %%endPrintLoop
-    inc rbx
+    inc rdx
     inc rax
     jmp %%printLoop
 %%endPrintLoop:
-    mov rax, SYS_WRITE
-    mov rdi, STDIN
-    mov rsi, %1
-    mov rdx, rbx
-    syscall
+    print %1, rdx
 %endmacro
 
-; input: rax as integer
-; output: print integer at rax
-%macro printRAX 0
-    mov rcx, digitSpace
-    mov rbx, 10
-    mov [rcx], rbx
-    inc rcx
-    mov [digitSpacePos], rcx
-%%printRAXLoop:
-    mov rdx, 0
-    mov rbx, 10
-    div rbx
-    push rax
-    add rdx, 48
-
-    mov rcx, [digitSpacePos]
-    mov [rcx], dl
-    inc rcx
-    mov [digitSpacePos], rcx
-    
-    pop rax
-    cmp rax, 0
-    jne %%printRAXLoop
-%%printRAXLoop2:
-    mov rcx, [digitSpacePos]
-
-    mov rax, 1
-    mov rdi, 1
-    mov rsi, rcx
-    mov rdx, 1
-    syscall
-
-    mov rcx, [digitSpacePos]
-    dec rcx
-    mov [digitSpacePos], rcx
-
-    cmp rcx, digitSpace
-    jge %%printRAXLoop2
+; input: pointer to NUL terminated path, file descriptor to write to
+; output: the whole file written to the file descriptor, after everything printed before it
+;; the file descriptor is moved first, it may be in rdi
+%macro cat 2
+    mov rsi, %2
+    mov rdi, %1
+%ifdef COPY_FILE_OUTPUT
+    call _copyFile
+%else
+    call _streamFile
+%endif
+%endmacro
 
-    ret
+; input: integer, register or memory holding a signed 64-bit integer
+; output: decimal representation of the integer and a newline appended to the stdout buffer
+%macro printInt 1
+    mov rax, %1
+    call _printInteger
+%ifdef UNBUFFERED_OUTPUT
+    call _flushOutput
+%endif
 %endmacro
 
 STDIN_FILENO                equ 0
@@ -109,6 +133,14 @@ O_TMPFILE                   equ 4259840
 
 O_LARGEFILE                 equ 0
 
+PROT_READ                   equ 1
+MAP_PRIVATE                 equ 2
+SEEK_CUR                    equ 1
+
+;; struct stat, as filled in by SYS_FSTAT
+STAT_SIZE                   equ 144
+STAT_ST_SIZE                equ 48
+
 SYS_READ                    equ 0
 SYS_WRITE                   equ 1
 SYS_OPEN                    equ 2
@@ -442,4 +474,320 @@ MEMBARRIER                  equ 324
 MLOCK2                      equ 325
 COPY_FILE_RANGE             equ 326
 PREADV2                     equ 327
-PWRITEV2                    equ 328
\ No newline at end of file
+PWRITEV2                    equ 328
+
+;; Runtime routines. The generator assembles this file on its own with -dBUILTINS_OBJECT,
+;; that object holds the routines and their buffers, programs that %include the file only get
+;; the macros, constants and extern declarations
+OUTPUT_BUFFER_SIZE          equ 65536
+;; the most a single sendfile transfers
+SENDFILE_CHUNK              equ 0x7ffff000
+
+%ifdef BUILTINS_OBJECT
+section .bss
+    _outputBuffer resb OUTPUT_BUFFER_SIZE
+    _outputBufferLength resq 1
+
+    global _outputBuffer
+    global _outputBufferLength
+
+section .text
+    global _exitProgram
+    global _bufferedWrite
+    global _flushOutput
+    global _writeAll
+    global _printInteger
+    global _streamFile
+    global _copyFile
+
+; input: rdi as exit code
+; output: flushes buffered output, then exits
+_exitProgram:
+    mov rbx, rdi
+    call _flushOutput
+    mov rax, SYS_EXIT
+    mov rdi, rbx
+    syscall
+
+; input: rsi as pointer to string, rdx as length of the string
+; output: string appended to the stdout buffer, the buffer is flushed first if it would overflow
+; clobbers: rax, rcx, rdx, rsi, rdi, r11
+_bufferedWrite:
+    mov rax, [_outputBufferLength]
+    lea rcx, [rax + rdx]
+    cmp rcx, OUTPUT_BUFFER_SIZE
+    jbe .copy
+
+    push rsi
+    push rdx
+    call _flushOutput
+    pop rdx
+    pop rsi
+    xor eax, eax
+
+    ;; strings that can never fit in the buffer skip it entirely
+    cmp rdx, OUTPUT_BUFFER_SIZE
+    ja _writeAll
+.copy:
+    mov rdi, _outputBuffer
+    add rdi, rax
+    add rax, rdx
+    mov [_outputBufferLength], rax
+    mov rcx, rdx
+    rep movsb
+    ret
+
+; output: writes out everything buffered for stdout
+; clobbers: rax, rcx, rdx, rsi, rdi, r11
+_flushOutput:
+    mov rdx, [_outputBufferLength]
+    test rdx, rdx
+    jz .done
+    mov qword [_outputBufferLength], 0
+    mov rsi, _outputBuffer
+    jmp _writeAll
+.done:
+    ret
+
+; input: rsi as pointer to data, rdx as length of the data
+; output: data written to stdout, retrying partial writes
+; clobbers: rax, rcx, rdx, rsi, rdi, r11
+_writeAll:
+    mov rdi, STDOUT
+
+; input: rdi as file descriptor, rsi as pointer to data, rdx as length of the data
+; output: data written to the file descriptor, retrying partial writes
+; clobbers: rax, rcx, rdx, rsi, r11
+_writeAllTo:
+    test rdx, rdx
+    jz .done
+    mov rax, SYS_WRITE
+    syscall
+    test rax, rax
+    jle .done
+    add rsi, rax
+    sub rdx, rax
+    jmp _writeAllTo
+.done:
+    ret
+
+;; sendfile moves the data inside the kernel without copying it through user space, to a file,
+;; a pipe or a socket, splicing through a pipe internally where it has to. When a file can't be
+;; sent, the rest of it is mapped and written in one go, and files that can't be mapped either
+;; are copied with read and write
+; input: rdi as pointer to a NUL terminated path, rsi as file descriptor to write to
+; output: the whole file written to the file descriptor, stdout is flushed first
+; clobbers: rax, rcx, rdx, rsi, rdi, r8, r9, r11
+_streamFile:
+    push rbx
+    push r10
+    push r12
+    push r13
+    sub rsp, STAT_SIZE
+    mov r12, rsi
+    call _openFile
+.sendfile:
+    mov rax, SYS_SENDFILE
+    mov rdi, r12
+    mov rsi, rbx
+    xor edx, edx
+    mov r10, SENDFILE_CHUNK
+    syscall
+    test rax, rax
+    jg .sendfile
+    jz .close
+
+    ;; sendfile leaves the file position after what it sent, the mapping is written from there
+    mov rax, SYS_FSTAT
+    mov rdi, rbx
+    mov rsi, rsp
+    syscall
+    test rax, rax
+    jnz .copy
+    mov rax, SYS_LSEEK
+    mov rdi, rbx
+    xor esi, esi
+    mov rdx, SEEK_CUR
+    syscall
+    test rax, rax
+    js .copy
+    mov r13, rax
+    ;; files reporting no size, like the ones in /proc, can only be read
+    mov rsi, [rsp + STAT_ST_SIZE]
+    cmp rsi, r13
+    jbe .copy
+
+    mov rax, SYS_MMAP
+    xor edi, edi
+    mov rdx, PROT_READ
+    mov r10, MAP_PRIVATE
+    mov r8, rbx
+    xor r9d, r9d
+    syscall
+    ;; errors are returned as -4095 to -1
+    cmp rax, -4096
+    ja .copy
+    mov r10, rax
+    mov rdi, r12
+    lea rsi, [r10 + r13]
+    mov rdx, [rsp + STAT_ST_SIZE]
+    sub rdx, r13
+    call _writeAllTo
+    mov rax, SYS_MUNMAP
+    mov rdi, r10
+    mov rsi, [rsp + STAT_ST_SIZE]
+    syscall
+    jmp .close
+.copy:
+    call _copyLoop
+.close:
+    mov rax, SYS_CLOSE
+    mov rdi, rbx
+    syscall
+    add rsp, STAT_SIZE
+    pop r13
+    pop r12
+    pop r10
+    pop rbx
+    ret
+
+; input: rdi as pointer to a NUL terminated path, rsi as file descriptor to write to
+; output: the whole file copied to the file descriptor with read and write, stdout is flushed first
+; clobbers: rax, rcx, rdx, rsi, rdi, r8, r9, r11
+_copyFile:
+    push rbx
+    push r12
+    mov r12, rsi
+    call _openFile
+    call _copyLoop
+    mov rax, SYS_CLOSE
+    mov rdi, rbx
+    syscall
+    pop r12
+    pop rbx
+    ret
+
+;; the stdout buffer was just flushed, so it is free to read into
+; input: rbx as file descriptor to read, r12 as file descriptor to write to
+; output: the rest of the file written to r12
+; clobbers: rax, rcx, rdx, rsi, rdi, r11
+_copyLoop:
+    mov rax, SYS_READ
+    mov rdi, rbx
+    mov rsi, _outputBuffer
+    mov rdx, OUTPUT_BUFFER_SIZE
+    syscall
+    test rax, rax
+    jle .done
+    mov rdi, r12
+    mov rsi, _outputBuffer
+    mov rdx, rax
+    call _writeAllTo
+    jmp _copyLoop
+.done:
+    ret
+
+; input: rdi as pointer to a NUL terminated path
+; output: rbx as the file opened for reading, stdout is flushed first so output stays in order.
+;         When the file can't be opened, the path is reported on stderr and the program exits with 1
+; clobbers: rax, rcx, rdx, rsi, rdi, r8, r11
+_openFile:
+    push rdi
+    call _flushOutput
+    pop rdi
+    mov rax, SYS_OPEN
+    xor esi, esi
+    xor edx, edx
+    syscall
+    test rax, rax
+    js .failed
+    mov rbx, rax
+    ret
+.failed:
+    mov r8, rdi
+    mov rdi, STDERR
+    mov rsi, _openError
+    mov rdx, _openErrorLength
+    call _writeAllTo
+    mov rsi, r8
+    xor edx, edx
+.pathLength:
+    cmp byte [rsi + rdx], 0
+    je .writePath
+    inc rdx
+    jmp .pathLength
+.writePath:
+    call _writeAllTo
+    mov rsi, _newline
+    mov rdx, 1
+    call _writeAllTo
+    mov rax, SYS_EXIT
+    mov rdi, 1
+    syscall
+;; digits are produced two at a time, by multiplying with the reciprocal of 100 instead of using div
+; input: rax as signed integer
+; output: decimal representation of the integer and a newline appended to the stdout buffer
+; clobbers: rax, rcx, rdx, rsi, rdi, r8, r9, r11
+_printInteger:
+    sub rsp, 32
+    lea rsi, [rsp + 31]
+    mov byte [rsi], 10
+    mov r8, rax
+    test rax, rax
+    jns .convert
+    neg rax
+.convert:
+    mov r9, 0x28F5C28F5C28F5C3
+.twoDigits:
+    cmp rax, 100
+    jb .lastDigits
+    mov rcx, rax
+    shr rax, 2
+    mul r9
+    shr rdx, 2
+    imul rax, rdx, 100
+    sub rcx, rax
+    movzx ecx, word [_digitPairs + rcx * 2]
+    sub rsi, 2
+    mov [rsi], cx
+    mov rax, rdx
+    jmp .twoDigits
+.lastDigits:
+    cmp rax, 10
+    jb .oneDigit
+    movzx ecx, word [_digitPairs + rax * 2]
+    sub rsi, 2
+    mov [rsi], cx
+    jmp .sign
+.oneDigit:
+    add al, '0'
+    dec rsi
+    mov [rsi], al
+.sign:
+    test r8, r8
+    jns .write
+    dec rsi
+    mov byte [rsi], '-'
+.write:
+    lea rdx, [rsp + 32]
+    sub rdx, rsi
+    call _bufferedWrite
+    add rsp, 32
+    ret
+
+section .rodata
+    _openError db "cat: could not open "
+    _openErrorLength equ 20
+    _newline db 10
+    _digitPairs db "00010203040506070809101112131415161718192021222324252627282930313233343536373839404142434445464748495051525354555657585960616263646566676869707172737475767778798081828384858687888990919293949596979899"
+%else
+    extern _outputBuffer
+    extern _outputBufferLength
+    extern _exitProgram
+    extern _bufferedWrite
+    extern _flushOutput
+    extern _writeAll
+    extern _printInteger
+    extern _streamFile
+    extern _copyFile
+%endif
@@ -0,0 +1,220 @@
+import time
+from typing import Iterable, Iterator
+
+from parse import AST_NODE_TYPE, ASTNode, INT64_MIN
+from tokenizer import TOKEN_TYPE
+
+DEFAULT_OPTIMIZATION_LEVEL = 1
+
+def wrap_int64(value: int) -> int:
+    """
+    Wrap a Python int to a signed 64-bit integer, the way the generated code overflows.
+    """
+    return (value + 2 ** 63) % 2 ** 64 - 2 ** 63
+
+def evaluate_binary_operation(operator: TOKEN_TYPE, left: int, right: int) -> int | None:
+    """
+    Compute a binary operation on constants exactly like the generated code would.
+
+    :return: The wrapped result, or None for divisions that trap at runtime, by zero or INT64_MIN by -1.
+    """
+    if operator == TOKEN_TYPE.PLUS:
+        result = left + right
+    elif operator == TOKEN_TYPE.MINUS:
+        result = left - right
+    elif operator == TOKEN_TYPE.MULTIPLY:
+        result = left * right
+    elif right == 0 or (left == INT64_MIN and right == -1):
+        return None
+    else:
+        result = abs(left) // abs(right) * (1 if (left < 0) == (right < 0) else -1)
+
+    return wrap_int64(result)
+
+class OptimizationPass:
+    """
+    Base class for the passes run between the Parser and the Generator.
+
+    A pass takes the statements one at a time from the pass before it and yields the transformed
+    statements, so a program streams from the parser through every pass into the generator without
+    ever being held as a whole. It must never change what the compiled program does. Passes run
+    when the optimization level is at least their level, and keep counters of what they did in statistics.
+    """
+    name = "pass"
+    level = 1
+
+    def __init__(self, optimization_level: int = DEFAULT_OPTIMIZATION_LEVEL) -> None:
+        self.optimization_level = optimization_level
+        self.statistics = {}
+        self.elapsed = 0.0
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.statistics[name] = self.statistics.get(name, 0) + value
+
+    def run(self, nodes: Iterable[ASTNode]) -> Iterator[ASTNode]:
+        raise NotImplementedError
+
+class ConstantFolding(OptimizationPass):
+    """
+    Evaluate integer expressions at compile time.
+
+    Arithmetic wraps around at 64 bits and division truncates toward zero, like the generated code.
+    Divisions that would trap at runtime, by zero or INT64_MIN by -1, are left for the runtime.
+    """
+    name = "constant-folding"
+
+    def fold(self, expression):
+        if not isinstance(expression, ASTNode): return expression
+
+        if expression.type == AST_NODE_TYPE.INTEGER: return expression.value
+        if expression.type == AST_NODE_TYPE.VARIABLE: return expression
+
+        operands = [self.fold(operand) for operand in expression.operands]
+        if not all(isinstance(operand, int) for operand in operands):
+            # Keep whatever folded inside the expression
+            folded_operands = tuple(operand if isinstance(operand, ASTNode) else ASTNode(AST_NODE_TYPE.INTEGER, operand) for operand in operands)
+            return ASTNode(expression.type, expression.value, expression.start, expression.end, folded_operands)
+
+        if expression.type == AST_NODE_TYPE.NEGATE:
+            self.count("folded")
+            return wrap_int64(-operands[0])
+
+        left, right = operands
+        result = evaluate_binary_operation(expression.value, left, right)
+        if result is None:
+            self.count("left_for_runtime")
+            return ASTNode(expression.type, expression.value, expression.start, expression.end, (ASTNode(AST_NODE_TYPE.INTEGER, left), ASTNode(AST_NODE_TYPE.INTEGER, right)))
+
+        self.count("folded")
+        return result
+
+    def run(self, nodes: Iterable[ASTNode]) -> Iterator[ASTNode]:
+        for node in nodes:
+            if isinstance(node.value, ASTNode): node.value = self.fold(node.value)
+
+            # Declarations and assignments keep their expression as a node
+            if node.operands is not None:
+                expression = self.fold(node.operands[0])
+                node.operands = (expression if isinstance(expression, ASTNode) else ASTNode(AST_NODE_TYPE.INTEGER, expression),)
+
+            yield node
+
+class DeadCodeElimination(OptimizationPass):
+    """
+    Drop every statement after the first exit, none of them can ever run.
+
+    The statements after it are still pulled from the parser, so errors in them are reported.
+    """
+    name = "dead-code-elimination"
+
+    def run(self, nodes: Iterable[ASTNode]) -> Iterator[ASTNode]:
+        nodes = iter(nodes)
+
+        for node in nodes:
+            yield node
+            if node.type == AST_NODE_TYPE.EXIT: break
+
+        for node in nodes: self.count("removed")
+
+class MergePrints(OptimizationPass):
+    """
+    Merge runs of adjacent string prints into a single print of the joined strings.
+
+    Every print ends with a newline, so joining with newlines prints exactly the same bytes.
+    From level 2, prints of constant integers are turned into string prints first, so they
+    join the runs around them instead of being formatted at runtime.
+    """
+    name = "merge-prints"
+
+    def end_run(self, run: list[ASTNode]) -> list[ASTNode]:
+        if len(run) < 2: return run
+
+        self.count("merged", len(run) - 1)
+        return [ASTNode(AST_NODE_TYPE.PRINT, "\n".join(node.value for node in run), run[0].start, run[-1].end)]
+
+    def run(self, nodes: Iterable[ASTNode]) -> Iterator[ASTNode]:
+        stringify_integers = self.optimization_level >= 2
+        # Only the current run of string prints is held back
+        run = []
+
+        for node in nodes:
+            if node.type == AST_NODE_TYPE.PRINT and stringify_integers and isinstance(node.value, int):
+                self.count("stringified")
+                node = ASTNode(AST_NODE_TYPE.PRINT, str(node.value), node.start, node.end)
+
+            if node.type == AST_NODE_TYPE.PRINT and isinstance(node.value, str):
+                run.append(node)
+            else:
+                yield from self.end_run(run)
+                run = []
+                yield node
+
+        yield from self.end_run(run)
+
+# Passes in the order they run, folding first so the other passes see constants
+PASSES = [ConstantFolding, DeadCodeElimination, MergePrints]
+
+class Optimizer:
+    """
+    Runs the optimization passes enabled at a level over the statements of a program, as they stream from the parser.
+
+    -O0 runs nothing, -O1 folds constants, removes dead code and merges string prints,
+    -O2 also turns prints of constant integers into strings.
+    """
+    def __init__(self, level: int = DEFAULT_OPTIMIZATION_LEVEL, passes: list[type] = None) -> None:
+        self.level = level
+        self.passes = []
+
+        for pass_class in (passes if passes is not None else PASSES):
+            if pass_class.level > level: continue
+            self.passes.append(pass_class(level))
+
+    def optimize(self, nodes: Iterable[ASTNode]) -> Iterator[ASTNode]:
+        """
+        Chain the passes over a stream of statements, nothing runs until the result is iterated.
+        The statistics are complete once it has been iterated to the end.
+        """
+        for optimization_pass in self.passes:
+            nodes = self.measure(optimization_pass, nodes)
+
+        return nodes
+
+    @staticmethod
+    def measure(optimization_pass: OptimizationPass, nodes: Iterable[ASTNode]) -> Iterator[ASTNode]:
+        """
+        Run a pass, counting the statements that go in and out and the time spent in the pass itself.
+        """
+        counts = {"statements_in": 0, "statements_out": 0}
+
+        def pull(nodes):
+            # Time spent in the passes before and in the parser isn't this pass's
+            iterator = iter(nodes)
+            while True:
+                start_time = time.perf_counter()
+                node = next(iterator, None)
+                optimization_pass.elapsed -= time.perf_counter() - start_time
+                if node is None: return
+
+                counts["statements_in"] += 1
+                yield node
+
+        iterator = optimization_pass.run(pull(nodes))
+        try:
+            while True:
+                start_time = time.perf_counter()
+                node = next(iterator, None)
+                optimization_pass.elapsed += time.perf_counter() - start_time
+                if node is None: return
+
+                counts["statements_out"] += 1
+                yield node
+        finally:
+            for name, value in counts.items(): optimization_pass.count(name, value)
+
+    def report(self) -> str:
+        lines = [f"Optimizer (-O{self.level}): {len(self.passes)} passes"]
+        for optimization_pass in self.passes:
+            counters = ", ".join(f"{name} {value}" for name, value in optimization_pass.statistics.items())
+            lines.append(f"  {optimization_pass.name}: {counters} ({optimization_pass.elapsed * 1000:.3f} ms)")
+
+        return "\n".join(lines)
@@ -1,50 +1,243 @@
 import os
+import sys
+import glob
+import time
 import argparse
-import pprint
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import exceptions
+import profiler
+from exceptions import PandaCompilerError
 
 from tokenizer import Tokenizer
 from parse import Parser
-from generator import Generator, ASSEMBLER
+from optimizer import Optimizer, DEFAULT_OPTIMIZATION_LEVEL
+from generator import Generator, ASSEMBLER, Program, BUILTINS_PATH, codegen_options, warm_builtins_cache
+from cache import BuildCache
+from profiler import Profiler, phase, count
+from version import VERSION
+
+def compile_file(file_path: str, args: argparse.Namespace) -> Program | None:
+    """
+    Run every compiler step on one file, as configured by the command line arguments.
+
+    :return: The compiled program, or None when only the tokenizer or parser steps ran.
+    """
+    output_path = os.path.normpath(os.path.join(file_path, '../', os.path.splitext(os.path.basename(file_path))[0]))
+
+    assembler = ASSEMBLER[args.assembler.upper()]
+
+    # The build cache can only stand in for a full compile, not for the partial or intermediate outputs
+    build_cache = None
+    if not (args.no_cache or args.t or args.T or args.a or args.in_memory):
+        build_cache = BuildCache()
+
+        with open(BUILTINS_PATH, 'rb') as builtins_file:
+            build_key = build_cache.key(file_path, builtins_file.read(), VERSION, codegen_options(assembler, args.O, args.optimize_size))
+
+        with phase("cache"):
+            cache_hit = build_cache.fetch(build_key, output_path)
+
+        if cache_hit:
+            if args.v == True: print(f"Cache hit for {file_path}: {build_cache.entry_directory(build_key)}")
+
+            program = Program(None)
+            program.executable_path = os.path.abspath(output_path)
+            return program
+
+    # While profiling every phase runs to completion before the next one starts, instead of
+    # streaming into it, so each can be timed on its own
+    profiling = profiler.active_profiler() is not None
+
+    program_tokenizer = Tokenizer()
+    if profiling:
+        with phase("read"):
+            with open(file_path, 'rb') as source_file:
+                source = source_file.read()
+        with phase("tokenize"):
+            program_tokens = program_tokenizer.tokenize(source)
+        count("source_bytes", len(source))
+        count("tokens", len(program_tokens))
+    else:
+        program_tokens = program_tokenizer.stream(file_path)
+
+    if args.t == True:
+        for token in program_tokens: print(token)
+        return None
+
+    program_parser = Parser(program_tokens, program_tokenizer.line_index)
+    if profiling:
+        with phase("parse"):
+            ast_nodes = program_parser.parse()
+        count("ast_nodes", len(ast_nodes))
+    else:
+        ast_nodes = program_parser.stream()
+
+    if args.T == True:
+        for node in ast_nodes: print(node)
+        return None
+
+    # The passes stream like the parser, statements go through them one at a time into the generator
+    program_optimizer = None
+    if args.O > 0:
+        program_optimizer = Optimizer(args.O)
+        if profiling:
+            with phase("optimize"):
+                ast_nodes = list(program_optimizer.optimize(ast_nodes))
+            count("optimized_ast_nodes", len(ast_nodes))
+        else:
+            ast_nodes = program_optimizer.optimize(ast_nodes)
+
+    program_generator = Generator(assembler=assembler, use_cache=not (args.no_cache or args.in_memory), optimization_level=args.O, optimize_size=args.optimize_size)
+    with phase("generate"):
+        program = program_generator.generate_assembly_elf64(ast_nodes)
+    if profiling: count("rodata_bytes", program_generator.constant_pool.statistics()["stored_bytes"])
+    if args.v == True:
+        # The optimizer's statistics are only complete once the generator has drained it
+        if program_optimizer is not None: print(program_optimizer.report())
+        print(program_generator.constant_pool.report())
+        print(program_generator.register_allocator.report())
+        if program_generator.peephole_optimizer is not None: print(program_generator.peephole_optimizer.report())
+        print(program_generator.report_builtins())
+
+    if args.in_memory:
+        program.compile_in_memory(os.path.basename(output_path))
+        return program
+
+    program.compile(output_path, full_output=args.a)
+    if args.v == True:
+        for child_program in program.child_programs:
+            if child_program.cache_status is not None:
+                print(f"Cache {child_program.cache_status} for {child_program.program_name}: {child_program.library_directory}")
+
+    if build_cache is not None:
+        build_cache.store(build_key, program.executable_path)
+        if args.v == True: print(f"Cache miss for {file_path}: stored in {build_cache.entry_directory(build_key)}")
+
+    return program
+
+def expand_file_paths(paths: list[str]) -> list[str]:
+    """
+    Expand directories to the .pnda files below them and glob patterns to the files they match.
+    """
+    file_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths.extend(sorted(glob.glob(os.path.join(path, '**', '*.pnda'), recursive=True)))
+        elif glob.has_magic(path):
+            file_paths.extend(sorted(match for match in glob.glob(path, recursive=True) if os.path.isfile(match)))
+        else:
+            file_paths.append(path)
+
+    # The same file given twice would race with itself over its output path
+    return list(dict.fromkeys(file_paths))
+
+def compile_worker(file_path: str, args: argparse.Namespace) -> tuple[str, str | None, float, Profiler | None]:
+    """
+    Compile one file of a batch, turning any failure into an error message instead of an exit.
+
+    :return: The file path, the error message or None on success, the compile time in seconds,
+             and the file's profile when profiling.
+    """
+    # Compiler errors raise instead of exiting, so one bad file only fails itself
+    exceptions.SUPPRESS_TRACEBACK = False
+
+    file_profiler = Profiler(file_path).start() if args.profile else None
+    start_time = time.perf_counter()
+    try:
+        if not os.path.isfile(file_path): raise FileNotFoundError(f"The file '{file_path}' does not exist.")
+        compile_file(file_path, args)
+        error = None
+    except PandaCompilerError as e:
+        error = f"{e.__class__.__name__}: {e.message}"
+    except subprocess.CalledProcessError as e:
+        error = f"{os.path.basename(e.cmd[0])} failed: {e.stderr.decode().strip() if e.stderr else e}"
+    except Exception as e:
+        error = f"{e.__class__.__name__}: {e}"
+
+    if file_profiler is not None: file_profiler.stop()
+    return file_path, error, time.perf_counter() - start_time, file_profiler
+
+def compile_batch(file_paths: list[str], args: argparse.Namespace) -> int:
+    """
+    Compile many files across a process pool, reporting each result as it finishes.
+
+    :return: The number of files that failed.
+    """
+    # Assemble the builtins once up front, every worker then links the same cached object
+    if not args.no_cache and args.assembler == "nasm": warm_builtins_cache()
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.j) as executor:
+        futures = [executor.submit(compile_worker, file_path, args) for file_path in file_paths]
+
+        for future in as_completed(futures):
+            file_path, error, elapsed, file_profiler = future.result()
+            if error is None:
+                print(f"ok    {file_path} ({elapsed:.3f}s)")
+            else:
+                failures += 1
+                print(f"FAIL  {file_path} ({elapsed:.3f}s): {error}")
+
+            if file_profiler is not None: file_profiler.write(args.profile, args.profile_output)
+
+    print(f"{len(file_paths) - failures} compiled, {failures} failed")
+    return failures
 
 def main() -> None:
     arg_parser = argparse.ArgumentParser(description='A compiler for the Panda programming language')
 
     arg_parser.add_argument('-a', action='store_true', help='Generate all files along with the executable (.asm, .o, .obj, etc.)')
     arg_parser.add_argument('-r', action='store_true', help='Run the code after compiling')
+    arg_parser.add_argument('--in-memory', action='store_true', help='Compile and run without writing anything to disk: intermediates stay on tmpfs and the executable runs from memory (implies -r)')
     arg_parser.add_argument('-t', action='store_true', help='Only run the tokenizer step')
+    arg_parser.add_argument('-v', action='store_true', help='Print statistics about the compilation')
     arg_parser.add_argument('-T', action='store_true', help='Only run the tokenizer, and parse steps')
-    arg_parser.add_argument('file_path', type=str, help='The path to the file you would like to compile')
+    arg_parser.add_argument('-O', default=str(DEFAULT_OPTIMIZATION_LEVEL), choices=['0', '1', '2', 's'], metavar='LEVEL', help=f'Optimization level: 0 for none, 1 to fold constants, remove dead code and merge prints, 2 to also turn constant integer prints into strings and inline builtins for speed, s for 2 but keeping builtins in their smallest form (default: {DEFAULT_OPTIMIZATION_LEVEL})')
+    arg_parser.add_argument('-j', type=int, default=os.cpu_count(), metavar='N', help='Number of files to compile in parallel when given several files (default: number of CPUs)')
+    arg_parser.add_argument('--assembler', choices=[assembler.name.lower() for assembler in ASSEMBLER], default='nasm', help='Assemble with nasm and ld, or write the ELF64 executable directly without launching either (default: nasm)')
+    arg_parser.add_argument('--profile', nargs='?', const='text', choices=['text', 'json'], help='Report the time spent in each compiler phase, counters and the process peak RSS, as text or as one JSON line per file')
+    arg_parser.add_argument('--profile-output', type=str, metavar='PATH', help='Append the profile to a file instead of printing it')
+    arg_parser.add_argument('--no-cache', action='store_true', help='Always compile from scratch, without reading or filling the build caches')
+    arg_parser.add_argument('file_paths', type=str, nargs='+', metavar='file_path', help='The files you would like to compile, directories and glob patterns compile every .pnda file they contain')
 
     args = arg_parser.parse_args()
+    # -Os runs everything -O2 does, only the code generator picks smaller code over faster code
+    args.optimize_size = args.O == 's'
+    args.O = 2 if args.optimize_size else int(args.O)
 
-    if not os.path.isfile(args.file_path):
-        print(f"Error: The file '{args.file_path}' does not exist.")
-        return
+    file_paths = expand_file_paths(args.file_paths)
 
-    program_tokenizer = Tokenizer()
-    program_tokens = program_tokenizer.tokenize(args.file_path)
+    if len(file_paths) != 1 or file_paths[0] != args.file_paths[0]:
+        if args.r or args.t or args.T or args.in_memory:
+            print("Error: -r, -t, -T and --in-memory only work with a single file.")
+            sys.exit(1)
 
-    if args.t == True:
-        pprint.pprint(program_tokens.tokens)
+        if compile_batch(file_paths, args) > 0: sys.exit(1)
         return
 
-    program_parser = Parser(program_tokens)
-    program_ast = program_parser.parse()
-
-    if args.T == True:
-        pprint.pprint(program_parser.nodes)
+    if not os.path.isfile(file_paths[0]):
+        print(f"Error: The file '{file_paths[0]}' does not exist.")
         return
 
-    program_generator = Generator(assembler=ASSEMBLER.NASM)
-    program = program_generator.generate_assembly_elf64(program_ast)
+    if args.in_memory and args.a:
+        print("Error: -a writes the intermediates to disk, it can't be used with --in-memory.")
+        sys.exit(1)
 
-    output_path = os.path.join(args.file_path, '../', os.path.splitext(os.path.basename(args.file_path))[0])
-    program.compile(output_path, full_output=args.a)
-    if args.r == True: program.run()
+    file_profiler = Profiler(file_paths[0]).start() if args.profile else None
 
-if __name__ == '__main__':
-    import time
+    program = compile_file(file_paths[0], args)
+    if program is not None and args.in_memory:
+        program.run_in_memory(os.path.splitext(os.path.basename(file_paths[0]))[0])
+    elif program is not None and args.r == True:
+        program.run()
 
+    if file_profiler is not None:
+        file_profiler.stop()
+        file_profiler.write(args.profile, args.profile_output)
+
+if __name__ == '__main__':
     start_time = time.time()
     main()
 
@@ -1,67 +1,291 @@
 from enum import Enum, auto
+from collections import deque
 
-from exceptions import UnexpectedTokenError, UnrecognizedTokenError
+from exceptions import ParsingError, ParsingErrors, UnexpectedTokenError, UnrecognizedTokenError, IntegerOutOfRangeError, UndefinedVariableError, RedeclaredVariableError, ImmutableVariableError
 from tokenizer import TOKEN_TYPE, Token, Tokens
+from source import LineIndex
+
+END_OF_FILE_TOKEN = Token(TOKEN_TYPE.END_OF_FILE)
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+STDOUT_FILE_DESCRIPTOR = 1
+
+# Binding strength of the binary operators, higher binds tighter
+BINARY_OPERATOR_PRECEDENCE = {
+    TOKEN_TYPE.PLUS: 1,
+    TOKEN_TYPE.MINUS: 1,
+    TOKEN_TYPE.MULTIPLY: 2,
+    TOKEN_TYPE.DIVIDE: 2,
+}
 
 class AST_NODE_TYPE(Enum):
     EXIT = auto()
     PRINT = auto()
+    # The value is the path, the only operand is the file descriptor written to
+    CAT = auto()
+
+    # Variables, the statement's value is the variable name and its operands hold the assigned expression
+    LET = auto()
+    VAR = auto()
+    ASSIGN = auto()
+
+    # Expressions
+    INTEGER = auto()
+    NEGATE = auto()
+    BINARY_OPERATION = auto()
+    VARIABLE = auto()
 
 class ASTNode:
-    def __init__(self, type_, value=None):
+    __slots__ = ('type', 'value', 'start', 'end', 'operands')
+
+    def __init__(self, type_, value=None, start=None, end=None, operands=None):
         self.type = type_
         self.value = value
+        # Byte offsets of the statement in its source, end is exclusive
+        self.start = start
+        self.end = end
+        # Sub-expressions of NEGATE and BINARY_OPERATION nodes, a binary operation's value is its operator's TOKEN_TYPE
+        self.operands = operands
 
     def __repr__(self) -> str:
+        if self.operands is not None:
+            return f"ASTNode({self.type}, {self.value}, {list(self.operands)})"
+
         if self.value is not None:
             return f"ASTNode({self.type}, {self.value})"
 
         return f"ASTNode({self.type})"
 
 class Parser:
-    def __init__(self, tokens: Tokens):
-        self.tokens = tokens.get_tokens()
-        self.current = 0
+    def __init__(self, tokens: Tokens = (), line_index: LineIndex = None):
+        # Statement parsers by the token that starts the statement
+        self.statement_parsers = {
+            TOKEN_TYPE.EXIT: self.parse_exit,
+            TOKEN_TYPE.PRINT: self.parse_print,
+            TOKEN_TYPE.CAT: self.parse_cat,
+            TOKEN_TYPE.LET: self.parse_declaration,
+            TOKEN_TYPE.VAR: self.parse_declaration,
+            TOKEN_TYPE.IDENTIFIER: self.parse_assignment,
+        }
+
+        self.reset(tokens, line_index)
+
+    def reset(self, tokens: Tokens, line_index: LineIndex = None) -> None:
+        """
+        Start over on a new token stream, so one parser can be reused for many programs.
+        """
+        # Tokens are pulled on demand from any iterable, a Tokens list or Tokenizer.stream(),
+        # so only the small lookahead buffer has to be held in memory
+        self.tokens = iter(tokens)
+        self.lookahead = deque()
+        self.line_index = line_index
         self.nodes = []
+        self.errors = []
+        self.last_end = None
+        # Whether each declared variable can be assigned to, var can and let can't
+        self.variables = {}
+
+    def peek(self, distance=0):
+        while len(self.lookahead) <= distance:
+            token = next(self.tokens, None)
+            if token is None: return END_OF_FILE_TOKEN
+            self.lookahead.append(token)
+
+        return self.lookahead[distance]
 
     def current_token(self):
-        if self.current < len(self.tokens):
-            return self.tokens[self.current]
-        else:
-            return Token(TOKEN_TYPE.END_OF_FILE)
+        return self.peek(0)
+
+    def location(self, token: Token) -> str:
+        if self.line_index is None or token.start is None: return "unknown location"
+        return self.line_index.format(token.start)
+
+    def advance(self) -> Token:
+        token = self.current_token()
+        if self.lookahead: self.lookahead.popleft()
+        self.last_end = token.end
+        return token
 
     def consume(self, expected_type):
-        if self.current_token().type == expected_type:
-            self.current += 1
+        token = self.current_token()
+        if token.type == expected_type:
+            return self.advance()
         else:
-            UnexpectedTokenError(f"Expected {expected_type}, but got {self.current_token().type}").raise_err()
+            raise UnexpectedTokenError(f"Expected {expected_type}, but got {token.type} at {self.location(token)}")
+
+    def synchronize(self) -> None:
+        """
+        Recover from an error by skipping past the next semicolon, where the next statement should start.
+        """
+        while True:
+            token = self.current_token()
+            if token.type == TOKEN_TYPE.END_OF_FILE: return
+
+            self.advance()
+            if token.type == TOKEN_TYPE.SEMICOLON: return
+
+    def report_errors(self) -> None:
+        if len(self.errors) == 1:
+            self.errors[0].raise_err()
+        elif self.errors:
+            ParsingErrors(self.errors).raise_err()
 
     def parse(self):
-        self.nodes = []
-        while self.current_token().type != TOKEN_TYPE.END_OF_FILE:
-            if self.current_token().type == TOKEN_TYPE.EXIT:
-                self.nodes.append(self.parse_exit())
-            elif self.current_token().type == TOKEN_TYPE.PRINT:
-                self.nodes.append(self.parse_print())
-            else:
-                UnrecognizedTokenError(f"Unrecognized Token Type {self.current_token().type}").raise_err()
-            
+        self.nodes = list(self.stream())
         return self.nodes
-    
+
+    def stream(self):
+        """
+        Lazily parse the token stream, yielding each AST node as soon as its statement is complete.
+        Nodes are not kept on the parser, use parse() when the full list is needed.
+
+        A statement with an error is skipped up to the next semicolon and parsing carries on,
+        every error in the file is reported together once the stream ends.
+        """
+        statement_parsers = self.statement_parsers
+
+        while True:
+            token = self.current_token()
+            if token.type == TOKEN_TYPE.END_OF_FILE: break
+
+            try:
+                statement_parser = statement_parsers.get(token.type)
+                if statement_parser is None:
+                    raise UnrecognizedTokenError(f"Unrecognized Token Type {token.type} at {self.location(token)}")
+
+                node = statement_parser()
+            except ParsingError as e:
+                self.errors.append(e)
+                self.synchronize()
+                continue
+
+            yield node
+
+        self.report_errors()
+
     def parse_print(self):
+        start = self.current_token().start
         self.consume(TOKEN_TYPE.PRINT)
         self.consume(TOKEN_TYPE.OPEN_PARENTHESES)
-        print_string = self.current_token().value
-        self.consume(TOKEN_TYPE.CONST_STRING)
+        if self.current_token().type == TOKEN_TYPE.CONST_STRING:
+            print_value = str(self.consume(TOKEN_TYPE.CONST_STRING).value)
+        else:
+            print_value = self.statement_value(self.parse_expression())
         self.consume(TOKEN_TYPE.CLOSE_PARENTHESES)
         self.consume(TOKEN_TYPE.SEMICOLON)
-        return ASTNode(AST_NODE_TYPE.PRINT, str(print_string))
+        return ASTNode(AST_NODE_TYPE.PRINT, print_value, start, self.last_end)
 
     def parse_exit(self):
+        start = self.current_token().start
         self.consume(TOKEN_TYPE.EXIT)
         self.consume(TOKEN_TYPE.OPEN_PARENTHESES)
-        exit_code = self.current_token().value
-        self.consume(TOKEN_TYPE.INTEGER)
+        exit_code = self.statement_value(self.parse_expression())
         self.consume(TOKEN_TYPE.CLOSE_PARENTHESES)
         self.consume(TOKEN_TYPE.SEMICOLON)
-        return ASTNode(AST_NODE_TYPE.EXIT, int(exit_code))
+        return ASTNode(AST_NODE_TYPE.EXIT, exit_code, start, self.last_end)
+
+    def parse_cat(self):
+        start = self.current_token().start
+        self.consume(TOKEN_TYPE.CAT)
+        self.consume(TOKEN_TYPE.OPEN_PARENTHESES)
+        path = str(self.consume(TOKEN_TYPE.CONST_STRING).value)
+        # Files go to stdout unless another file descriptor is given
+        if self.current_token().type == TOKEN_TYPE.COMMA:
+            self.advance()
+            file_descriptor = self.parse_expression()
+        else:
+            file_descriptor = ASTNode(AST_NODE_TYPE.INTEGER, STDOUT_FILE_DESCRIPTOR)
+        self.consume(TOKEN_TYPE.CLOSE_PARENTHESES)
+        self.consume(TOKEN_TYPE.SEMICOLON)
+        return ASTNode(AST_NODE_TYPE.CAT, path, start, self.last_end, (file_descriptor,))
+
+    def parse_declaration(self):
+        keyword = self.advance()
+        name = self.consume(TOKEN_TYPE.IDENTIFIER)
+        # Errors are raised before the semicolon is consumed, recovering skips to the end of this statement
+        if name.value in self.variables:
+            raise RedeclaredVariableError(f"Variable {name.value} is already declared, at {self.location(name)}")
+
+        self.consume(TOKEN_TYPE.EQUALS)
+        # The name is only declared after its expression, so it can't be used in it
+        expression = self.parse_expression()
+        self.variables[name.value] = keyword.type == TOKEN_TYPE.VAR
+        self.consume(TOKEN_TYPE.SEMICOLON)
+
+        node_type = AST_NODE_TYPE.VAR if keyword.type == TOKEN_TYPE.VAR else AST_NODE_TYPE.LET
+        return ASTNode(node_type, name.value, keyword.start, self.last_end, (expression,))
+
+    def parse_assignment(self):
+        name = self.advance()
+        mutable = self.variables.get(name.value)
+        if mutable is None:
+            raise UndefinedVariableError(f"Assignment to undeclared variable {name.value} at {self.location(name)}")
+        if not mutable:
+            raise ImmutableVariableError(f"Variable {name.value} is declared with let and can't be assigned to, at {self.location(name)}")
+
+        self.consume(TOKEN_TYPE.EQUALS)
+        expression = self.parse_expression()
+        self.consume(TOKEN_TYPE.SEMICOLON)
+
+        return ASTNode(AST_NODE_TYPE.ASSIGN, name.value, name.start, self.last_end, (expression,))
+
+    @staticmethod
+    def statement_value(expression: ASTNode):
+        """
+        Statements hold plain ints for integer literals and expression nodes for anything else.
+        """
+        if expression.type == AST_NODE_TYPE.INTEGER: return expression.value
+        return expression
+
+    def integer_literal(self, value: int, start: int, token: Token) -> ASTNode:
+        if not INT64_MIN <= value <= INT64_MAX:
+            raise IntegerOutOfRangeError(f"Integer {value} does not fit in 64 bits at {self.location(token)}")
+
+        return ASTNode(AST_NODE_TYPE.INTEGER, int(value), start, token.end)
+
+    def parse_expression(self, min_precedence=1) -> ASTNode:
+        """
+        Parse an integer expression by precedence climbing, operators of equal precedence group to the left.
+        """
+        left = self.parse_unary()
+
+        while True:
+            operator = self.current_token()
+            precedence = BINARY_OPERATOR_PRECEDENCE.get(operator.type)
+            if precedence is None or precedence < min_precedence: return left
+
+            self.advance()
+            right = self.parse_expression(precedence + 1)
+            left = ASTNode(AST_NODE_TYPE.BINARY_OPERATION, operator.type, left.start, right.end, (left, right))
+
+    def parse_unary(self) -> ASTNode:
+        token = self.current_token()
+
+        if token.type == TOKEN_TYPE.MINUS:
+            self.advance()
+            operand = self.current_token()
+
+            # A minus directly in front of a literal is part of it, so INT64_MIN can be written
+            if operand.type == TOKEN_TYPE.INTEGER:
+                self.advance()
+                return self.integer_literal(-operand.value, token.start, operand)
+
+            operand = self.parse_unary()
+            return ASTNode(AST_NODE_TYPE.NEGATE, None, token.start, operand.end, (operand,))
+
+        if token.type == TOKEN_TYPE.OPEN_PARENTHESES:
+            self.advance()
+            expression = self.parse_expression()
+            self.consume(TOKEN_TYPE.CLOSE_PARENTHESES)
+            return expression
+
+        if token.type == TOKEN_TYPE.IDENTIFIER:
+            self.advance()
+            if token.value not in self.variables:
+                raise UndefinedVariableError(f"Variable {token.value} is used before it is declared, at {self.location(token)}")
+            return ASTNode(AST_NODE_TYPE.VARIABLE, token.value, token.start, token.end)
+
+        self.consume(TOKEN_TYPE.INTEGER)
+        return self.integer_literal(token.value, token.start, token)
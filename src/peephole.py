@@ -0,0 +1,558 @@
+import re
+import time
+from itertools import islice
+
+from elf64 import REGISTERS, Assembler, SourceAssembler
+from regalloc import CALL_CLOBBERED_REGISTERS
+
+# The 64-bit register every register name is part of
+FULL_REGISTER_NAMES = {number: name for name, (number, size) in REGISTERS.items() if size == 64}
+FULL_REGISTERS = {name: FULL_REGISTER_NAMES[number] for name, (number, size) in REGISTERS.items()}
+REGISTERS_32 = {FULL_REGISTER_NAMES[number]: name for name, (number, size) in REGISTERS.items() if size == 32}
+
+# Macros from builtins-elf64.asm, they call into the runtime and return having clobbered these
+RUNTIME_MACROS = frozenset({"print", "printInt", "flush", "exit", "cat"})
+RUNTIME_CLOBBERS = frozenset(CALL_CLOBBERED_REGISTERS + ("rax", "rdx", "flags"))
+
+# Destination is only written
+MOVES = frozenset({"mov", "movzx", "movsx", "lea"})
+# Destination is read and written, flags are written
+READ_MODIFY_WRITE = frozenset({"add", "sub", "and", "or", "xor", "imul", "shl", "sal", "shr", "sar", "neg", "inc", "dec"})
+
+# Every instruction elf64.py encodes, other lines of an assembly source are kept as they are
+MNEMONICS = frozenset(Assembler().encoders) | {"rep"}
+ASM_LABEL_PATTERN = re.compile(r"^([A-Za-z_.%@$?][\w.%@$?]*):$")
+
+INVERTED_CONDITIONS = {
+    "e": "ne", "ne": "e", "z": "nz", "nz": "z", "l": "ge", "ge": "l", "le": "g", "g": "le",
+    "b": "ae", "ae": "b", "be": "a", "a": "be", "s": "ns", "ns": "s", "o": "no", "no": "o",
+    "c": "nc", "nc": "c", "p": "np", "np": "p",
+}
+# Instructions in front of a loop's compare and branch that may be copied to the end of the loop
+LOOP_CONDITION_LIMIT = 2
+
+# Stack slots are the only memory whose stores can be tracked, nothing else addresses them
+SLOT_PATTERN = re.compile(r"^(?:qword\s+)?\[rsp(?:\s*\+\s*(\d+))?\]$")
+NUMBER_PATTERN = re.compile(r"^-?\d+$")
+
+class AsmInstruction:
+    __slots__ = ('mnemonic', 'operands', 'comment')
+
+    def __init__(self, mnemonic: str, operands: tuple = (), comment: str = None) -> None:
+        self.mnemonic = mnemonic
+        self.operands = tuple(operands)
+        self.comment = comment
+
+    def format(self) -> str:
+        text = f"{self.mnemonic} {', '.join(self.operands)}" if self.operands else self.mnemonic
+        return f"{text} ; {self.comment}" if self.comment else text
+
+    def __repr__(self) -> str:
+        return f"AsmInstruction({self.format()})"
+
+class AsmLabel:
+    __slots__ = ('name',)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def format(self) -> str:
+        return f"{self.name}:"
+
+    def __repr__(self) -> str:
+        return f"AsmLabel({self.name})"
+
+class AsmDirective:
+    """
+    A line of an assembly source that isn't an instruction or a label: a directive, data, a
+    comment or a blank line. It is kept as written and nothing is moved across it.
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+    def format(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"AsmDirective({self.text.strip()})"
+
+class Everything:
+    """
+    Stands in for the set of every register and slot, where what is read or live can't be known.
+    """
+    def __contains__(self, item) -> bool:
+        return True
+
+    def __or__(self, other) -> 'Everything':
+        return self
+
+    __ror__ = __or__
+
+    def __sub__(self, other) -> 'Everything':
+        return self
+
+    def update(self, other) -> None:
+        pass
+
+    def difference_update(self, other) -> None:
+        pass
+
+EVERYTHING = Everything()
+
+def parse_assembly(source: str) -> list:
+    """
+    Read an assembly source into instructions, labels and, for every other line, directives.
+
+    Lines with a comment or a string are kept as directives too, so the rules never have to
+    tell a ; or a quote in an operand from the start of a comment.
+    """
+    instructions = []
+    for line in source.splitlines():
+        text = line.strip()
+        label = ASM_LABEL_PATTERN.match(text)
+        words = text.split(None, 1)
+
+        if label is not None:
+            instructions.append(AsmLabel(label.group(1)))
+        elif words and (words[0] in MNEMONICS or words[0] in RUNTIME_MACROS) and not any(char in text for char in ";\"'`"):
+            operands = SourceAssembler.split_operands(words[1]) if len(words) > 1 else []
+            instructions.append(AsmInstruction(words[0], operands))
+        else:
+            instructions.append(AsmDirective(line))
+
+    return instructions
+
+def format_assembly(instructions: list) -> str:
+    lines = [instruction.format() if isinstance(instruction, (AsmLabel, AsmDirective)) else f"    {instruction.format()}" for instruction in instructions]
+    return "\n".join(lines) + "\n"
+
+def is_register(operand: str) -> bool:
+    return operand in FULL_REGISTERS
+
+def is_memory(operand: str) -> bool:
+    return operand.endswith("]")
+
+def is_number(operand: str) -> bool:
+    return NUMBER_PATTERN.match(operand) is not None
+
+def slot_key(operand: str) -> str | None:
+    match = SLOT_PATTERN.match(operand)
+    return f"[rsp + {match.group(1) or 0}]" if match else None
+
+def operand_reads(operand: str):
+    """
+    :return: What reading an operand reads, its register, or the slot and the registers of its address.
+    """
+    if is_register(operand): return {FULL_REGISTERS[operand]}
+    # A macro parameter may turn out to be any register or address
+    if "%" in operand: return EVERYTHING
+    if not is_memory(operand): return set()
+
+    slot = slot_key(operand)
+    if slot is None: return EVERYTHING
+    return {"rsp", slot}
+
+def address_reads(operand: str) -> set:
+    # Registers used to compute an address, for lea and for stores
+    return {FULL_REGISTERS[word] for word in re.findall(r"[a-z]\w*", operand) if word in FULL_REGISTERS}
+
+def effects(instruction) -> tuple:
+    """
+    What an instruction reads and writes, "flags" included.
+
+    :return: (reads, writes, removable), removable instructions have no effect besides their writes.
+             Anything not understood reads everything and can't be removed.
+    """
+    if not isinstance(instruction, AsmInstruction): return EVERYTHING, set(), False
+
+    mnemonic, operands = instruction.mnemonic, instruction.operands
+
+    if mnemonic in RUNTIME_MACROS:
+        reads = set()
+        for operand in operands: reads = reads | operand_reads(operand)
+        return reads, set(RUNTIME_CLOBBERS), False
+
+    if mnemonic == "cqo": return {"rax"}, {"rdx"}, True
+    if mnemonic in ("idiv", "div"):
+        # Division traps on a zero divisor, it has to stay even when its result is unused
+        return {"rax", "rdx"} | operand_reads(operands[0]), {"rax", "rdx", "flags"}, False
+    if mnemonic in ("imul", "mul") and len(operands) == 1:
+        return {"rax"} | operand_reads(operands[0]), {"rax", "rdx", "flags"}, True
+    if mnemonic in ("cmp", "test"):
+        return operand_reads(operands[0]) | operand_reads(operands[1]), {"flags"}, True
+
+    if mnemonic in MOVES or mnemonic in READ_MODIFY_WRITE:
+        destination = operands[0]
+        if mnemonic == "lea":
+            reads = address_reads(operands[1])
+        else:
+            reads = set()
+            for operand in operands[1:]: reads = reads | operand_reads(operand)
+
+        if mnemonic in READ_MODIFY_WRITE:
+            # xor r, r zeroes r without depending on it
+            if not (mnemonic in ("xor", "sub") and len(operands) == 2 and operands[0] == operands[1]) and not (mnemonic == "imul" and len(operands) == 3):
+                reads = reads | operand_reads(destination)
+            writes = {"flags"}
+            # inc and dec keep the carry flag
+            if mnemonic in ("inc", "dec"): reads = reads | {"flags"}
+        else:
+            writes = set()
+
+        if is_register(destination):
+            _, size = REGISTERS[destination]
+            # Writing the low 8 or 16 bits keeps the rest of the register
+            if size < 32: reads = reads | {FULL_REGISTERS[destination]}
+            return reads, writes | {FULL_REGISTERS[destination]}, True
+
+        slot = slot_key(destination)
+        reads = reads | address_reads(destination)
+        if slot is None: return reads, writes, False
+        return reads, writes | {slot}, True
+
+    return EVERYTHING, set(), False
+
+def is_dead(instructions: list, index: int, value: str, live_out=frozenset()) -> bool:
+    """
+    Is value dead after instructions[index], overwritten or never read again before being read?
+
+    Scans forward, which usually stops within a few instructions as registers are reused quickly.
+    Labels and anything unknown read everything, so code with branches stays correct, just less optimized.
+    """
+    for instruction in islice(instructions, index + 1, None):
+        reads, writes, _ = effects(instruction)
+        if value in reads: return False
+        # exit never returns, nothing after it is ever read
+        if value in writes or (isinstance(instruction, AsmInstruction) and instruction.mnemonic == "exit"): return True
+
+    return value not in live_out
+
+def intersects(values: set, live) -> bool:
+    return any(value in live for value in values)
+
+class PeepholeRuleSet:
+    """
+    Base class for a set of peephole rules.
+
+    A rule set walks the instructions once and returns the rewritten list, counting how often
+    each of its rules fired in statistics. No rule may change what the program does.
+    """
+    name = "rules"
+
+    def __init__(self) -> None:
+        self.statistics = {}
+        self.elapsed = 0.0
+
+    def count(self, rule: str, value: int = 1) -> None:
+        self.statistics[rule] = self.statistics.get(rule, 0) + value
+
+    def rewrites(self) -> int:
+        return sum(self.statistics.values())
+
+    def run(self, instructions: list) -> list:
+        raise NotImplementedError
+
+class RedundantMoves(PeepholeRuleSet):
+    """
+    Remove moves that don't change anything, and moves through a register that dies right after.
+
+    mov rax, rax                    ->
+    mov [rsp + 8], rax / mov rax, [rsp + 8]  -> mov [rsp + 8], rax
+    mov rax, rcx / mov rcx, rax     -> mov rax, rcx
+    mov rax, 5 / mov rbx, rax       -> mov rbx, 5      (when rax isn't read again)
+    """
+    name = "redundant-moves"
+
+    def run(self, instructions: list) -> list:
+        result = []
+
+        for index, instruction in enumerate(instructions):
+            previous = result[-1] if result else None
+
+            if isinstance(instruction, AsmInstruction) and instruction.mnemonic == "mov":
+                destination, source = instruction.operands
+
+                if destination == source and (not is_register(destination) or REGISTERS[destination][1] == 64):
+                    self.count("self_moves")
+                    continue
+
+                if self.is_mov(previous) and previous.operands == (source, destination) and self.same_value_after(destination, source):
+                    self.count("moves_back")
+                    continue
+
+                # mov eax, 5 set all of rax, forwarding its number is fine too
+                if self.is_mov(previous) and is_register(source) and REGISTERS[source][1] == 64 and source != destination \
+                        and (previous.operands[0] == source or (FULL_REGISTERS.get(previous.operands[0]) == source and is_number(previous.operands[1]))) \
+                        and is_dead(instructions, index, FULL_REGISTERS[source]):
+                    forwarded = self.forward(previous.operands[1], destination)
+                    if forwarded is not None:
+                        result[-1] = forwarded
+                        self.count("forwarded")
+                        continue
+
+            result.append(instruction)
+
+        return result
+
+    @staticmethod
+    def is_mov(instruction) -> bool:
+        return isinstance(instruction, AsmInstruction) and instruction.mnemonic == "mov"
+
+    @staticmethod
+    def same_value_after(destination: str, source: str) -> bool:
+        """
+        After mov source, destination, does destination already hold what mov destination, source would write?
+        Not for 32-bit registers, whose writes also clear the upper half, nor when the register is part of the address.
+        """
+        for operand, other in ((destination, source), (source, destination)):
+            if is_register(operand):
+                if REGISTERS[operand][1] != 64 or FULL_REGISTERS[operand] in address_reads(other): return False
+
+        return True
+
+    @staticmethod
+    def forward(value: str, destination: str) -> AsmInstruction | None:
+        # There is no memory to memory mov, and only registers take 64-bit immediates
+        if is_memory(destination) and (is_memory(value) or (is_number(value) and not -2 ** 31 <= int(value) < 2 ** 31)): return None
+        if is_memory(destination) and not is_number(value) and not is_register(value): return None
+        if is_register(destination) and REGISTERS[destination][1] != 64: return None
+        if FULL_REGISTERS.get(destination) in address_reads(value): return None
+
+        return AsmInstruction("mov", (destination, value))
+
+class ZeroingIdioms(PeepholeRuleSet):
+    """
+    Use the shorter encodings that rely on 32-bit writes zeroing the upper half of a register.
+
+    mov rax, 0          -> xor eax, eax     (when the flags it clobbers are dead)
+    mov rax, 60         -> mov eax, 60
+    exit 300            -> exit 44          (the exit status only keeps the low byte)
+    """
+    name = "zeroing-idioms"
+
+    def run(self, instructions: list) -> list:
+        result = []
+
+        for index, instruction in enumerate(instructions):
+            if isinstance(instruction, AsmInstruction) and instruction.mnemonic == "mov":
+                destination, source = instruction.operands
+
+                if is_register(destination) and REGISTERS[destination][1] == 64 and is_number(source):
+                    value = int(source)
+                    if value == 0 and is_dead(instructions, index, "flags"):
+                        register = REGISTERS_32[destination]
+                        instruction = AsmInstruction("xor", (register, register), instruction.comment)
+                        self.count("xor_zeroing")
+                    elif 0 < value < 2 ** 32:
+                        instruction = AsmInstruction("mov", (REGISTERS_32[destination], source), instruction.comment)
+                        self.count("zero_extended_immediates")
+            elif isinstance(instruction, AsmInstruction) and instruction.mnemonic == "exit" and is_number(instruction.operands[0]):
+                value = int(instruction.operands[0])
+                if not 0 <= value <= 255:
+                    instruction = AsmInstruction("exit", (str(value & 255),), instruction.comment)
+                    self.count("exit_status_bytes")
+
+            result.append(instruction)
+
+        return result
+
+class DeadStores(PeepholeRuleSet):
+    """
+    Remove instructions whose results are never read, register writes and stack slot stores alike.
+
+    mov rcx, 5 / mov rcx, 7         -> mov rcx, 7
+    add rax, 1 / exit 0             -> exit 0
+    """
+    name = "dead-stores"
+
+    def run(self, instructions: list) -> list:
+        kept = []
+        live = set()
+
+        # Walk backward, so each instruction is checked against what is live after it
+        for instruction in reversed(instructions):
+            reads, writes, removable = effects(instruction)
+
+            if removable and not intersects(writes, live):
+                self.count("removed")
+                continue
+
+            kept.append(instruction)
+            # Updated in place, a new set for every instruction would copy every live stack slot each time
+            if reads is EVERYTHING:
+                live = EVERYTHING
+            elif isinstance(instruction, AsmInstruction) and instruction.mnemonic == "exit":
+                live = set(reads)
+            else:
+                live.difference_update(writes)
+                live.update(reads)
+
+        kept.reverse()
+        return kept
+
+class CompareAndBranch(PeepholeRuleSet):
+    """
+    Simplify comparisons and jumps.
+
+    cmp rax, 0                      -> test rax, rax
+    jmp .next / .next:              -> .next:
+    je .skip / jmp .other / .skip:  -> jne .other / .skip:
+
+    A loop that jumps back to its compare and branch gets a copy of them at its end instead,
+    which saves a jump every iteration:
+
+    .loop: / cmp rdx, 0 / je .done / inc rdx / jmp .loop / .done:
+        -> .loop: / cmp rdx, 0 / je .done / .loopBody: / inc rdx / cmp rdx, 0 / jne .loopBody / .done:
+    """
+    name = "compare-and-branch"
+
+    def run(self, instructions: list) -> list:
+        result = []
+        # index of jmp -> the instructions replacing it, index of a loop's branch -> the label going after it
+        rotated_jumps, body_labels = self.rotations(instructions)
+
+        for index, instruction in enumerate(instructions):
+            if isinstance(instruction, AsmInstruction) and instruction.mnemonic == "cmp" and instruction.operands[1] == "0" and is_register(instruction.operands[0]):
+                register = instruction.operands[0]
+                instruction = AsmInstruction("test", (register, register), instruction.comment)
+                self.count("test_for_zero")
+
+            if index in rotated_jumps:
+                result.extend(rotated_jumps[index])
+                self.count("rotated_loops")
+                continue
+
+            if isinstance(instruction, AsmLabel):
+                if result and self.is_jump(result[-1], "jmp") and result[-1].operands[0] == instruction.name:
+                    result.pop()
+                    self.count("jumps_to_next")
+                elif len(result) >= 2 and self.is_jump(result[-1], "jmp") and self.conditional_jump(result[-2]) is not None \
+                        and result[-2].operands[0] == instruction.name:
+                    condition = self.conditional_jump(result[-2])
+                    target = result.pop().operands[0]
+                    result[-1] = AsmInstruction(f"j{INVERTED_CONDITIONS[condition]}", (target,))
+                    self.count("inverted_branches")
+
+            result.append(instruction)
+            if index in body_labels: result.append(AsmLabel(body_labels[index]))
+
+        return result
+
+    def rotations(self, instructions: list) -> tuple[dict, dict]:
+        """
+        Find the loops ending in jmp .loop, right before the label their branch leaves the loop for.
+
+        Only loops whose head is a compare and branch, after at most LOOP_CONDITION_LIMIT other
+        instructions, are rotated. There may be no ordinary label between the head and the jump,
+        so the local labels on both ends belong to the same one.
+        """
+        labels = {instruction.name: index for index, instruction in enumerate(instructions) if isinstance(instruction, AsmLabel)}
+        rotated_jumps, body_labels = {}, {}
+
+        for index, instruction in enumerate(instructions[:-1]):
+            if not self.is_jump(instruction, "jmp") or not isinstance(instructions[index + 1], AsmLabel): continue
+
+            head = labels.get(instruction.operands[0])
+            if head is None or head > index: continue
+            exit_label = instructions[index + 1].name
+
+            condition = None
+            for branch in range(head + 1, min(head + LOOP_CONDITION_LIMIT + 3, index)):
+                if self.conditional_jump(instructions[branch]) is not None:
+                    condition = branch
+                    break
+                if not isinstance(instructions[branch], AsmInstruction) or self.is_branch(instructions[branch]): break
+            if condition is None or instructions[condition].operands[0] != exit_label: continue
+            if not self.is_compare(instructions[condition - 1]): continue
+            if any(isinstance(between, AsmLabel) and self.is_ordinary_label(between.name) for between in instructions[head + 1:index]): continue
+
+            body_label = self.body_label(instructions[head].name)
+            if body_label in labels or condition in body_labels: continue
+
+            inverted = INVERTED_CONDITIONS[self.conditional_jump(instructions[condition])]
+            rotated_jumps[index] = [AsmInstruction(copied.mnemonic, copied.operands, copied.comment) for copied in instructions[head + 1:condition]] + [AsmInstruction(f"j{inverted}", (body_label,))]
+            body_labels[condition] = body_label
+
+        return rotated_jumps, body_labels
+
+    @staticmethod
+    def body_label(loop_label: str) -> str:
+        # Local to the same scope as the loop, a new ordinary label would take the loop's local labels with it
+        if loop_label.startswith(".") or loop_label.startswith("%%"): return f"{loop_label}Body"
+        return f".{loop_label.lstrip('_')}Body"
+
+    @staticmethod
+    def is_ordinary_label(name: str) -> bool:
+        return not name.startswith(".") and not name.startswith("%%")
+
+    @staticmethod
+    def is_jump(instruction, mnemonic: str) -> bool:
+        return isinstance(instruction, AsmInstruction) and instruction.mnemonic == mnemonic
+
+    @staticmethod
+    def is_compare(instruction) -> bool:
+        return isinstance(instruction, AsmInstruction) and instruction.mnemonic in ("cmp", "test")
+
+    @staticmethod
+    def is_branch(instruction) -> bool:
+        return isinstance(instruction, AsmInstruction) and (instruction.mnemonic.startswith("j") or instruction.mnemonic in ("call", "ret") or instruction.mnemonic in RUNTIME_MACROS)
+
+    @staticmethod
+    def conditional_jump(instruction) -> str | None:
+        """
+        :return: The condition of a conditional jump, None for anything else.
+        """
+        if not isinstance(instruction, AsmInstruction) or not instruction.mnemonic.startswith("j"): return None
+        condition = instruction.mnemonic[1:]
+        return condition if condition in INVERTED_CONDITIONS else None
+
+# Rule sets in the order they run, every round
+RULE_SETS = [RedundantMoves, ZeroingIdioms, CompareAndBranch, DeadStores]
+
+class PeepholeOptimizer:
+    """
+    Runs the peephole rule sets over the generated instructions until none of them finds anything
+    left to rewrite, then reports how many instructions there were before and after.
+    """
+    def __init__(self, rule_sets: list[type] = None, max_rounds: int = 4) -> None:
+        self.rule_sets = [rule_set() for rule_set in (rule_sets if rule_sets is not None else RULE_SETS)]
+        self.max_rounds = max_rounds
+        self.instructions_before = 0
+        self.instructions_after = 0
+
+    @staticmethod
+    def instruction_count(instructions: list) -> int:
+        return sum(1 for instruction in instructions if isinstance(instruction, AsmInstruction))
+
+    def optimize(self, instructions: list) -> list:
+        self.instructions_before += self.instruction_count(instructions)
+
+        for _ in range(self.max_rounds):
+            rewrites = sum(rule_set.rewrites() for rule_set in self.rule_sets)
+
+            for rule_set in self.rule_sets:
+                start_time = time.perf_counter()
+                instructions = rule_set.run(instructions)
+                rule_set.elapsed += time.perf_counter() - start_time
+
+            if sum(rule_set.rewrites() for rule_set in self.rule_sets) == rewrites: break
+
+        self.instructions_after += self.instruction_count(instructions)
+        return instructions
+
+    def optimize_assembly(self, source: str) -> str:
+        """
+        Optimize the instructions of an assembly source, like the expanded builtin macros and the
+        runtime routines, everything that isn't an instruction or a label stays as it is.
+        """
+        return format_assembly(self.optimize(parse_assembly(source)))
+
+    def report(self) -> str:
+        lines = [f"Peephole: {self.instructions_before} -> {self.instructions_after} instructions"]
+        for rule_set in self.rule_sets:
+            counters = ", ".join(f"{name} {value}" for name, value in rule_set.statistics.items()) or "nothing"
+            lines.append(f"  {rule_set.name}: {counters} ({rule_set.elapsed * 1000:.3f} ms)")
+
+        return "\n".join(lines)
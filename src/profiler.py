@@ -0,0 +1,108 @@
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager, nullcontext
+
+# The profiler the compiler phases report to, per thread so compiles running side by side
+# through the library API each time their own phases
+PROFILER_STATE = threading.local()
+
+def active_profiler() -> 'Profiler | None':
+    """
+    :return: The profiler of the current thread, None when profiling is off.
+    """
+    return getattr(PROFILER_STATE, "profiler", None)
+
+class Profiler:
+    """
+    Collects the wall time of each compiler phase and counters about what it produced.
+
+    Phases are timed with perf_counter and accumulate when entered more than once, so a
+    program assembled in several parts reports their sum. Memory is the peak resident set size
+    of the whole process since it started, which costs nothing to read, unlike tracing allocations
+    which slows a compile down several times. It is not reset between files, so for a worker of a
+    batch it is the peak over every file that worker compiled so far, an upper bound for this one.
+    """
+    def __init__(self, file_path: str = None) -> None:
+        self.file_path = file_path
+        self.phases = {}
+        self.counters = {}
+        self.process_peak_rss_bytes = None
+
+    def start(self) -> 'Profiler':
+        PROFILER_STATE.profiler = self
+        return self
+
+    def stop(self) -> None:
+        if active_profiler() is self: PROFILER_STATE.profiler = None
+        self.process_peak_rss_bytes = self.process_peak_rss()
+
+    @contextmanager
+    def phase(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start_time
+
+    def count(self, name: str, value: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @staticmethod
+    def process_peak_rss() -> int:
+        # ru_maxrss is in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def record(self) -> dict:
+        return {
+            "file": self.file_path,
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "total": round(sum(self.phases.values()), 6),
+            "counters": dict(self.counters),
+            "process_peak_rss_bytes": self.process_peak_rss_bytes if self.process_peak_rss_bytes is not None else self.process_peak_rss(),
+        }
+
+    def json_line(self) -> str:
+        return json.dumps(self.record(), sort_keys=True)
+
+    def report(self) -> str:
+        record = self.record()
+        lines = [f"Profile for {record['file']}:"]
+
+        width = max([len(name) for name in record["phases"]] + [len(name) for name in record["counters"]] + [16])
+        for name, seconds in record["phases"].items():
+            lines.append(f"  {name:<{width}}  {seconds * 1000:>10.3f} ms")
+        lines.append(f"  {'total':<{width}}  {record['total'] * 1000:>10.3f} ms")
+
+        for name, value in record["counters"].items():
+            lines.append(f"  {name:<{width}}  {value:>10}")
+        lines.append(f"  {'process peak RSS':<{width}}  {record['process_peak_rss_bytes'] / (1024 * 1024):>10.1f} MiB")
+
+        return "\n".join(lines)
+
+    def write(self, profile_format: str, output_path: str = None) -> None:
+        """
+        Write the profile as text or as a JSON line, appending to output_path or printing to stdout.
+        """
+        text = self.report() if profile_format == "text" else self.json_line()
+
+        if output_path is None:
+            print(text)
+            sys.stdout.flush()
+        else:
+            with open(output_path, 'a') as f:
+                f.write(text + "\n")
+
+def phase(name: str):
+    """
+    Time a phase on the active profiler, does nothing when profiling is off.
+    """
+    profiler = active_profiler()
+    if profiler is None: return nullcontext()
+    return profiler.phase(name)
+
+def count(name: str, value: int) -> None:
+    profiler = active_profiler()
+    if profiler is not None: profiler.count(name, value)
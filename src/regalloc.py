@@ -0,0 +1,164 @@
+import heapq
+from bisect import bisect_right
+
+from ir import CALL_OPCODES, Instruction, VirtualRegister
+
+# The runtime routines preserve these, so values in them survive print and exit
+CALL_PRESERVED_REGISTERS = ("rbx", "r12", "r13", "r14", "r15", "rbp", "r10")
+CALL_CLOBBERED_REGISTERS = ("rcx", "rsi", "rdi", "r8", "r9", "r11")
+# rax and rdx are never allocated, idiv, the high half of imul and printInt need them,
+# and they stand in for spilled operands that can't be used from memory
+
+class LiveInterval:
+    __slots__ = ('register', 'start', 'end', 'crosses_call', 'hint', 'location')
+
+    def __init__(self, register: VirtualRegister, start: int, hint: VirtualRegister = None) -> None:
+        self.register = register
+        # Indices of the defining instruction and of the last instruction reading the register
+        self.start = start
+        self.end = start
+        self.crosses_call = False
+        # A register that dies where this one is defined, sharing its location saves a mov
+        self.hint = hint
+        # A register name, or a spill slot number
+        self.location = None
+
+def build_intervals(instructions: list[Instruction]) -> list[LiveInterval]:
+    """
+    Compute the live interval of every virtual register.
+
+    The instructions are straight line code with a single definition per register, so each
+    interval is simply its definition up to its last use.
+
+    :return: The intervals, ordered by start.
+    """
+    intervals = []
+    intervals_by_register = {}
+    calls = []
+
+    for index, instruction in enumerate(instructions):
+        for source in instruction.sources:
+            if type(source) is VirtualRegister: intervals_by_register[source.number].end = index
+
+        if instruction.opcode in CALL_OPCODES: calls.append(index)
+
+        destination = instruction.destination
+        if destination is not None:
+            first_source = instruction.sources[0] if instruction.sources else None
+            interval = LiveInterval(destination, index, first_source if type(first_source) is VirtualRegister else None)
+            intervals_by_register[destination.number] = interval
+            intervals.append(interval)
+
+    # A value read by a call is passed before the call clobbers anything, only calls strictly
+    # inside the interval matter
+    for interval in intervals:
+        next_call = bisect_right(calls, interval.start)
+        interval.crosses_call = next_call < len(calls) and calls[next_call] < interval.end
+
+    return intervals
+
+class LinearScanAllocator:
+    """
+    Assigns the virtual registers of straight line code to x86-64 registers, using linear scan.
+
+    Intervals are visited by start, and the ones that ended are expired to free their register.
+    Values live across a call only get registers the runtime preserves, other values take the
+    clobbered ones first so the preserved ones stay available. When no register is free, the
+    interval that ends last is spilled to a stack slot, so spills only happen under pressure and
+    hit the values that are used the furthest away.
+    """
+    def __init__(self, preserved_registers: tuple = CALL_PRESERVED_REGISTERS, clobbered_registers: tuple = CALL_CLOBBERED_REGISTERS) -> None:
+        self.preserved_registers = preserved_registers
+        self.any_registers = clobbered_registers + preserved_registers
+        self.locations = {}
+        self.spill_slots = 0
+        self.statistics = {}
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.statistics[name] = self.statistics.get(name, 0) + value
+
+    def location(self, register: VirtualRegister):
+        """
+        :return: The register name or spill slot number holding a virtual register.
+        """
+        return self.locations[register.number]
+
+    def allocate(self, instructions: list[Instruction]) -> dict:
+        intervals = build_intervals(instructions)
+
+        free_registers = set(self.any_registers)
+        # (index the slot became free at, slot)
+        free_slots = []
+        # Heaps of (end, number, interval), for the intervals in registers and in spill slots
+        active = []
+        active_spills = []
+
+        for interval in intervals:
+            start = interval.start
+            while active and active[0][0] <= start:
+                free_registers.add(heapq.heappop(active)[2].location)
+            while active_spills and active_spills[0][0] <= start:
+                end, _, spilled = heapq.heappop(active_spills)
+                free_slots.append((end, spilled.location))
+
+            allowed_registers = self.preserved_registers if interval.crosses_call else self.any_registers
+            hint = self.locations.get(interval.hint.number) if interval.hint is not None else None
+
+            if hint in free_registers and hint in allowed_registers:
+                register = hint
+            else:
+                register = next((register for register in allowed_registers if register in free_registers), None)
+
+            if register is not None:
+                free_registers.remove(register)
+                interval.location = register
+                heapq.heappush(active, (interval.end, interval.register.number, interval))
+            else:
+                spilled = self.spill(interval, active, allowed_registers)
+                spilled.location = self.spill_slot(free_slots, spilled.start)
+                self.locations[spilled.register.number] = spilled.location
+                heapq.heappush(active_spills, (spilled.end, spilled.register.number, spilled))
+                self.count("spilled")
+
+            self.locations[interval.register.number] = interval.location
+
+        self.count("virtual_registers", len(intervals))
+        self.count("registers_used", len({location for location in self.locations.values() if isinstance(location, str)}))
+        return self.locations
+
+    def spill(self, interval: LiveInterval, active: list, allowed_registers: tuple) -> LiveInterval:
+        """
+        Pick the interval to spill when no register is free for interval.
+
+        :return: The spilled interval, when it isn't interval itself, interval took over its register.
+        """
+        candidates = [entry for entry in active if entry[2].location in allowed_registers]
+        if not candidates: return interval
+
+        victim_entry = max(candidates, key=lambda entry: entry[0])
+        if victim_entry[0] <= interval.end: return interval
+
+        victim = victim_entry[2]
+        active.remove(victim_entry)
+        heapq.heapify(active)
+
+        interval.location = victim.location
+        heapq.heappush(active, (interval.end, interval.register.number, interval))
+        return victim
+
+    def spill_slot(self, free_slots: list, start: int) -> int:
+        """
+        Take a slot for an interval starting at start. A victim spilled after the fact started
+        before the current interval, so only slots that were already free then can be reused.
+        """
+        for i, (free_since, slot) in enumerate(free_slots):
+            if free_since <= start: return free_slots.pop(i)[1]
+
+        self.spill_slots += 1
+        return self.spill_slots - 1
+
+    def report(self) -> str:
+        stats = self.statistics
+        return (f"Register allocation: {stats.get('virtual_registers', 0)} virtual registers in "
+                f"{stats.get('registers_used', 0)} registers, {stats.get('spilled', 0)} spilled to "
+                f"{self.spill_slots} stack slots")
@@ -0,0 +1,88 @@
+import os
+import mmap
+from array import array
+from bisect import bisect_right
+
+class SourceBuffer:
+    """
+    Read-only bytes view over a Panda source.
+
+    Files are mapped with mmap so the tokenizer can scan them without reading the whole file
+    into a Python string, the OS pages the contents in and out as needed. Plain strings are
+    encoded once to utf-8 so both cases can be scanned with the same bytes pattern.
+    """
+    def __init__(self, source: str | bytes) -> None:
+        self.source = source
+        self.path = None
+        self.file = None
+        self.buffer = None
+
+    def open(self):
+        if isinstance(self.source, bytes):
+            self.buffer = self.source
+        elif os.path.exists(self.source):
+            self.path = self.source
+            self.file = open(self.path, 'rb')
+
+            # mmap refuses to map empty files
+            if os.fstat(self.file.fileno()).st_size == 0:
+                self.buffer = b''
+            else:
+                self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buffer = self.source.encode('utf-8')
+
+        return self.buffer
+
+    def close(self) -> None:
+        if isinstance(self.buffer, mmap.mmap): self.buffer.close()
+        if self.file is not None: self.file.close()
+
+        self.buffer = None
+        self.file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+class LineIndex:
+    """
+    Maps byte offsets in a source to line and column numbers.
+
+    The offsets of every line start are collected once, the first time a position is looked
+    up, and each lookup after that is a binary search over them. Columns are counted in bytes.
+    """
+    def __init__(self, source: str | bytes) -> None:
+        self.source = source
+        self.line_starts = None
+
+    def build(self) -> array:
+        line_starts = array('q', [0])
+
+        # The index opens its own view of the source, so it can be built after the tokenizer is done with it
+        with SourceBuffer(self.source) as buffer:
+            newline = buffer.find(b'\n')
+            while newline != -1:
+                line_starts.append(newline + 1)
+                newline = buffer.find(b'\n', newline + 1)
+
+        return line_starts
+
+    def find(self, offset: int) -> tuple[int, int]:
+        """
+        Find the line number and column position for a given offset in the source.
+
+        :param offset: The byte offset in the source code for which to find line and column.
+        :return: A tuple containing the line number and column position, both starting at 1.
+        """
+        if offset is None or offset < 0: return -1, -1
+        if self.line_starts is None: self.line_starts = self.build()
+
+        line = bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
+
+    def format(self, offset: int) -> str:
+        line, column = self.find(offset)
+        return f"{line}:{column}"
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from daemon import CompilerDaemon
+
+@pytest.mark.parametrize("request_, error", [
+    ({"files": "a.pnda"}, "files must be a list of paths"),
+    ({"files": ["a.pnda", 1]}, "files must be a list of paths"),
+    ({"files": [], "optimization_level": 3}, "optimization_level must be 0, 1 or 2"),
+    ({"files": [], "optimization_level": "2"}, "optimization_level must be 0, 1 or 2"),
+    ({"files": [], "optimization_level": True}, "optimization_level must be 0, 1 or 2"),
+    ({"files": [], "optimize_size": 1}, "optimize_size must be true or false"),
+    ({"files": [], "force": "yes"}, "force must be true or false"),
+    ({"files": [], "force": None}, "force must be true or false"),
+])
+def test_malformed_compile_requests(request_, error):
+    response = CompilerDaemon().handle_request(request_)
+
+    assert response["ok"] is False
+    assert response["error"].startswith(error)
+
+@pytest.mark.parametrize("command", ["compile_all", ["compile"], None])
+def test_unknown_commands(command):
+    response = CompilerDaemon().handle_request({"command": command})
+
+    assert response == {"ok": False, "error": f"Unknown command {command!r}"}
+
+def test_compile_request(tmp_path):
+    source_path = tmp_path / "exit.pnda"
+    source_path.write_bytes(b"exit(3);\n")
+
+    daemon = CompilerDaemon()
+    response = daemon.handle_request({"command": "compile", "files": [str(source_path)], "optimization_level": 0, "optimize_size": False, "force": True})
+
+    assert [result["status"] for result in response["results"]] == ["compiled"]
+    assert os.path.exists(tmp_path / "exit")
+    # Left out fields take the daemon's defaults
+    assert daemon.handle_request({"files": [str(source_path)]})["results"][0]["ok"]
@@ -0,0 +1,44 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from elf64 import SourceAssembler
+from benchmarks.encodings import encoding_cases, compare
+
+def encode(line: str) -> str:
+    return SourceAssembler().assemble(line).sections["text"].hex(' ')
+
+@pytest.mark.parametrize("line, expected", [
+    # Byte registers that need a REX prefix, without one f6 ec is imul ah
+    ("imul spl", "40 f6 ec"),
+    ("imul r11b", "41 f6 eb"),
+    # 16-bit operations take 16-bit immediates
+    ("imul ax, 128", "66 69 c0 80 00"),
+    ("imul cx, [rax], 32767", "66 69 08 ff 7f"),
+    # The short forms nasm picks
+    ("add eax, 1000", "05 e8 03 00 00"),
+    ("cmp rax, -129", "48 3d 7f ff ff ff"),
+    ("and al, 15", "24 0f"),
+    ("add eax, 5", "83 c0 05"),
+    ("test al, 1", "a8 01"),
+    ("test rax, 128", "48 a9 80 00 00 00"),
+    ("add ecx, 0xFFFFFFFF", "83 c1 ff"),
+    ("shl rax, 1", "48 d1 e0"),
+    ("sar byte [rsp], 1", "d0 3c 24"),
+    ("shr rdx, 3", "48 c1 ea 03"),
+    ("jmp near .forward", "e9 00 00 00 00"),
+])
+def test_encoding(line, expected):
+    if ".forward" in line: line = f"{line}\n.forward:"
+    assert encode(line) == expected
+
+@pytest.mark.skipif(shutil.which("nasm") is None, reason="nasm is not installed")
+def test_encodings_match_nasm():
+    differences, errors = compare(encoding_cases())
+
+    assert errors == {}
+    assert [case for case, _, _ in differences] == []
@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+import generator
+from generator import in_memory_directory
+
+def test_tmpfs_is_used(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(generator, "TMPFS_DIRECTORY", str(tmp_path))
+    in_memory_directory.cache_clear()
+    try:
+        assert in_memory_directory() == str(tmp_path)
+    finally:
+        in_memory_directory.cache_clear()
+    assert capsys.readouterr().err == ""
+
+def test_missing_tmpfs_falls_back_with_a_warning(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(generator, "TMPFS_DIRECTORY", str(tmp_path / "missing"))
+    monkeypatch.setattr(generator.tempfile, "gettempdir", lambda: str(tmp_path))
+    in_memory_directory.cache_clear()
+    try:
+        assert in_memory_directory() == str(tmp_path)
+        # Warned about once per process
+        assert in_memory_directory() == str(tmp_path)
+    finally:
+        in_memory_directory.cache_clear()
+
+    warning = capsys.readouterr().err
+    assert warning.count("Warning:") == 1
+    assert str(tmp_path / "missing") in warning and "--assembler elf64" in warning
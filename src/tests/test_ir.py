@@ -0,0 +1,172 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import TOKEN_TYPE
+from ir import IR_OPCODE, UINT64_MASK, CALL_OPCODES, IRBuilder, Instruction, signed_division_magic
+from regalloc import LinearScanAllocator, CALL_PRESERVED_REGISTERS, CALL_CLOBBERED_REGISTERS
+from optimizer import wrap_int64
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+OPERANDS = [0, 1, -1, 2, -2, 3, -3, 6, -6, 7, -7, 100, -100, 12345678901, -12345678901, INT64_MAX, INT64_MAX - 1, INT64_MIN, INT64_MIN + 1]
+
+# How the IR's opcodes compute, on signed 64-bit values
+OPERATIONS = {
+    IR_OPCODE.MOVE: lambda a: a,
+    IR_OPCODE.ADD: lambda a, b: a + b,
+    IR_OPCODE.SUBTRACT: lambda a, b: a - b,
+    IR_OPCODE.MULTIPLY: lambda a, b: a * b,
+    IR_OPCODE.SHIFT_LEFT: lambda a, k: a << k,
+    IR_OPCODE.SHIFT_RIGHT: lambda a, k: (a & UINT64_MASK) >> k,
+    IR_OPCODE.SHIFT_RIGHT_ARITHMETIC: lambda a, k: a >> k,
+    IR_OPCODE.MULTIPLY_HIGH: lambda a, b: a * b >> 64,
+    IR_OPCODE.SCALED_ADD: lambda a, b, scale: a + b * scale,
+    IR_OPCODE.NEGATE: lambda a: -a,
+}
+
+def c_divide(dividend: int, divisor: int) -> int:
+    """
+    int64_t division in C: the quotient truncates toward zero and wraps around.
+    """
+    quotient = abs(dividend) // abs(divisor)
+    return wrap_int64(quotient if (dividend < 0) == (divisor < 0) else -quotient)
+
+def execute(instructions: list[Instruction], values: dict, location=lambda register: register.number) -> list[int]:
+    """
+    Run straight line IR, keeping each virtual register's value at location(register).
+    Calls clobber the registers the runtime doesn't preserve.
+
+    :return: The values passed to PRINT_INTEGER and EXIT.
+    """
+    def read(operand):
+        return values[location(operand)] if not isinstance(operand, int) else operand
+
+    results = []
+    for instruction in instructions:
+        if instruction.opcode in CALL_OPCODES:
+            results.append(read(instruction.sources[0]))
+            for register in CALL_CLOBBERED_REGISTERS: values[register] = None
+            continue
+
+        sources = [read(source) for source in instruction.sources]
+        values[location(instruction.destination)] = wrap_int64(OPERATIONS[instruction.opcode](*sources))
+
+    return results
+
+def lower(operation, constant: int) -> tuple:
+    """
+    :return: The builder's instructions computing operation(v0, constant) and the register of the result.
+    """
+    builder = IRBuilder()
+    value = builder.new_register()
+    result = operation(builder, value, constant)
+    return builder, value, result
+
+# multiply_by_constant
+
+@pytest.mark.parametrize("factor", [0, 1, -1, 2, -2, 3, -3, 5, 9, -9, 16, -16, 17, 31, -31, 10, 2 ** 40, INT64_MIN])
+def test_multiply_by_constant(factor):
+    builder, value, product = lower(IRBuilder.multiply_by_constant, factor)
+
+    for operand in OPERANDS:
+        values = {value.number: operand}
+        execute(builder.instructions, values)
+        assert (product if isinstance(product, int) else values[product.number]) == wrap_int64(operand * factor)
+
+# divide_by_constant
+
+DIVISORS = [1, -1, 2, -2, 4, -4, 8, 2 ** 32, -2 ** 32, 2 ** 62, -2 ** 62, INT64_MIN, 3, -3, 5, 6, 7, -7, 10, 641, 2 ** 31 - 1, INT64_MAX]
+
+@pytest.mark.parametrize("divisor", DIVISORS)
+def test_divide_by_constant_truncates_like_c(divisor):
+    builder, value, quotient = lower(IRBuilder.divide_by_constant, divisor)
+
+    if divisor == -1:
+        # INT64_MIN / -1 must still trap like idiv does
+        assert quotient is None
+        return
+
+    assert all(instruction.opcode != IR_OPCODE.DIVIDE for instruction in builder.instructions)
+    for operand in OPERANDS:
+        values = {value.number: operand}
+        execute(builder.instructions, values)
+        assert values[quotient.number] == c_divide(operand, divisor), operand
+
+def test_division_by_zero_is_left_to_idiv():
+    assert lower(IRBuilder.divide_by_constant, 0)[2] is None
+
+def test_division_through_the_builder_keeps_idiv_for_traps():
+    builder = IRBuilder()
+    value = builder.new_register()
+    builder.lower_binary_operation(TOKEN_TYPE.DIVIDE, value, -1)
+    builder.lower_binary_operation(TOKEN_TYPE.DIVIDE, value, 7)
+
+    assert [instruction.opcode for instruction in builder.instructions].count(IR_OPCODE.DIVIDE) == 1
+    assert builder.statistics == {"divisions_reduced": 1}
+
+# signed_division_magic
+
+@pytest.mark.parametrize("divisor, expected", [(3, (0x5555555555555556, 0)), (5, (0x6666666666666667, 1)), (7, (0x4924924924924925, 1)), (6, (0x2AAAAAAAAAAAAAAB, 0))])
+def test_signed_division_magic_matches_hackers_delight(divisor, expected):
+    assert signed_division_magic(divisor) == expected
+
+# LinearScanAllocator
+
+REGISTER_COUNT = len(CALL_PRESERVED_REGISTERS + CALL_CLOBBERED_REGISTERS)
+
+def sum_program(count: int, call_between: bool = False) -> tuple:
+    """
+    Define count values, all live at once, then print their sum.
+
+    :return: The instructions and the expected sum.
+    """
+    builder = IRBuilder()
+    values = [builder.emit(IR_OPCODE.MOVE, 1000 + i) for i in range(count)]
+    if call_between: builder.instructions.append(Instruction(IR_OPCODE.PRINT_INTEGER, sources=(0,)))
+
+    total = values[0]
+    for value in values[1:]:
+        total = builder.emit(IR_OPCODE.ADD, total, value)
+    builder.instructions.append(Instruction(IR_OPCODE.PRINT_INTEGER, sources=(total,)))
+
+    return builder.instructions, sum(1000 + i for i in range(count))
+
+def run_allocated(instructions: list[Instruction], allocator: LinearScanAllocator) -> list[int]:
+    locations = allocator.allocate(instructions)
+    return execute(instructions, {}, lambda register: locations[register.number])
+
+def test_allocation_without_pressure_does_not_spill():
+    instructions, total = sum_program(REGISTER_COUNT)
+    allocator = LinearScanAllocator()
+
+    assert run_allocated(instructions, allocator) == [total]
+    assert allocator.statistics.get("spilled", 0) == 0
+
+def test_spills_when_more_values_are_live_than_registers():
+    extra = 4
+    instructions, total = sum_program(REGISTER_COUNT + extra)
+    allocator = LinearScanAllocator()
+
+    # Values sharing a register or a stack slot while both are live would change the sum
+    assert run_allocated(instructions, allocator) == [total]
+    assert allocator.statistics["spilled"] == extra
+    assert allocator.spill_slots == extra
+
+    # The spilled values are the ones read last
+    spilled = sorted(number for number, location in allocator.locations.items() if isinstance(location, int))
+    assert spilled == list(range(REGISTER_COUNT, REGISTER_COUNT + extra))
+
+def test_values_live_across_calls_only_get_preserved_registers():
+    count = len(CALL_PRESERVED_REGISTERS) + 3
+    instructions, total = sum_program(count, call_between=True)
+    allocator = LinearScanAllocator()
+
+    # The print clobbers CALL_CLOBBERED_REGISTERS, a value kept in one would be lost
+    assert run_allocated(instructions, allocator) == [0, total]
+    assert allocator.statistics["spilled"] == 3
+    assert all(allocator.locations[number] not in CALL_CLOBBERED_REGISTERS for number in range(count))
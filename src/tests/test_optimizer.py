@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import Tokenizer
+from parse import AST_NODE_TYPE, Parser
+from optimizer import Optimizer
+
+def statements(source: bytes, pulled: list = None):
+    tokenizer = Tokenizer()
+    for node in Parser(tokenizer.tokenize(source), tokenizer.line_index).stream():
+        if pulled is not None: pulled.append(node)
+        yield node
+
+def test_passes_stream_statements():
+    pulled = []
+    nodes = Optimizer(1).optimize(statements(b'let x = 1 + 2;\nprint(x);\nprint("a");\nprint("b");\n', pulled))
+
+    # Nothing is parsed until the optimizer is iterated, and only as far as the next statement needs
+    assert pulled == []
+    assert next(nodes).type == AST_NODE_TYPE.LET
+    assert len(pulled) == 1
+
+def test_passes_match_the_whole_program():
+    nodes = list(Optimizer(2).optimize(statements(b'print(2 * 3);\nprint("a");\nexit(1);\nprint("b");\nprint("c");\n')))
+
+    assert [(node.type, node.value) for node in nodes] == [(AST_NODE_TYPE.PRINT, "6\na"), (AST_NODE_TYPE.EXIT, 1)]
+
+def test_statistics_count_every_statement():
+    optimizer = Optimizer(1)
+    list(optimizer.optimize(statements(b'print("a");\nexit(0);\nprint("b");\nprint("c");\n')))
+
+    dead_code_elimination = optimizer.passes[1]
+    assert dead_code_elimination.statistics == {"removed": 2, "statements_in": 4, "statements_out": 2}
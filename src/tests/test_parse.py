@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import Tokenizer
+from parse import AST_NODE_TYPE, Parser
+from exceptions import ParsingErrors, UnexpectedTokenError, ImmutableVariableError, UndefinedVariableError, RedeclaredVariableError, raising_errors
+
+def parse_all(source: bytes) -> tuple:
+    """
+    Stream every statement of source, raising the parsing errors instead of exiting.
+
+    :return: The parsed nodes, the error raised at the end of the stream and the source's line index.
+    """
+    tokenizer = Tokenizer()
+    tokens = tokenizer.tokenize(source)
+    nodes = []
+    with raising_errors(), pytest.raises((ParsingErrors, UnexpectedTokenError)) as error:
+        for node in Parser(tokens, tokenizer.line_index).stream():
+            nodes.append(node)
+
+    return nodes, error.value, tokenizer.line_index
+
+def test_errors_are_collected_and_parsing_resumes_after_each_semicolon():
+    source = b'print(1);\nprint(2 3);\nlet x = 5;\nexit(;\nx = 1; print(x);\n  print(y);\nlet x = 2;\nprint(x + 1);\n'
+    nodes, error, line_index = parse_all(source)
+
+    # Each error points at the byte offset of the token it is about
+    expected = [
+        (UnexpectedTokenError, source.index(b'3)')),
+        (UnexpectedTokenError, source.index(b';\nx')),
+        (ImmutableVariableError, source.index(b'x = 1')),
+        (UndefinedVariableError, source.index(b'y)')),
+        (RedeclaredVariableError, source.index(b'x = 2')),
+    ]
+    assert isinstance(error, ParsingErrors)
+    assert [type(error) for error in error.errors] == [error_type for error_type, _ in expected]
+    for collected, (_, offset) in zip(error.errors, expected):
+        assert collected.message.endswith(f"at {line_index.format(offset)}")
+
+    # The statements after each bad one's semicolon are still parsed, even on the same line
+    assert [(node.type, node.start) for node in nodes] == [
+        (AST_NODE_TYPE.PRINT, source.index(b'print(1)')),
+        (AST_NODE_TYPE.LET, source.index(b'let x = 5')),
+        (AST_NODE_TYPE.PRINT, source.index(b'print(x)')),
+        (AST_NODE_TYPE.PRINT, source.index(b'print(x + 1)')),
+    ]
+
+def test_a_single_error_is_raised_on_its_own():
+    source = b'print(1);\nprint(2'
+    nodes, error, line_index = parse_all(source)
+
+    # Recovery stops at the end of the file when there is no semicolon left to skip to
+    assert [node.value for node in nodes] == [1]
+    assert type(error) is UnexpectedTokenError
+    assert error.message.endswith(f"at {line_index.format(len(source))}")
@@ -0,0 +1,206 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from peephole import AsmInstruction, AsmLabel, RedundantMoves, ZeroingIdioms, CompareAndBranch, DeadStores, PeepholeOptimizer, parse_assembly, format_assembly
+from generator import BUILTINS_PATH, filter_builtins
+
+def program(*lines: str) -> list:
+    """
+    Instructions from lines written like the generator's output, "mov rax, 5" or "exit 0", and labels, ".loop:"
+    """
+    instructions = []
+    for line in lines:
+        if line.endswith(":"):
+            instructions.append(AsmLabel(line[:-1]))
+            continue
+
+        mnemonic, _, operands = line.partition(" ")
+        instructions.append(AsmInstruction(mnemonic, tuple(operand.strip() for operand in operands.split(",")) if operands else ()))
+
+    return instructions
+
+def run(rule_set, *lines: str) -> list[str]:
+    return [instruction.format() for instruction in rule_set.run(program(*lines))]
+
+# RedundantMoves
+
+def test_self_move_is_removed():
+    rule_set = RedundantMoves()
+    assert run(rule_set, "mov rax, rax", "exit rax") == ["exit rax"]
+    assert rule_set.statistics == {"self_moves": 1}
+
+def test_32_bit_self_move_is_kept():
+    # mov eax, eax clears the upper half of rax
+    assert run(RedundantMoves(), "mov eax, eax", "exit rax") == ["mov eax, eax", "exit rax"]
+
+def test_move_back_is_removed():
+    rule_set = RedundantMoves()
+    assert run(rule_set, "mov [rsp + 8], rax", "mov rax, [rsp + 8]", "exit rax") == ["mov [rsp + 8], rax", "exit rax"]
+    assert rule_set.statistics == {"moves_back": 1}
+
+def test_move_back_through_address_register_is_kept():
+    lines = ("mov [rax], rax", "mov rax, [rax]", "exit rax")
+    assert run(RedundantMoves(), *lines) == list(lines)
+
+def test_dead_register_is_forwarded():
+    rule_set = RedundantMoves()
+    assert run(rule_set, "mov rax, 5", "mov rbx, rax", "exit rbx") == ["mov rbx, 5", "exit rbx"]
+    assert rule_set.statistics == {"forwarded": 1}
+
+def test_live_register_is_not_forwarded():
+    lines = ("mov rax, 5", "mov rbx, rax", "add rbx, rax", "exit rbx")
+    assert run(RedundantMoves(), *lines) == list(lines)
+
+def test_memory_to_memory_is_not_forwarded():
+    lines = ("mov rax, [rsp + 8]", "mov [rsp + 16], rax", "printInt [rsp + 16]")
+    assert run(RedundantMoves(), *lines) == list(lines)
+
+def test_64_bit_immediate_to_memory_is_not_forwarded():
+    lines = ("mov rax, 4294967296", "mov [rsp + 8], rax", "printInt [rsp + 8]")
+    assert run(RedundantMoves(), *lines) == list(lines)
+
+def test_32_bit_immediate_to_memory_is_forwarded():
+    assert run(RedundantMoves(), "mov rax, -5", "mov [rsp + 8], rax", "printInt [rsp + 8]") == ["mov [rsp + 8], -5", "printInt [rsp + 8]"]
+
+# ZeroingIdioms
+
+def test_zeroing_uses_xor():
+    rule_set = ZeroingIdioms()
+    assert run(rule_set, "mov rax, 0", "exit rax") == ["xor eax, eax", "exit rax"]
+    assert rule_set.statistics == {"xor_zeroing": 1}
+
+def test_zeroing_keeps_live_flags():
+    # xor would clobber the flags the jump reads
+    lines = ("cmp rbx, 1", "mov rax, 0", "jl .done")
+    assert run(ZeroingIdioms(), *lines) == list(lines)
+
+def test_zeroing_before_flags_are_written_uses_xor():
+    assert run(ZeroingIdioms(), "mov rax, 0", "add rax, rbx", "exit rax") == ["xor eax, eax", "add rax, rbx", "exit rax"]
+
+def test_32_bit_immediates_are_narrowed():
+    rule_set = ZeroingIdioms()
+    assert run(rule_set, "mov rax, 60", "mov r8, 4294967295", "exit rax") == ["mov eax, 60", "mov r8d, 4294967295", "exit rax"]
+    assert rule_set.statistics == {"zero_extended_immediates": 2}
+
+def test_64_bit_and_negative_immediates_are_kept():
+    # Neither fits a zero-extended 32-bit immediate
+    lines = ("mov rax, 4294967296", "mov rbx, -1", "exit rax")
+    assert run(ZeroingIdioms(), *lines) == list(lines)
+
+def test_exit_status_keeps_its_low_byte():
+    rule_set = ZeroingIdioms()
+    assert run(rule_set, "exit 300") == ["exit 44"]
+    assert run(rule_set, "exit -1") == ["exit 255"]
+    assert run(rule_set, "exit 255") == ["exit 255"]
+    assert rule_set.statistics == {"exit_status_bytes": 2}
+
+# DeadStores
+
+def test_overwritten_register_store_is_removed():
+    rule_set = DeadStores()
+    assert run(rule_set, "mov rcx, 5", "mov rcx, 7", "printInt rcx") == ["mov rcx, 7", "printInt rcx"]
+    assert rule_set.statistics == {"removed": 1}
+
+def test_overwritten_slot_store_is_removed():
+    assert run(DeadStores(), "mov [rsp + 8], rbx", "mov [rsp + 8], rcx", "printInt [rsp + 8]") == ["mov [rsp + 8], rcx", "printInt [rsp + 8]"]
+
+def test_slot_store_read_later_is_kept():
+    lines = ("mov [rsp + 8], rbx", "mov [rsp + 16], rcx", "printInt [rsp + 8]", "printInt [rsp + 16]")
+    assert run(DeadStores(), *lines) == list(lines)
+
+def test_stores_before_exit_are_removed():
+    assert run(DeadStores(), "mov [rsp + 8], rbx", "add rax, 1", "exit 0") == ["exit 0"]
+    assert run(DeadStores(), "mov rbx, 3", "add rax, 1", "exit rbx") == ["mov rbx, 3", "exit rbx"]
+
+def test_stores_to_other_memory_are_kept():
+    lines = ("mov [rbx], rax", "exit 0")
+    assert run(DeadStores(), *lines) == list(lines)
+
+def test_division_is_kept_when_unused():
+    # idiv traps on a zero divisor, and the cqo it reads stays with it
+    lines = ("cqo", "idiv rcx", "exit 0")
+    assert run(DeadStores(), *lines) == list(lines)
+
+def test_unknown_instructions_keep_everything():
+    lines = ("mov rax, 1", "mov rbx, 2", "syscall")
+    assert run(DeadStores(), *lines) == list(lines)
+
+def test_macro_parameters_may_read_anything():
+    # %1 may be rcx where the macro is expanded
+    lines = ("mov rcx, 5", "mov rsi, %1", "mov rcx, 6", "syscall")
+    assert run(DeadStores(), *lines) == list(lines)
+
+# CompareAndBranch
+
+def test_compare_with_zero_uses_test():
+    rule_set = CompareAndBranch()
+    assert run(rule_set, "cmp cl, 0", "je .done", ".done:") == ["test cl, cl", "je .done", ".done:"]
+    assert rule_set.statistics == {"test_for_zero": 1}
+
+def test_compare_with_zero_in_memory_is_kept():
+    lines = ("cmp byte [rsi], 0", "je .done", ".done:")
+    assert run(CompareAndBranch(), *lines) == list(lines)
+
+def test_jump_to_next_label_is_removed():
+    rule_set = CompareAndBranch()
+    assert run(rule_set, "mov rax, 1", "jmp .next", ".next:", "ret") == ["mov rax, 1", ".next:", "ret"]
+    assert rule_set.statistics == {"jumps_to_next": 1}
+
+def test_branch_over_jump_is_inverted():
+    rule_set = CompareAndBranch()
+    assert run(rule_set, "test rax, rax", "jle .skip", "jmp .other", ".skip:", "ret") == ["test rax, rax", "jg .other", ".skip:", "ret"]
+    assert rule_set.statistics == {"inverted_branches": 1}
+
+def test_loop_is_rotated():
+    rule_set = CompareAndBranch()
+    lines = (".loop:", "mov cl, [rax]", "test cl, cl", "je .done", "inc rax", "jmp .loop", ".done:", "ret")
+
+    assert run(rule_set, *lines) == [
+        ".loop:", "mov cl, [rax]", "test cl, cl", "je .done", ".loopBody:",
+        "inc rax", "mov cl, [rax]", "test cl, cl", "jne .loopBody",
+        ".done:", "ret",
+    ]
+    assert rule_set.statistics == {"rotated_loops": 1}
+
+def test_loop_of_an_ordinary_label_gets_a_local_body_label():
+    assert run(CompareAndBranch(), "_write:", "test rdx, rdx", "jz .done", "dec rdx", "jmp _write", ".done:") == [
+        "_write:", "test rdx, rdx", "jz .done", ".writeBody:", "dec rdx", "test rdx, rdx", "jnz .writeBody", ".done:",
+    ]
+
+def test_loops_that_cant_be_rotated_are_kept():
+    # The head is too long to copy
+    long_head = (".loop:", "mov rax, 0", "mov rdi, rbx", "syscall", "test rax, rax", "jle .done", "inc rbx", "jmp .loop", ".done:")
+    # The jump isn't followed by the label the loop exits to
+    other_exit = (".loop:", "cmp rdx, 8", "je .done", "inc rdx", "jmp .loop", ".other:", ".done:")
+    # .done after _other belongs to _other, not to the loop
+    other_scope = (".loop:", "cmp rdx, 8", "je .done", "_other:", "inc rdx", "jmp .loop", ".done:")
+
+    for lines in (long_head, other_exit, other_scope):
+        assert run(CompareAndBranch(), *lines) == list(lines)
+
+def test_builtins_loops_are_rotated():
+    with open(BUILTINS_PATH) as file:
+        builtins_source = filter_builtins(file.read())
+
+    # The print 1 NUL scan, _writeAllTo's partial write loop, the path length of a file cat can't open and _printInteger's digit pairs
+    for label in ["%%printLoopBody:", ".writeAllToBody:", ".pathLengthBody:", ".twoDigitsBody:"]:
+        assert label in builtins_source
+    assert "cmp cl, 0" not in builtins_source
+
+def test_assembly_sources_round_trip():
+    source = "%macro print 1\n    mov rax, %1\n%%loop:\n    add al, '0'\n    rep movsb\n    jmp %%loop ; back\n%endmacro\nSTDOUT equ 1\n"
+    instructions = parse_assembly(source)
+
+    assert format_assembly(instructions) == source
+    assert [type(instruction).__name__ for instruction in instructions] == ["AsmDirective", "AsmInstruction", "AsmLabel", "AsmDirective", "AsmInstruction", "AsmDirective", "AsmDirective", "AsmDirective"]
+
+# PeepholeOptimizer
+
+def test_rule_sets_run_until_nothing_changes():
+    optimizer = PeepholeOptimizer()
+    instructions = optimizer.optimize(program("mov rax, 0", "mov rbx, rax", "mov rbx, rbx", "mov [rsp + 8], rbx", "mov [rsp + 8], rbx", "exit rbx"))
+
+    assert [instruction.format() for instruction in instructions] == ["xor ebx, ebx", "exit rbx"]
+    assert (optimizer.instructions_before, optimizer.instructions_after) == (6, 2)
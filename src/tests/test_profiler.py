@@ -0,0 +1,22 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from profiler import Profiler
+
+def test_memory_is_labelled_as_the_process_peak_rss():
+    profiler = Profiler("test.pnda").start()
+    with profiler.phase("parse"):
+        profiler.count("tokens", 3)
+    profiler.stop()
+
+    # ru_maxrss covers the whole process, neither output may present it as the memory of one compile
+    record = json.loads(profiler.json_line())
+    assert record["process_peak_rss_bytes"] == profiler.process_peak_rss_bytes > 0
+    assert not any("memory" in key for key in record)
+
+    report = profiler.report()
+    assert "process peak RSS" in report
+    assert "memory" not in report.lower()
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.normpath(os.path.join(__file__, "../../")))
+
+from tokenizer import TOKEN_TYPE, Tokenizer
+
+def parts(tokens) -> list[tuple]:
+    return [(token.type, token.value, token.start, token.end) for token in tokens]
+
+def test_tokens():
+    source = b'let total = 1_000 + 2.5;\nprint("a\\"b", `c`, total);  \n'
+
+    assert parts(Tokenizer().tokenize(source)) == [
+        (TOKEN_TYPE.LET, None, 0, 3),
+        (TOKEN_TYPE.IDENTIFIER, "total", 4, 9),
+        (TOKEN_TYPE.EQUALS, None, 10, 11),
+        (TOKEN_TYPE.INTEGER, 1000, 12, 17),
+        (TOKEN_TYPE.PLUS, None, 18, 19),
+        (TOKEN_TYPE.FLOAT, 2.5, 20, 23),
+        (TOKEN_TYPE.SEMICOLON, None, 23, 24),
+        (TOKEN_TYPE.PRINT, None, 25, 30),
+        (TOKEN_TYPE.OPEN_PARENTHESES, None, 30, 31),
+        (TOKEN_TYPE.CONST_STRING, 'a"b', 31, 37),
+        (TOKEN_TYPE.COMMA, None, 37, 38),
+        (TOKEN_TYPE.CONST_STRING, "c", 39, 42),
+        (TOKEN_TYPE.COMMA, None, 42, 43),
+        (TOKEN_TYPE.IDENTIFIER, "total", 44, 49),
+        (TOKEN_TYPE.CLOSE_PARENTHESES, None, 49, 50),
+        (TOKEN_TYPE.SEMICOLON, None, 50, 51),
+        (TOKEN_TYPE.END_OF_FILE, None, 54, 54),
+    ]
+
+def test_stream_matches_tokenize():
+    source = b"exit(3);\nprint('it\\'s', 12, 0.5);\nvar x = y * 2 / 3 - 4;"
+
+    assert parts(Tokenizer().stream(source)) == parts(Tokenizer().tokenize(source))
+
+@pytest.mark.parametrize("source, message", [
+    (b'print("abc);', 'Unterminated string starting at 1:7'),
+    (b'exit(1.2.3);', 'Unrecognized token "." encountered at 1:9'),
+    (b'print(1);\n  @', 'Unrecognized token "@" encountered at 2:3'),
+])
+def test_unrecognized_tokens(source, message, capsys):
+    with pytest.raises(SystemExit):
+        Tokenizer().tokenize(source)
+
+    assert message in capsys.readouterr().out
@@ -1,7 +1,11 @@
-import os
+import re
+from array import array
 from enum import Enum, auto
 
 from exceptions import UnrecognizedTokenError
+from source import SourceBuffer, LineIndex
+
+ESCAPE_SEQUENCE_PATTERN = re.compile(rb'\\(.)', re.DOTALL)
 
 class TOKEN_TYPE(Enum):
     # Data Types
@@ -18,6 +22,8 @@ class TOKEN_TYPE(Enum):
     OPEN_BRACKET = auto() # [
     CLOSE_BRACKET = auto() # ]
     SEMICOLON = auto() # ;
+    EQUALS = auto() # =
+    COMMA = auto() # ,
 
     # Math Symbols
     PLUS = auto() # +
@@ -32,14 +38,31 @@ class TOKEN_TYPE(Enum):
     # Built ins
     EXIT = auto()
     PRINT = auto()
+    CAT = auto()
 
     # Other
+    IDENTIFIER = auto() # Example: total; names a variable
     END_OF_FILE = auto()
 
+# Lets Tokens turn its stored type codes back into TOKEN_TYPE members without an Enum lookup
+TOKEN_TYPES_BY_CODE = {token_type.value: token_type for token_type in TOKEN_TYPE}
+
+# Type codes the scanner produces, looked up once instead of through the Enum for every token
+INTEGER, FLOAT, CONST_STRING, IDENTIFIER, END_OF_FILE = (token_type.value for token_type in (TOKEN_TYPE.INTEGER, TOKEN_TYPE.FLOAT, TOKEN_TYPE.CONST_STRING, TOKEN_TYPE.IDENTIFIER, TOKEN_TYPE.END_OF_FILE))
+
+# Numbers of the master pattern's groups, in the order they are written. match.lastindex is the
+# group that matched, comparing it is cheaper than looking up match.lastgroup's name
+FIXED_GROUP, STRING_GROUP, NUMBER_GROUP, UNRECOGNIZED_GROUP, END_GROUP = range(1, 6)
+
 class Token:
-    def __init__(self, type_, value=None) -> None:
+    __slots__ = ('type', 'value', 'start', 'end')
+
+    def __init__(self, type_, value=None, start=None, end=None) -> None:
         self.type = type_
         self.value = value
+        # Byte offsets of the token in its source, end is exclusive
+        self.start = start
+        self.end = end
     
     def __repr__(self) -> str:
         if self.value is not None:
@@ -48,134 +71,214 @@ class Token:
         return f"Token({self.type})"
 
 class Tokens:
+    """
+    Struct-of-arrays token storage.
+
+    Type codes, offsets and value ids are packed into typed arrays, and literal values are
+    interned in a side table so repeated strings and numbers are stored once. Indexing or
+    iterating yields Token objects built on demand as views over that storage.
+    """
     def __init__(self) -> None:
-        self.tokens = []
+        self.types = array('i')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.value_ids = array('i')
+        self.values = []
+        self.interned_values = {}
+
+    def intern_value(self, value) -> int:
+        if value is None: return -1
+
+        # 1, 1.0 and True hash the same, so the key has to include the type
+        key = (type(value), value)
+        value_id = self.interned_values.get(key)
+        if value_id is None:
+            value_id = len(self.values)
+            self.values.append(value)
+            self.interned_values[key] = value_id
+
+        return value_id
+
+    def append(self, type_code: int, start: int, end: int, value=None) -> None:
+        """
+        Store a token from its parts, without a Token object in between.
+
+        :param type_code: The value of its TOKEN_TYPE.
+        :param start: Its byte offset in the source, -1 when unknown, like end.
+        """
+        self.types.append(type_code)
+        self.starts.append(start)
+        self.ends.append(end)
+        # Most tokens are symbols and keywords, which have no value to intern
+        self.value_ids.append(-1 if value is None else self.intern_value(value))
 
     def add_token(self, token: Token) -> None:
-        self.tokens.append(token)
+        self.append(token.type.value, -1 if token.start is None else token.start, -1 if token.end is None else token.end, token.value)
 
-    def get_tokens(self) -> list[Token]:
-        return self.tokens
+    def get_tokens(self) -> 'Tokens':
+        return self
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> Token:
+        value_id = self.value_ids[index]
+        start = self.starts[index]
+        end = self.ends[index]
+
+        return Token(
+            TOKEN_TYPES_BY_CODE[self.types[index]],
+            None if value_id == -1 else self.values[value_id],
+            None if start == -1 else start,
+            None if end == -1 else end,
+        )
     
     def __iter__(self):
-        return iter(self.tokens)
+        for index in range(len(self.types)):
+            yield self[index]
 
 class Tokenizer:
     def __init__(self) -> None:
         self.tokens = Tokens()
-        self.single_character_handlers = {
-            '(': self.gen_handler(TOKEN_TYPE.OPEN_PARENTHESES),
-            ')': self.gen_handler(TOKEN_TYPE.CLOSE_PARENTHESES),
-            '{': self.gen_handler(TOKEN_TYPE.OPEN_CURLY_BRACKET),
-            '}': self.gen_handler(TOKEN_TYPE.CLOSE_CURLY_BRACKET),
-            '[': self.gen_handler(TOKEN_TYPE.OPEN_BRACKET),
-            ']': self.gen_handler(TOKEN_TYPE.CLOSE_BRACKET),
-            ';': self.gen_handler(TOKEN_TYPE.SEMICOLON),
+        self.line_index = None
+        self.single_character_tokens = {
+            '(': TOKEN_TYPE.OPEN_PARENTHESES,
+            ')': TOKEN_TYPE.CLOSE_PARENTHESES,
+            '{': TOKEN_TYPE.OPEN_CURLY_BRACKET,
+            '}': TOKEN_TYPE.CLOSE_CURLY_BRACKET,
+            '[': TOKEN_TYPE.OPEN_BRACKET,
+            ']': TOKEN_TYPE.CLOSE_BRACKET,
+            ';': TOKEN_TYPE.SEMICOLON,
+            '=': TOKEN_TYPE.EQUALS,
+            ',': TOKEN_TYPE.COMMA,
+            '+': TOKEN_TYPE.PLUS,
+            '-': TOKEN_TYPE.MINUS,
+            '*': TOKEN_TYPE.MULTIPLY,
+            '/': TOKEN_TYPE.DIVIDE,
         }
-        self.multi_character_handlers = {
-            'exit': self.gen_handler(TOKEN_TYPE.EXIT, word_length=4),
-            'print': self.gen_handler(TOKEN_TYPE.PRINT, word_length=5),
+        self.keyword_tokens = {
+            'exit': TOKEN_TYPE.EXIT,
+            'print': TOKEN_TYPE.PRINT,
+            'cat': TOKEN_TYPE.CAT,
+            'let': TOKEN_TYPE.LET,
+            'var': TOKEN_TYPE.VAR,
         }
+        # Symbols and keywords share one lookup table, so adding keywords doesn't add work per character.
+        # The source is scanned as bytes, so the keys are too
+        self.fixed_tokens = {text.encode(): token_type.value for text, token_type in {**self.single_character_tokens, **self.keyword_tokens}.items()}
+        self.master_pattern = self.compile_master_pattern()
 
-    def peek_characters(self, raw_source, current_index, number_of_characters):
-        return raw_source[current_index:current_index + number_of_characters]
+    def compile_master_pattern(self) -> re.Pattern:
+        """
+        Build the master regex used by tokenize. Leading whitespace is absorbed by every match
+        and each alternative is a group, so every token costs exactly one regex match. The groups
+        are numbered as in FIXED_GROUP and the rest.
 
-    def tokenize(self, source: str) -> Tokens:
-        raw_source = source
-        if os.path.exists(source):
-            with open(source, 'r') as f: 
-                raw_source = f.read()
+        :return: The compiled pattern.
+        """
+        symbols = ''.join(re.escape(char) for char in self.single_character_tokens)
 
-        i = 0
-        while i < len(raw_source):
-            current_index = i
+        return re.compile((r'\s*(?:' + '|'.join([
+            rf'(?P<FIXED>[A-Za-z_]\w*|[{symbols}])',
+            # Runs of plain characters are taken at once, rather than one alternation per character
+            r'(?P<STRING>"[^"\\]*(?:\\.[^"\\]*)*"|\'[^\'\\]*(?:\\.[^\'\\]*)*\'|`[^`\\]*(?:\\.[^`\\]*)*`)',
+            r'(?P<NUMBER>\d[\d_]*(?:\.[\d_]*)?)',
+            r'(?P<UNRECOGNIZED>\S)',
+            # Whitespace at the end of the source ends in one match, otherwise finditer would
+            # retry from every position in it after \s* runs into the end
+            r'(?P<END>\Z)',
+        ]) + ')').encode(), re.DOTALL)
 
-            for seq, handler in self.multi_character_handlers.items():
-                if raw_source[i:i+len(seq)] == seq:
-                    i = handler(raw_source, i)
-                    break
-            else:
-                char = raw_source[i]
-                if char in self.single_character_handlers:
-                    i = self.single_character_handlers[char](raw_source, i)
-                elif char in ["\"", "\'", "`"]:
-                    i = self.handle_string(raw_source, i)
-                elif char.isdigit():
-                    i = self.handle_number(raw_source, i)
-                elif char.isspace():
-                    i += 1
-                else:
-                    i = self.handle_unrecognized(raw_source, i)
-
-            if i == current_index:
-                line_info = self.find_line_info(raw_source, i)
-                UnrecognizedTokenError(message=f'Tokenizer was not able to make progress with "{raw_source[i]}" encountered at {line_info[0]}:{line_info[1]}').raise_err()
-
-        self.tokens.add_token(Token(TOKEN_TYPE.END_OF_FILE))
+    def reset(self) -> None:
+        """
+        Forget the last source, the pattern and handler tables are kept for the next one.
+        """
+        self.tokens = Tokens()
+        self.line_index = None
+
+    def tokenize(self, source: str | bytes) -> Tokens:
+        # Each call returns the tokens of its own source only
+        self.reset()
+        self.line_index = LineIndex(source)
+
+        # The parts of each match go straight into the arrays, no Token is made for them
+        append = self.tokens.append
+        with SourceBuffer(source) as raw_source:
+            for type_code, start, end, value in self.scan(raw_source):
+                append(type_code, start, end, value)
 
+            source_length = len(raw_source)
+
+        append(END_OF_FILE, source_length, source_length)
         return self.tokens
-    
-    def gen_handler(self, token_type: TOKEN_TYPE, word_length: int = 1):
-        def handler(raw_source, i):
-            self.tokens.add_token(Token(token_type))
-            return i + word_length
 
-        return handler
-    
-    def handle_string(self, raw_source, i):
-        string = ""
-        start_character = raw_source[i]
-
-        while i + 1 < len(raw_source):
-            if raw_source[i + 1] == start_character and raw_source[i] != "\\": break
-
-            i += 1
-            string = string.rstrip("\\")
-            string += raw_source[i]
-
-        self.tokens.add_token(Token(TOKEN_TYPE.CONST_STRING, string))
-        return i + 2
-
-    def handle_number(self, raw_source, i):
-        num_str = raw_source[i]
-        is_float = False
-        while i + 1 < len(raw_source) and (raw_source[i + 1].isdigit() or raw_source[i + 1] in ['.', '_']):
-            i += 1
-
-            if raw_source[i] == '_': 
-                continue
-            elif raw_source[i] == '.' and is_float == True: 
-                lineInfo = self.find_line_info(raw_source, i)
-                UnrecognizedTokenError(message=f'Unrecognized token "{raw_source[i]}" encountered at {lineInfo[0]}:{lineInfo[1]}').raise_err()
-            elif raw_source[i] == '.': 
-                is_float = True
-            num_str += raw_source[i]
-
-        self.tokens.add_token(Token(is_float and TOKEN_TYPE.FLOAT or TOKEN_TYPE.INTEGER, (is_float and float or int)(num_str)))
-        return i + 1
-
-    def handle_unrecognized(self, raw_source, i):
-        line_info = self.find_line_info(raw_source, i)
-        UnrecognizedTokenError(message=f'Unrecognized token "{raw_source[i]}" encountered at {line_info[0]}:{line_info[1]}').raise_err()
-        return i + 1
-    
-    def find_line_info(self, raw_source, index) -> tuple[int]:
+    def stream(self, source: str | bytes):
         """
-        Find the line number and column position for a given index in the source string.
+        Lazily tokenize a source, yielding each token as soon as it is matched.
+
+        Files are scanned through an mmap, so neither the source text nor the token list has
+        to be held in memory at once. The last token yielded is always END_OF_FILE.
+        self.line_index is replaced with an index over the new source, positions in tokens
+        and errors resolve against it.
 
-        :param raw_source: The complete source code as a string.
-        :param index: The index in the source code for which to find line and column.
-        :return: A tuple containing the line number and column position.
+        :param source: A path to a .pnda file, or the source code itself.
+        :return: A generator of Token objects.
         """
-        line_number = 1  # Lines start at 1
-        line_start = 0  # Index where the current line starts
-
-        for i, char in enumerate(raw_source):
-            if i == index:
-                column = index - line_start
-                return line_number, column + 1  # +1 since columns start at 1
-            elif char == '\n':
-                line_number += 1
-                line_start = i + 1  # The next line starts after the newline character
-
-        return -1, -1
+        self.line_index = LineIndex(source)
+        return self.scan_source(source)
+
+    def scan_source(self, source: str | bytes):
+        with SourceBuffer(source) as raw_source:
+            for type_code, start, end, value in self.scan(raw_source):
+                yield Token(TOKEN_TYPES_BY_CODE[type_code], value, start, end)
+
+            source_length = len(raw_source)
+
+        yield Token(TOKEN_TYPE.END_OF_FILE, start=source_length, end=source_length)
+
+    def scan(self, raw_source):
+        """
+        Match the tokens of a source.
+
+        :return: A generator of (type code, start, end, value) tuples, END_OF_FILE is left out.
+        """
+        fixed_tokens = self.fixed_tokens
+
+        # Every kind of token is handled right here, a call per token costs as much as its match
+        for match in self.master_pattern.finditer(raw_source):
+            kind = match.lastindex
+            if kind == FIXED_GROUP:
+                text = match[FIXED_GROUP]
+                type_code = fixed_tokens.get(text)
+                # Words that aren't keywords are identifiers
+                if type_code is None: yield IDENTIFIER, match.start(FIXED_GROUP), match.end(), text.decode('ascii')
+                else: yield type_code, match.start(FIXED_GROUP), match.end(), None
+            elif kind == STRING_GROUP:
+                # A backslash escapes whatever character follows it, the backslash itself is dropped
+                string = match[STRING_GROUP][1:-1]
+                if b'\\' in string: string = ESCAPE_SEQUENCE_PATTERN.sub(rb'\1', string)
+                yield CONST_STRING, match.start(STRING_GROUP), match.end(), string.decode('utf-8')
+            elif kind == NUMBER_GROUP:
+                num_str = match[NUMBER_GROUP].replace(b'_', b'')
+                if b'.' not in num_str:
+                    yield INTEGER, match.start(NUMBER_GROUP), match.end(), int(num_str)
+                    continue
+
+                # A second decimal point directly after a float can't start any other token
+                if raw_source[match.end():match.end() + 1] == b'.':
+                    UnrecognizedTokenError(message=f'Unrecognized token "." encountered at {self.line_index.format(match.end())}').raise_err()
+
+                yield FLOAT, match.start(NUMBER_GROUP), match.end(), float(num_str)
+            elif kind == END_GROUP:
+                break
+            else:
+                self.handle_unrecognized(match)
+
+    def handle_unrecognized(self, match):
+        text = match[UNRECOGNIZED_GROUP].decode('utf-8', errors='replace')
+        location = self.line_index.format(match.start(UNRECOGNIZED_GROUP))
+
+        if text in ["\"", "\'", "`"]:
+            UnrecognizedTokenError(message=f'Unterminated string starting at {location}').raise_err()
+        else:
+            UnrecognizedTokenError(message=f'Unrecognized token "{text}" encountered at {location}').raise_err()
@@ -1 +1,4 @@
-VERSION = "1.0.0"
\ No newline at end of file
+# Part of every build cache key and printed in the generated assembly, bump it with every change
+# to the code the compiler generates. The cache also keys on a hash of src/*.py, so a forgotten
+# bump can't hand back stale executables
+VERSION = "1.1.0"